@@ -7,8 +7,9 @@ from dotenv import load_dotenv
 from .models import db
 from .auth import auth_bp
 from .users import users_bp
-from .devices import devices_bp
-from .parkinson import parkinson_bp
+from .devices import devices_bp, sensor_data_cli, compactor
+from .parkinson import parkinson_bp, parkinson_cli, dose_cache, response_cache, daily_series
+from .metrics import metrics_bp
 # import your launcher
 from .websocket.server import launch_in_thread
 
@@ -21,6 +22,83 @@ def create_app(test_config=None):
             SECRET_KEY=os.getenv('SECRET_KEY', 'dev'),
             SQLALCHEMY_DATABASE_URI=os.getenv('DATABASE_URI', 'sqlite:///app.db'),
             SQLALCHEMY_TRACK_MODIFICATIONS=False,
+            # Write-behind ingest buffer for WebSocket sensor data
+            INGEST_BATCH_SIZE=int(os.getenv('INGEST_BATCH_SIZE', 500)),
+            INGEST_FLUSH_INTERVAL=float(os.getenv('INGEST_FLUSH_INTERVAL', 1.0)),
+            INGEST_MAX_UNFLUSHED_ROWS=int(os.getenv('INGEST_MAX_UNFLUSHED_ROWS', 5000)),
+            # Bound on queued rows and what to do when the database can't keep up:
+            # backpressure, drop_oldest or downsample (see websocket/overload.py)
+            INGEST_QUEUE_CAPACITY=int(os.getenv('INGEST_QUEUE_CAPACITY', 50000)),
+            INGEST_OVERLOAD_POLICY=os.getenv('INGEST_OVERLOAD_POLICY', 'backpressure'),
+            INGEST_DOWNSAMPLE_WATERMARK=float(os.getenv('INGEST_DOWNSAMPLE_WATERMARK', 0.5)),
+            # Write Device.last_seen at most once per this many seconds per device
+            DEVICE_LAST_SEEN_INTERVAL=float(os.getenv('DEVICE_LAST_SEEN_INTERVAL', 60)),
+            # Reload the device registry this often (0 = never); picks up device
+            # changes made by other processes
+            DEVICE_REGISTRY_REFRESH=float(os.getenv('DEVICE_REGISTRY_REFRESH', 60)),
+            # Set WS_IN_PROCESS=0 when ingest runs separately via run_ingest.py
+            WS_IN_PROCESS=os.getenv('WS_IN_PROCESS', '1') == '1',
+            # Live dashboard fan-out: per-device backlog size and per-subscriber queue bound
+            LIVE_RING_SIZE=int(os.getenv('LIVE_RING_SIZE', 500)),
+            LIVE_QUEUE_SIZE=int(os.getenv('LIVE_QUEUE_SIZE', 100)),
+            # Compute per-user per-minute ParkinsonMetric rows from the WebSocket stream;
+            # a minute is written GRACE seconds after the next one starts, or once it
+            # has had no data for IDLE_TIMEOUT seconds
+            SHAKE_INGEST_ENABLED=os.getenv('SHAKE_INGEST_ENABLED', '1') == '1',
+            SHAKE_INGEST_GRACE=float(os.getenv('SHAKE_INGEST_GRACE', 2.0)),
+            SHAKE_INGEST_IDLE_TIMEOUT=float(os.getenv('SHAKE_INGEST_IDLE_TIMEOUT', 65.0)),
+            # Streaming tremor-frequency analysis: window/hop in samples, band in Hz,
+            # rate assumed for frames without one (legacy single-sample frames)
+            TREMOR_ANALYSIS_ENABLED=os.getenv('TREMOR_ANALYSIS_ENABLED', '1') == '1',
+            TREMOR_WINDOW=int(os.getenv('TREMOR_WINDOW', 256)),
+            TREMOR_HOP=int(os.getenv('TREMOR_HOP', 64)),
+            TREMOR_BAND_LOW=float(os.getenv('TREMOR_BAND_LOW', 4.0)),
+            TREMOR_BAND_HIGH=float(os.getenv('TREMOR_BAND_HIGH', 6.0)),
+            TREMOR_DEFAULT_RATE=int(os.getenv('TREMOR_DEFAULT_RATE', 50)),
+            TREMOR_ANALYSIS_INTERVAL=float(os.getenv('TREMOR_ANALYSIS_INTERVAL', 0.5)),
+            # Raw sample storage: 'rows' (one SensorData row per sample) or 'chunks'
+            # (compressed SensorChunk blocks of SENSOR_CHUNK_SECONDS per device)
+            SENSOR_STORAGE=os.getenv('SENSOR_STORAGE', 'rows'),
+            SENSOR_CHUNK_SECONDS=int(os.getenv('SENSOR_CHUNK_SECONDS', 60)),
+            # Raw samples older than SENSOR_RETENTION_HOURS are replaced by per-device
+            # mean/min/max/RMS summaries over SENSOR_SUMMARY_SECONDS, deleted in batches
+            # of SENSOR_COMPACT_BATCH rows; SENSOR_COMPACT_INTERVAL > 0 runs it every that
+            # many seconds in the API process (use cron with several API processes)
+            SENSOR_RETENTION_HOURS=float(os.getenv('SENSOR_RETENTION_HOURS', 168)),
+            SENSOR_SUMMARY_SECONDS=int(os.getenv('SENSOR_SUMMARY_SECONDS', 60)),
+            SENSOR_COMPACT_BATCH=int(os.getenv('SENSOR_COMPACT_BATCH', 5000)),
+            SENSOR_COMPACT_PAUSE=float(os.getenv('SENSOR_COMPACT_PAUSE', 0.05)),
+            SENSOR_COMPACT_INTERVAL=float(os.getenv('SENSOR_COMPACT_INTERVAL', 0)),
+            # Samples per record batch (and Parquet row group) in bulk exports
+            SENSOR_EXPORT_BATCH=int(os.getenv('SENSOR_EXPORT_BATCH', 50000)),
+            # Keyset page size behind streamed (?stream=ndjson|json) sensor-data responses
+            SENSOR_STREAM_PAGE=int(os.getenv('SENSOR_STREAM_PAGE', 1000)),
+            # Upper bound on samples accepted by one /parkinson/log-batch request
+            PARKINSON_BATCH_MAX_SAMPLES=int(os.getenv('PARKINSON_BATCH_MAX_SAMPLES', 500000)),
+            # Medication-response results are cached per dose once the after-window
+            # closed this long ago; MEDICATION_RESPONSE_CACHE_SIZE bounds the cache
+            MEDICATION_RESPONSE_SETTLE_MINUTES=float(os.getenv('MEDICATION_RESPONSE_SETTLE_MINUTES', 10)),
+            MEDICATION_RESPONSE_CACHE_SIZE=int(os.getenv('MEDICATION_RESPONSE_CACHE_SIZE', 100000)),
+            # Cache of Parkinson analytics responses, invalidated per user on writes;
+            # backend is 'memory', a redis:// URL or 'module:factory'
+            RESPONSE_CACHE_ENABLED=os.getenv('RESPONSE_CACHE_ENABLED', '1') == '1',
+            RESPONSE_CACHE_BACKEND=os.getenv('RESPONSE_CACHE_BACKEND', 'memory'),
+            RESPONSE_CACHE_SIZE=int(os.getenv('RESPONSE_CACHE_SIZE', 2000)),
+            RESPONSE_CACHE_TTL=float(os.getenv('RESPONSE_CACHE_TTL', 300)),
+            # Users whose completed daily shake series (LSTM input) are kept in memory;
+            # a day is complete this long after it ends, and a series is reloaded in
+            # full after DAILY_SERIES_TTL seconds to see writes from other processes
+            DAILY_SERIES_CACHE_SIZE=int(os.getenv('DAILY_SERIES_CACHE_SIZE', 1000)),
+            DAILY_SERIES_SETTLE_MINUTES=float(os.getenv('DAILY_SERIES_SETTLE_MINUTES', 15)),
+            DAILY_SERIES_TTL=float(os.getenv('DAILY_SERIES_TTL', 3600)),
+            # Append-only ingest journal: devices are acked once samples are in the
+            # journal and a consumer thread loads it into the database ('' = off)
+            INGEST_JOURNAL_DIR=os.getenv('INGEST_JOURNAL_DIR', ''),
+            INGEST_JOURNAL_SEGMENT_MB=float(os.getenv('INGEST_JOURNAL_SEGMENT_MB', 64)),
+            INGEST_JOURNAL_SYNC=os.getenv('INGEST_JOURNAL_SYNC', '0') == '1',
+            INGEST_JOURNAL_BATCH=int(os.getenv('INGEST_JOURNAL_BATCH', 20000)),
+            # Standalone ingest workers serve /metrics on this port + worker index (0 = off)
+            INGEST_METRICS_PORT=int(os.getenv('INGEST_METRICS_PORT', 0)),
         )
     else:
         app.config.from_mapping(test_config)
@@ -38,14 +116,28 @@ def create_app(test_config=None):
     app.register_blueprint(users_bp)
     app.register_blueprint(devices_bp)
     app.register_blueprint(parkinson_bp)
+    app.register_blueprint(metrics_bp)
+    app.cli.add_command(sensor_data_cli)
+    app.cli.add_command(parkinson_cli)
     
     @app.route('/')
     def index():
         return {'message': 'API is working!'}, 200
 
-    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and not test_config:
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and not test_config \
+            and app.config.get('WS_IN_PROCESS', True):
         from .websocket.server import launch_in_thread
         launch_in_thread(app)
 
+    dose_cache.init_app(app)
+    response_cache.init_app(app)
+    daily_series.init_app(app)
+
+    if app.config.get('SENSOR_COMPACT_INTERVAL') and not app.testing:
+        compactor.init_app(app)
+        # Started by the first request, so only a process that serves the API
+        # runs it: not the reloader's watcher, CLI commands or ingest workers
+        app.before_request(compactor.start)
+
     return app
 
@@ -3,5 +3,7 @@ from flask import Blueprint
 
 # Create a Blueprint for device routes
 from .routes import devices_bp
+from .commands import sensor_data_cli
+from .retention import compactor
 
 # Import routes is done in routes.py to avoid circular imports
\ No newline at end of file
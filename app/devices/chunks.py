@@ -0,0 +1,480 @@
+"""
+Columnar chunk storage for raw sensor samples.
+
+With ``SENSOR_STORAGE=chunks`` the ingest buffer writes one SensorChunk row
+per device per chunk period (``SENSOR_CHUNK_SECONDS``, one minute by
+default) instead of one SensorData row per sample. A chunk's ``data`` is
+
+    1 byte  format version (1)
+    zlib(   int32 timestamp deltas in microseconds, the first one relative
+            to the chunk's start_time, then one float32 array per column in
+            CHUNK_COLUMNS order; missing values are NaN )
+
+Samples are sorted by time inside a chunk, so regular sampling turns the
+delta column into a run of identical values that compresses to almost
+nothing. Each flush writes what has arrived so far, so a period's samples
+first land in several partial chunks (readers merge them by timestamp).
+The ingest buffer merges them into one chunk once the period is over;
+``flask sensor-data pack`` merges any that are left, e.g. after a restart.
+"""
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import select, delete, func, and_, or_
+
+from ..models.models import db, SensorData, SensorChunk
+
+CHUNK_VERSION = 1
+CHUNK_COLUMNS = ('accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z', 'battery_level')
+# Decoded samples: 't' is microseconds since the Unix epoch
+CHUNK_DTYPE = np.dtype([('t', '<i8')] + [(name, '<f4') for name in CHUNK_COLUMNS])
+# Query results: 'id' is the SensorData row id, 0 for chunked samples;
+# 'chunk'/'pos' are the SensorChunk id and index in it, 0 for rows. Samples
+# are ordered by (t, id, chunk, pos), so chunked samples with equal
+# timestamps still have a definite order for keyset cursors.
+SAMPLE_COLUMNS_DTYPE = np.dtype([('id', '<i8'), ('chunk', '<i8'), ('pos', '<i4'), ('t', '<i8')]
+                                + [(name, '<f8') for name in CHUNK_COLUMNS])
+
+_EPOCH = np.datetime64(0, 'us')
+# Timestamp deltas are int32 microseconds, so a chunk period can't be longer
+MAX_CHUNK_SECONDS = (2 ** 31 - 1) // 1_000_000
+
+
+def check_chunk_seconds(chunk_seconds):
+    """
+    Raise ValueError unless ``chunk_seconds`` is a usable chunk period.
+    """
+    if not 0 < chunk_seconds <= MAX_CHUNK_SECONDS:
+        raise ValueError(f"SENSOR_CHUNK_SECONDS must be between 1 and {MAX_CHUNK_SECONDS}, got {chunk_seconds}")
+
+
+def _to_us(values):
+    return np.array(values, dtype='datetime64[us]').astype(np.int64)
+
+
+def encode_chunk(start_us, times_us, columns):
+    """
+    Pack sorted sample times (int64 us) and a dict of column arrays into a
+    chunk blob.
+    """
+    deltas = np.diff(times_us, prepend=start_us).astype('<i4')
+    parts = [deltas.tobytes()]
+    parts.extend(np.asarray(columns[name], dtype='<f4').tobytes() for name in CHUNK_COLUMNS)
+    return bytes([CHUNK_VERSION]) + zlib.compress(b''.join(parts))
+
+
+def decode_chunk(start_time, count, blob):
+    """
+    Unpack a chunk blob into a CHUNK_DTYPE array.
+    """
+    if blob[0] != CHUNK_VERSION:
+        raise ValueError(f"Unsupported sensor chunk version: {blob[0]}")
+    raw = zlib.decompress(blob[1:])
+    samples = np.empty(count, dtype=CHUNK_DTYPE)
+    deltas = np.frombuffer(raw, dtype='<i4', count=count)
+    samples['t'] = np.cumsum(deltas, dtype=np.int64) + _to_us(start_time)
+    offset = deltas.nbytes
+    for name in CHUNK_COLUMNS:
+        samples[name] = np.frombuffer(raw, dtype='<f4', count=count, offset=offset)
+        offset += count * 4
+    return samples
+
+
+def pack_rows(device_id, rows, chunk_seconds=60):
+    """
+    Turn SensorData column dicts of one device into SensorChunk insert dicts,
+    one per chunk period touched.
+    """
+    if not rows:
+        return []
+    times_us = _to_us([row['timestamp'] for row in rows])
+    columns = {
+        name: np.array([row.get(name) for row in rows], dtype=np.float64)
+        for name in CHUNK_COLUMNS
+    }
+    return pack_columns(device_id, times_us, columns, chunk_seconds)
+
+
+def pack_columns(device_id, times_us, columns, chunk_seconds=60):
+    """
+    Like pack_rows, for samples that are already column arrays.
+    """
+    check_chunk_seconds(chunk_seconds)
+    order = np.argsort(times_us, kind='stable')
+    times_us = times_us[order]
+    columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+
+    period_us = int(chunk_seconds * 1e6)
+    periods = times_us // period_us
+    bounds = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1], True])
+    chunks = []
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        start_us = int(periods[lo]) * period_us
+        chunks.append({
+            'device_id': device_id,
+            'start_time': (_EPOCH + np.timedelta64(start_us, 'us')).item(),
+            'end_time': (_EPOCH + np.timedelta64(int(times_us[hi - 1]), 'us')).item(),
+            'sample_count': hi - lo,
+            'data': encode_chunk(start_us, times_us[lo:hi],
+                                 {name: values[lo:hi] for name, values in columns.items()}),
+        })
+    return chunks
+
+
+def sample_dicts(device_id, samples):
+    """
+    Samples (CHUNK_DTYPE, or SAMPLE_COLUMNS_DTYPE with row ids) as
+    SensorData.to_dict()-shaped dicts. Chunked samples have no row id.
+    """
+    columns = {name: samples[name].astype(np.float64) for name in CHUNK_COLUMNS}
+    times = (samples['t'].astype('datetime64[us]')).tolist()
+    ids = samples['id'].tolist() if 'id' in samples.dtype.names else [0] * len(samples)
+    result = []
+    for i, ts in enumerate(times):
+        item = {'id': ids[i] or None, 'device_id': device_id, 'timestamp': ts.isoformat()}
+        for name in CHUNK_COLUMNS:
+            value = columns[name][i]
+            item[name] = None if value != value else float(value)
+        result.append(item)
+    return result
+
+
+def query_sample_columns(device_id, limit, offset=0, start=None, end=None,
+                         before=None, after=None, chunk_seconds=60):
+    """
+    A page of a device's samples from both SensorData rows and SensorChunk
+    blocks, as one SAMPLE_COLUMNS_DTYPE array in page order.
+
+    ``start``/``end`` bound the time range (start inclusive, end exclusive).
+    ``before``/``after`` are keyset cursors as returned by ``parse_cursor``
+    (see ``sample_cursor``): ``before`` pages go newest first and
+    only return samples older than the cursor, ``after`` pages go oldest
+    first and only return newer ones. Both seek through the (device_id,
+    timestamp) indexes, so a page costs the same at any depth; ``offset``
+    is still accepted but gets slower the larger it is.
+    """
+    need = limit + offset
+    if need <= 0:
+        return np.empty(0, dtype=SAMPLE_COLUMNS_DTYPE)
+    ascending = after is not None and before is None
+
+    table = SensorData.__table__
+    query = select(table.c.id, table.c.timestamp, *(table.c[name] for name in CHUNK_COLUMNS)) \
+        .where(table.c.device_id == device_id)
+    if start is not None:
+        query = query.where(table.c.timestamp >= start)
+    if end is not None:
+        query = query.where(table.c.timestamp < end)
+    if after is not None:
+        query = query.where(_after(table, *after))
+    if before is not None:
+        query = query.where(_before(table, *before))
+    if ascending:
+        query = query.order_by(table.c.timestamp, table.c.id)
+    else:
+        query = query.order_by(table.c.timestamp.desc(), table.c.id.desc())
+    rows = db.session.execute(query.limit(need)).all()
+
+    decoded = _chunk_samples(device_id, need, ascending, start, end, before, after, chunk_seconds)
+
+    # Straight from result tuples into columns, no per-row dicts
+    samples = np.zeros(len(rows) + len(decoded), dtype=SAMPLE_COLUMNS_DTYPE)
+    if rows:
+        columns = list(zip(*rows))
+        samples['id'][:len(rows)] = columns[0]
+        samples['t'][:len(rows)] = _to_us(columns[1])
+        for index, name in enumerate(CHUNK_COLUMNS, start=2):
+            samples[name][:len(rows)] = np.array(columns[index], dtype=np.float64)
+    for name in ('chunk', 'pos', 't') + CHUNK_COLUMNS:
+        samples[name][len(rows):] = decoded[name]
+
+    order = np.lexsort((samples['pos'], samples['chunk'], samples['id'], samples['t']))
+    if not ascending:
+        order = order[::-1]
+    return samples[order[offset:need]]
+
+
+def query_samples(device_id, limit, offset=0, start=None, end=None,
+                  before=None, after=None, chunk_seconds=60):
+    """
+    Like query_sample_columns, as SensorData.to_dict()-shaped dicts.
+    """
+    samples = query_sample_columns(device_id, limit, offset, start, end, before, after, chunk_seconds)
+    return sample_dicts(device_id, samples)
+
+
+def iter_samples(device_id, limit=None, offset=0, start=None, end=None,
+                 before=None, after=None, chunk_seconds=60, page_size=1000):
+    """
+    Like query_samples, as a generator over any number of samples: it
+    fetches keyset pages of ``page_size`` one after the other, so memory
+    stays at one page however many samples there are. ``limit=None``
+    means no limit.
+    """
+    ascending = after is not None and before is None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page = query_sample_columns(device_id, size, offset, start, end, before, after, chunk_seconds)
+        yield from sample_dicts(device_id, page)
+        if len(page) < size:
+            return
+        if remaining is not None:
+            remaining -= len(page)
+        offset = 0
+        # Continue right after the page's last sample, by its exact position
+        cursor = sample_position(page[-1])
+        if ascending:
+            after = cursor
+        else:
+            before = cursor
+
+
+def sample_cursor(sample):
+    """
+    Cursor for ``before``/``after`` pointing at one SAMPLE_COLUMNS_DTYPE
+    sample: its timestamp plus ``~<row id>`` for a row, or
+    ``~c<chunk id>.<index>`` for a chunked sample.
+    """
+    timestamp = sample['t'].astype('datetime64[us]').item().isoformat()
+    if sample['id']:
+        return f"{timestamp}~{int(sample['id'])}"
+    return f"{timestamp}~c{int(sample['chunk'])}.{int(sample['pos'])}"
+
+
+def sample_position(sample):
+    """
+    Keyset position of one SAMPLE_COLUMNS_DTYPE sample, in the form
+    parse_cursor returns.
+    """
+    timestamp = sample['t'].astype('datetime64[us]').item()
+    if sample['id']:
+        return timestamp, int(sample['id']), None
+    return timestamp, None, (int(sample['chunk']), int(sample['pos']))
+
+
+def parse_cursor(value):
+    """
+    Inverse of sample_cursor, as ``(timestamp, row id or None, (chunk id,
+    index) or None)``; a bare ISO 8601 timestamp is accepted too and
+    matches on time alone. Raises ValueError on anything else.
+    """
+    timestamp, _, position = value.partition('~')
+    if position.startswith('c'):
+        chunk, _, index = position[1:].partition('.')
+        return parse_timestamp(timestamp), None, (int(chunk), int(index))
+    return parse_timestamp(timestamp), int(position) if position else None, None
+
+
+def parse_timestamp(value):
+    """
+    Naive UTC datetime from an ISO 8601 string, with or without 'Z'.
+    """
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _row_bound(row_id, chunk):
+    # Rows sort after chunked samples with the same timestamp, so a chunk
+    # position compares like row id 0
+    return 0 if chunk is not None else row_id
+
+
+def _before(table, timestamp, row_id, chunk=None):
+    row_id = _row_bound(row_id, chunk)
+    if row_id is None:
+        return table.c.timestamp < timestamp
+    return or_(table.c.timestamp < timestamp,
+               and_(table.c.timestamp == timestamp, table.c.id < row_id))
+
+
+def _after(table, timestamp, row_id, chunk=None):
+    row_id = _row_bound(row_id, chunk)
+    if row_id is None:
+        return table.c.timestamp > timestamp
+    return or_(table.c.timestamp > timestamp,
+               and_(table.c.timestamp == timestamp, table.c.id > row_id))
+
+
+def _chunk_keep(samples, cursor, newer):
+    """
+    Mask of chunked samples (SAMPLE_COLUMNS_DTYPE) on the ``newer`` (or
+    older) side of a keyset cursor, in (t, id, chunk, pos) order.
+    """
+    timestamp, row_id, chunk = cursor
+    t = samples['t']
+    bound = _to_us(timestamp)
+    beyond = t > bound if newer else t < bound
+    if chunk is not None:
+        # Same timestamp: compare positions among chunked samples
+        chunk_id, index = chunk
+        if newer:
+            position = (samples['chunk'] > chunk_id) | ((samples['chunk'] == chunk_id) & (samples['pos'] > index))
+        else:
+            position = (samples['chunk'] < chunk_id) | ((samples['chunk'] == chunk_id) & (samples['pos'] < index))
+        return beyond | ((t == bound) & position)
+    if row_id is not None and not newer:
+        # Chunked samples come before any row with the same timestamp
+        return beyond | (t == bound)
+    return beyond
+
+
+def _chunk_samples(device_id, need, ascending, start, end, before, after, chunk_seconds):
+    """
+    Decode just enough chunks to fill a page, as SAMPLE_COLUMNS_DTYPE in
+    page order. A chunk never spans more than one chunk period, which
+    turns the time bounds into index range scans on start_time
+    (ascending) or end_time (descending).
+    """
+    period = timedelta(seconds=chunk_seconds)
+    low = max((t for t in (start, after and after[0]) if t is not None), default=None)
+    high = min((t for t in (end, before and before[0]) if t is not None), default=None)
+
+    query = select(SensorChunk.id, SensorChunk.start_time, SensorChunk.end_time,
+                   SensorChunk.sample_count, SensorChunk.data) \
+        .where(SensorChunk.device_id == device_id)
+    if low is not None:
+        query = query.where(SensorChunk.end_time >= low, SensorChunk.start_time > low - period)
+    if high is not None:
+        query = query.where(SensorChunk.start_time <= high, SensorChunk.end_time < high + period)
+    if ascending:
+        query = query.order_by(SensorChunk.start_time, SensorChunk.id)
+    else:
+        query = query.order_by(SensorChunk.end_time.desc(), SensorChunk.id.desc())
+
+    decoded = np.empty(0, dtype=SAMPLE_COLUMNS_DTYPE)
+    chunks = db.session.execute(query.execution_options(yield_per=16))
+    for chunk_id, start_time, end_time, count, blob in chunks:
+        # Stop once every remaining chunk lies beyond the last sample we keep
+        if len(decoded) >= need:
+            if ascending and _to_us(start_time) > decoded['t'][-1]:
+                break
+            if not ascending and _to_us(end_time) < decoded['t'][-1]:
+                break
+        raw = decode_chunk(start_time, count, blob)
+        samples = np.zeros(count, dtype=SAMPLE_COLUMNS_DTYPE)
+        samples['chunk'] = chunk_id
+        samples['pos'] = np.arange(count)
+        for name in ('t',) + CHUNK_COLUMNS:
+            samples[name] = raw[name]
+        if start is not None:
+            samples = samples[samples['t'] >= _to_us(start)]
+        if end is not None:
+            samples = samples[samples['t'] < _to_us(end)]
+        if after is not None:
+            samples = samples[_chunk_keep(samples, after, newer=True)]
+        if before is not None:
+            samples = samples[_chunk_keep(samples, before, newer=False)]
+        decoded = np.concatenate((decoded, samples))
+        order = np.lexsort((decoded['pos'], decoded['chunk'], decoded['t']))
+        if not ascending:
+            order = order[::-1]
+        decoded = decoded[order][:need]
+    chunks.close()
+    return decoded
+
+
+def migrate_rows(device_id=None, batch_size=50000, chunk_seconds=60, log=print):
+    """
+    Move existing SensorData rows into SensorChunk blocks, one batch per
+    transaction so an interrupted run can simply be restarted. Returns the
+    number of rows moved.
+    """
+    table = SensorData.__table__
+    if device_id:
+        device_ids = [device_id]
+    else:
+        device_ids = db.session.execute(select(table.c.device_id).distinct()).scalars().all()
+
+    moved = 0
+    for current in device_ids:
+        while True:
+            batch = db.session.execute(
+                select(table)
+                .where(table.c.device_id == current)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).mappings().all()
+            if not batch:
+                break
+            chunks = pack_rows(current, batch, chunk_seconds)
+            db.session.execute(SensorChunk.__table__.insert(), chunks)
+            db.session.execute(
+                delete(table)
+                .where(table.c.device_id == current)
+                .where(table.c.id <= batch[-1]['id'])
+            )
+            db.session.commit()
+            moved += len(batch)
+            log(f"{current}: packed {len(batch)} rows into {len(chunks)} chunks")
+    return moved
+
+
+def merge_period(device_id, start_time, chunk_seconds=60):
+    """
+    Replace a device's chunks for the period starting at ``start_time``
+    with a single chunk. Returns the number of chunks merged away: 0 if
+    there was at most one, or if another process merged them first.
+    """
+    table = SensorChunk.__table__
+    found = db.session.execute(
+        select(table.c.id, table.c.start_time, table.c.sample_count, table.c.data)
+        .where(table.c.device_id == device_id, table.c.start_time == start_time)
+        .order_by(table.c.id)
+    ).all()
+    if len(found) < 2:
+        return 0
+    # In chunk id order, so equal timestamps keep their order
+    samples = np.concatenate([decode_chunk(start, count, blob) for _, start, count, blob in found])
+    merged = pack_columns(device_id, samples['t'], {name: samples[name] for name in CHUNK_COLUMNS},
+                          chunk_seconds)
+    deleted = db.session.execute(delete(table).where(table.c.id.in_([row.id for row in found]))).rowcount
+    if deleted != len(found):
+        db.session.rollback()
+        return 0
+    db.session.execute(table.insert(), merged)
+    db.session.commit()
+    return len(found) - len(merged)
+
+
+def repack_chunks(device_id=None, before=None, chunk_seconds=60, log=print):
+    """
+    Merge every period that has more than one chunk into a single chunk,
+    one period per transaction; with ``before`` given, only periods over by
+    then. Returns the number of chunks merged away.
+    """
+    table = SensorChunk.__table__
+    query = select(table.c.device_id, table.c.start_time) \
+        .group_by(table.c.device_id, table.c.start_time) \
+        .having(func.count(table.c.id) > 1)
+    if device_id:
+        query = query.where(table.c.device_id == device_id)
+    if before is not None:
+        query = query.where(table.c.start_time <= before - timedelta(seconds=chunk_seconds))
+
+    removed = 0
+    for current, start_time in db.session.execute(query).all():
+        count = merge_period(current, start_time, chunk_seconds)
+        if count:
+            log(f"{current}: merged {count + 1} chunks starting {start_time}")
+        removed += count
+    return removed
+
+
+def storage_stats():
+    """
+    Row/sample counts and bytes used by chunked storage.
+    """
+    chunks, samples, size = db.session.execute(
+        select(func.count(SensorChunk.id), func.sum(SensorChunk.sample_count),
+               func.sum(func.length(SensorChunk.data)))
+    ).one()
+    return {
+        'sensor_rows': db.session.execute(select(func.count(SensorData.id))).scalar(),
+        'chunks': chunks,
+        'chunked_samples': samples or 0,
+        'chunk_bytes': size or 0,
+    }
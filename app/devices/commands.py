@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from ..models.models import Device
+from .chunks import migrate_rows, repack_chunks, parse_timestamp, storage_stats
+from .export import EXPORT_FORMATS, write_export
+from .retention import compactor
+
+sensor_data_cli = AppGroup('sensor-data', help='Raw sensor data storage maintenance.')
+
+
+@sensor_data_cli.command('pack')
+@click.option('--device', 'device_id', default=None, help='Only pack this device.')
+@click.option('--batch-size', default=50000, show_default=True, help='Rows moved per transaction.')
+def pack_command(device_id, batch_size):
+    """Move SensorData rows into compressed SensorChunk blocks and merge partial chunks."""
+    chunk_seconds = current_app.config.get('SENSOR_CHUNK_SECONDS', 60)
+    moved = migrate_rows(device_id, batch_size, chunk_seconds, log=click.echo)
+    click.echo(f"Packed {moved} rows")
+    # Periods still being written to are left to the ingest buffer
+    merged = repack_chunks(device_id, datetime.utcnow(), chunk_seconds, log=click.echo)
+    click.echo(f"Merged away {merged} partial chunks")
+
+
+@sensor_data_cli.command('stats')
+def stats_command():
+    """Show how much raw data is stored as rows and as chunks."""
+    for key, value in storage_stats().items():
+        click.echo(f"{key}: {value}")
+
+
+@sensor_data_cli.command('compact')
+@click.option('--vacuum', is_flag=True, help='Shrink the SQLite file afterwards (locks the database).')
+def compact_command(vacuum):
+    """Replace raw samples older than the retention window with summaries."""
+    compactor.init_app(current_app)
+    report = compactor.compact(log=click.echo)
+    if vacuum and compactor.vacuum():
+        click.echo("Vacuumed database")
+    for key, value in report.items():
+        click.echo(f"{key}: {value}")
+
+
+@sensor_data_cli.command('export')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--device', 'device_id', default=None, help='Export this device.')
+@click.option('--user', 'user_id', default=None, help='Export all devices of this user.')
+@click.option('--start', default=None, help='ISO 8601 start time (inclusive).')
+@click.option('--end', default=None, help='ISO 8601 end time (exclusive).')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='parquet', show_default=True)
+@click.option('--batch-size', default=None, type=int, help='Samples per record batch.')
+def export_command(output, device_id, user_id, start, end, fmt, batch_size):
+    """Write a device's or user's raw samples to an Arrow IPC or Parquet file."""
+    if bool(device_id) == bool(user_id):
+        raise click.UsageError("Pass exactly one of --device or --user")
+    try:
+        start = parse_timestamp(start) if start else None
+        end = parse_timestamp(end) if end else None
+    except ValueError as e:
+        raise click.BadParameter(f"Invalid time: {e}")
+    if device_id:
+        device_ids = [device_id]
+    else:
+        device_ids = [device.id for device in Device.query.filter_by(user_id=user_id).order_by(Device.id)]
+    batch_size = batch_size or current_app.config.get('SENSOR_EXPORT_BATCH', 50000)
+
+    total = 0
+    try:
+        for total in write_export(output, device_ids, fmt, start, end, batch_size):
+            click.echo(f"Exported {total} samples", err=True)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Wrote {total} samples to {output}")
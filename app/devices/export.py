@@ -0,0 +1,244 @@
+"""
+Streaming bulk export of raw sensor samples as Arrow IPC or Parquet.
+
+Samples are read in time order from both SensorData rows and SensorChunk
+blocks, ``batch_rows`` at a time (server-side cursors on backends that
+have them), merged, and written as one columnar record batch per step, so
+memory stays bounded by the batch size however long the time range is.
+pyarrow is optional; without it the export endpoints and command report
+that it is missing.
+"""
+import numpy as np
+from sqlalchemy import select
+
+from ..models.models import db, SensorData, SensorChunk
+from .chunks import CHUNK_COLUMNS, decode_chunk, _to_us
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pq = None
+
+EXPORT_AVAILABLE = pa is not None
+
+EXPORT_FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+# Exported samples: 't' is microseconds since the Unix epoch. Rows are
+# stored as doubles, so keep them that way here (chunks widen losslessly)
+EXPORT_DTYPE = np.dtype([('t', '<i8')] + [(name, '<f8') for name in CHUNK_COLUMNS])
+
+
+def export_schema():
+    return pa.schema(
+        [pa.field('device_id', pa.string(), nullable=False),
+         pa.field('timestamp', pa.timestamp('us', tz='UTC'), nullable=False)]
+        + [pa.field(name, pa.float64()) for name in CHUNK_COLUMNS]
+    )
+
+
+def _row_batches(device_id, start, end, batch_rows):
+    table = SensorData.__table__
+    query = select(table.c.timestamp, *(table.c[name] for name in CHUNK_COLUMNS)) \
+        .where(table.c.device_id == device_id)
+    if start is not None:
+        query = query.where(table.c.timestamp >= start)
+    if end is not None:
+        query = query.where(table.c.timestamp < end)
+    query = query.order_by(table.c.timestamp, table.c.id).execution_options(yield_per=batch_rows)
+
+    result = db.session.execute(query)
+    try:
+        for rows in result.partitions():
+            samples = np.empty(len(rows), dtype=EXPORT_DTYPE)
+            samples['t'] = _to_us([row[0] for row in rows])
+            for index, name in enumerate(CHUNK_COLUMNS, start=1):
+                samples[name] = np.array([row[index] for row in rows], dtype=np.float64)
+            yield samples
+    finally:
+        result.close()
+
+
+def _chunk_batches(device_id, start, end, batch_rows):
+    """
+    Decoded chunk samples in time order. Chunks of the same period can
+    overlap (partial flushes), but never reach back before their own
+    start_time, so everything older than the next chunk's start is final.
+    """
+    query = select(SensorChunk.start_time, SensorChunk.sample_count, SensorChunk.data) \
+        .where(SensorChunk.device_id == device_id)
+    if start is not None:
+        query = query.where(SensorChunk.end_time >= start)
+    if end is not None:
+        query = query.where(SensorChunk.start_time < end)
+    query = query.order_by(SensorChunk.start_time).execution_options(yield_per=16)
+
+    pending = []
+    count = 0
+    result = db.session.execute(query)
+    try:
+        for start_time, sample_count, blob in result:
+            if count >= batch_rows:
+                merged = np.sort(np.concatenate(pending), order='t', kind='stable')
+                cut = np.searchsorted(merged['t'], _to_us(start_time))
+                if cut:
+                    yield merged[:cut]
+                pending, count = [merged[cut:]], len(merged) - cut
+            decoded = decode_chunk(start_time, sample_count, blob)
+            if start is not None:
+                decoded = decoded[decoded['t'] >= _to_us(start)]
+            if end is not None:
+                decoded = decoded[decoded['t'] < _to_us(end)]
+            samples = np.empty(len(decoded), dtype=EXPORT_DTYPE)
+            for name in EXPORT_DTYPE.names:
+                samples[name] = decoded[name]
+            pending.append(samples)
+            count += len(samples)
+    finally:
+        result.close()
+    if count:
+        yield np.sort(np.concatenate(pending), order='t', kind='stable')
+
+
+def _merge_batches(left, right):
+    """
+    Merge two iterators of time-sorted sample arrays into one, holding at
+    most about one batch from each.
+    """
+    a = next(left, None)
+    b = next(right, None)
+    while a is not None and b is not None:
+        # Everything up to the smaller of the two last timestamps is final
+        cut = min(a['t'][-1], b['t'][-1]) if len(a) and len(b) else None
+        if cut is None:
+            a_cut = b_cut = 0
+        else:
+            a_cut = np.searchsorted(a['t'], cut, side='right')
+            b_cut = np.searchsorted(b['t'], cut, side='right')
+            out = np.concatenate((a[:a_cut], b[:b_cut]))
+            yield np.sort(out, order='t', kind='stable')
+        a, b = a[a_cut:], b[b_cut:]
+        if not len(a):
+            a = next(left, None)
+        if not len(b):
+            b = next(right, None)
+    for rest, source in ((a, left), (b, right)):
+        while rest is not None:
+            if len(rest):
+                yield rest
+            rest = next(source, None)
+
+
+def sample_batches(device_id, start=None, end=None, batch_rows=50000):
+    """
+    A device's samples in time order, as EXPORT_DTYPE arrays of up to
+    about ``batch_rows`` samples. ``start`` is inclusive, ``end`` exclusive.
+    """
+    pending = []
+    count = 0
+    for samples in _merge_batches(_row_batches(device_id, start, end, batch_rows),
+                                  _chunk_batches(device_id, start, end, batch_rows)):
+        pending.append(samples)
+        count += len(samples)
+        if count >= batch_rows:
+            merged = np.concatenate(pending)
+            for lo in range(0, len(merged) - batch_rows + 1, batch_rows):
+                yield merged[lo:lo + batch_rows]
+            tail = merged[len(merged) - len(merged) % batch_rows:]
+            pending, count = [tail], len(tail)
+    if count:
+        yield np.concatenate(pending)
+
+
+def record_batch(device_id, samples):
+    """
+    One EXPORT_DTYPE array as a pyarrow RecordBatch; NaN becomes null.
+    """
+    arrays = [
+        pa.array([device_id] * len(samples), type=pa.string()),
+        pa.array(samples['t'], type=pa.timestamp('us', tz='UTC')),
+    ]
+    for name in CHUNK_COLUMNS:
+        values = np.ascontiguousarray(samples[name])
+        arrays.append(pa.array(values, mask=np.isnan(values), type=pa.float64()))
+    return pa.RecordBatch.from_arrays(arrays, schema=export_schema())
+
+
+def write_export(sink, device_ids, fmt='parquet', start=None, end=None, batch_rows=50000):
+    """
+    Write the samples of ``device_ids`` (one after the other, each in time
+    order) to ``sink``, a path or writable file object. A generator: yields
+    the running sample count after each record batch has been written, so
+    callers can hand on the bytes written so far. Must run inside an app
+    context.
+    """
+    if not EXPORT_AVAILABLE:
+        raise RuntimeError("Sensor data export needs pyarrow installed")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    schema = export_schema()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    total = 0
+    try:
+        for device_id in device_ids:
+            for samples in sample_batches(device_id, start, end, batch_rows):
+                if fmt == 'parquet':
+                    writer.write_batch(record_batch(device_id, samples), row_group_size=batch_rows)
+                else:
+                    writer.write_batch(record_batch(device_id, samples))
+                total += len(samples)
+                yield total
+    finally:
+        writer.close()
+
+
+class ChunkedSink:
+    """
+    Minimal writable file object that collects what pyarrow writes until
+    ``take`` hands it to a streaming HTTP response.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_export(device_ids, fmt='parquet', start=None, end=None, batch_rows=50000):
+    """
+    Like write_export, as a generator of bytes for a streaming response.
+    """
+    sink = ChunkedSink()
+    for _ in write_export(pa.PythonFile(sink, mode='w'), device_ids, fmt, start, end, batch_rows):
+        data = sink.take()
+        if data:
+            yield data
+    data = sink.take()
+    if data:
+        yield data
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import namedtuple
+
+from ..models.models import Device
+
+DeviceInfo = namedtuple('DeviceInfo', ['id', 'user_id', 'device_type', 'name', 'auto_created'])
+
+
+def device_info(device):
+    """
+    Snapshot the fields the ingest path needs from a Device row.
+    """
+    return DeviceInfo(device.id, device.user_id, device.device_type, device.name, bool(device.auto_created))
+
+
+class DeviceRegistry:
+    """
+    Process-local map of device UUID -> DeviceInfo.
+
+    Loaded once at startup and kept current by the device CRUD endpoints, so
+    a known device costs no queries on the ingest path. It also rate-limits
+    ``last_seen`` writes: ``should_touch`` says yes at most once per
+    ``last_seen_interval`` seconds for each device.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.last_seen_interval = 60.0
+        self._devices = {}
+        self._touched = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.last_seen_interval = app.config.get('DEVICE_LAST_SEEN_INTERVAL', self.last_seen_interval)
+
+    def load(self):
+        """
+        (Re)load every device from the database.
+        """
+        with self.app.app_context():
+            rows = Device.query.with_entities(
+                Device.id, Device.user_id, Device.device_type, Device.name, Device.auto_created
+            ).all()
+        devices = {row.id: DeviceInfo(*row[:4], bool(row[4])) for row in rows}
+        with self._lock:
+            self._devices = devices
+        return len(devices)
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def put(self, device):
+        """
+        Add or refresh a device; accepts a Device row or a DeviceInfo.
+        """
+        info = device if isinstance(device, DeviceInfo) else device_info(device)
+        with self._lock:
+            self._devices[info.id] = info
+
+    def remove(self, device_id):
+        with self._lock:
+            self._devices.pop(device_id, None)
+            self._touched.pop(device_id, None)
+
+    def should_touch(self, device_id):
+        """
+        True if this device's last_seen is due to be written again.
+        """
+        now = time.monotonic()
+        last = self._touched.get(device_id)
+        if last is not None and now - last < self.last_seen_interval:
+            return False
+        self._touched[device_id] = now
+        return True
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+
+device_registry = DeviceRegistry()
@@ -0,0 +1,294 @@
+"""
+Retention and downsampling of raw sensor data.
+
+Raw samples (SensorData rows and SensorChunk blocks) are kept at full rate
+for ``SENSOR_RETENTION_HOURS``. ``compact`` replaces anything older with
+SensorSummary rows: per-device mean, min, max and RMS of every column over
+``SENSOR_SUMMARY_SECONDS``. It works oldest first in batches of
+``SENSOR_COMPACT_BATCH`` rows, committing each batch on its own and
+pausing between them, so no transaction holds the write lock for long and
+the ingest flusher keeps getting through. Summaries for a bucket that was
+split across batches (or runs) are merged, so a run can stop anywhere.
+
+Run it from cron with ``flask sensor-data compact``, or set
+``SENSOR_COMPACT_INTERVAL`` to have the API process run it periodically
+(from its first request on). Runs must not overlap, so with several API
+processes use cron.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, delete, text, tuple_
+
+from ..models.models import db, Device, SensorData, SensorChunk, SensorSummary
+from .chunks import CHUNK_COLUMNS, decode_chunk
+
+logger = logging.getLogger(__name__)
+
+STATS = ('mean', 'min', 'max', 'rms')
+# Rows removed per DELETE statement inside a batch
+DELETE_CHUNK = 500
+
+
+def summarize_samples(device_id, times_us, columns, bucket_seconds):
+    """
+    Per-bucket statistics of one device's samples as SensorSummary dicts.
+    ``columns`` maps CHUNK_COLUMNS names to float arrays (NaN = missing).
+    """
+    if not len(times_us):
+        return []
+    order = np.argsort(times_us, kind='stable')
+    bucket_us = int(bucket_seconds * 1e6)
+    buckets = times_us[order] // bucket_us
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+
+    summaries = [
+        {
+            'device_id': device_id,
+            'bucket_start': np.datetime64(int(bucket) * bucket_us, 'us').item(),
+            'bucket_seconds': bucket_seconds,
+            'sample_count': count,
+        }
+        for bucket, count in zip(buckets[starts].tolist(), counts.tolist())
+    ]
+    for name in CHUNK_COLUMNS:
+        values = np.asarray(columns[name], dtype=np.float64)[order]
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        n = np.add.reduceat(valid.astype(np.int64), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.add.reduceat(filled, starts) / n
+            rms = np.sqrt(np.add.reduceat(filled * filled, starts) / n)
+        stats = {
+            'mean': mean,
+            'min': np.fmin.reduceat(values, starts),
+            'max': np.fmax.reduceat(values, starts),
+            'rms': rms,
+        }
+        for stat, result in stats.items():
+            for summary, value in zip(summaries, result.tolist()):
+                summary[f'{name}_{stat}'] = None if value != value else value
+        for summary, count in zip(summaries, n.tolist()):
+            summary[f'{name}_count'] = count
+    return summaries
+
+
+def _valid_count(summary, name):
+    count = summary.get(f'{name}_count')
+    if count is None:
+        # Summaries from before per-column counts: every sample had a value,
+        # or none did
+        count = 0 if summary[f'{name}_mean'] is None else summary['sample_count']
+    return count
+
+
+def _merge(old, new):
+    """
+    Combine two summaries of the same bucket, weighting each column by the
+    number of samples that had a value for it.
+    """
+    merged = dict(new, sample_count=old['sample_count'] + new['sample_count'])
+    for name in CHUNK_COLUMNS:
+        a, b = _valid_count(old, name), _valid_count(new, name)
+        merged[f'{name}_count'] = a + b
+        if not a or not b:
+            source = new if b else old
+            for stat in STATS:
+                merged[f'{name}_{stat}'] = source[f'{name}_{stat}']
+            continue
+        pairs = {stat: (old[f'{name}_{stat}'], new[f'{name}_{stat}']) for stat in STATS}
+        merged[f'{name}_mean'] = (pairs['mean'][0] * a + pairs['mean'][1] * b) / (a + b)
+        merged[f'{name}_min'] = min(pairs['min'])
+        merged[f'{name}_max'] = max(pairs['max'])
+        merged[f'{name}_rms'] = ((pairs['rms'][0] ** 2 * a + pairs['rms'][1] ** 2 * b) / (a + b)) ** 0.5
+    return merged
+
+
+def _write_summaries(summaries):
+    """
+    Insert summaries, merging into any existing ones for the same bucket.
+    """
+    if not summaries:
+        return
+    table = SensorSummary.__table__
+    keys = [(s['device_id'], s['bucket_start']) for s in summaries]
+    existing = {
+        (row['device_id'], row['bucket_start']): dict(row)
+        for row in db.session.execute(
+            select(table).where(tuple_(table.c.device_id, table.c.bucket_start).in_(keys))
+        ).mappings()
+    }
+    inserts = []
+    for summary in summaries:
+        key = (summary['device_id'], summary['bucket_start'])
+        if key in existing:
+            db.session.execute(
+                table.update()
+                .where(table.c.device_id == key[0], table.c.bucket_start == key[1])
+                .values(_merge(existing[key], summary))
+            )
+        else:
+            inserts.append(summary)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+def database_size():
+    """
+    Bytes used by the database, or None if we can't tell for this backend.
+    For SQLite, pages on the freelist count as free.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        page_size = db.session.execute(text('PRAGMA page_size')).scalar()
+        pages = db.session.execute(text('PRAGMA page_count')).scalar()
+        free = db.session.execute(text('PRAGMA freelist_count')).scalar()
+        return (pages - free) * page_size
+    if dialect == 'mysql':
+        return db.session.execute(text(
+            'SELECT SUM(data_length + index_length) FROM information_schema.tables '
+            'WHERE table_schema = DATABASE()')).scalar()
+    return None
+
+
+class Compactor:
+    def __init__(self, app=None):
+        self.app = None
+        self.retention_hours = 168
+        self.summary_seconds = 60
+        self.batch_size = 5000
+        self.pause = 0.05
+        self.interval = 0
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.retention_hours = app.config.get('SENSOR_RETENTION_HOURS', self.retention_hours)
+        self.summary_seconds = app.config.get('SENSOR_SUMMARY_SECONDS', self.summary_seconds)
+        self.batch_size = app.config.get('SENSOR_COMPACT_BATCH', self.batch_size)
+        self.pause = app.config.get('SENSOR_COMPACT_PAUSE', self.pause)
+        self.interval = app.config.get('SENSOR_COMPACT_INTERVAL', self.interval)
+
+    def cutoff(self, now=None):
+        """
+        Samples older than this are compacted; aligned to a summary bucket so
+        the newest summary never covers retained raw samples.
+        """
+        now = now or datetime.utcnow()
+        limit = now - timedelta(hours=self.retention_hours)
+        bucket_us = int(self.summary_seconds * 1e6)
+        limit_us = int((limit - datetime(1970, 1, 1)).total_seconds() * 1e6)
+        return np.datetime64(limit_us - limit_us % bucket_us, 'us').item()
+
+    def compact(self, now=None, log=logger.info):
+        """
+        Summarize and delete raw samples older than the retention window.
+        Must run inside an app context. Returns a report dict.
+        """
+        cutoff = self.cutoff(now)
+        started = time.perf_counter()
+        size_before = database_size()
+        report = {'cutoff': cutoff.isoformat(), 'rows_deleted': 0, 'chunks_deleted': 0,
+                  'samples_summarized': 0, 'summaries_written': 0}
+
+        device_ids = db.session.execute(select(Device.id)).scalars().all()
+        for device_id in device_ids:
+            while self._compact_rows(device_id, cutoff, report):
+                time.sleep(self.pause)
+            while self._compact_chunks(device_id, cutoff, report):
+                time.sleep(self.pause)
+
+        size_after = database_size()
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        if size_before is not None and size_after is not None:
+            report['bytes_reclaimed'] = size_before - size_after
+        log(f"Sensor compaction up to {report['cutoff']}: {report['rows_deleted']} rows and "
+            f"{report['chunks_deleted']} chunks into {report['summaries_written']} summaries, "
+            f"{report.get('bytes_reclaimed', 'unknown')} bytes reclaimed in {report['seconds']}s")
+        return report
+
+    def _compact_rows(self, device_id, cutoff, report):
+        table = SensorData.__table__
+        batch = db.session.execute(
+            select(table)
+            .where(table.c.device_id == device_id, table.c.timestamp < cutoff)
+            .order_by(table.c.timestamp, table.c.id)
+            .limit(self.batch_size)
+        ).mappings().all()
+        if not batch:
+            return False
+        times_us = np.array([row['timestamp'] for row in batch], dtype='datetime64[us]').astype(np.int64)
+        columns = {
+            name: np.array([row[name] for row in batch], dtype=np.float64)
+            for name in CHUNK_COLUMNS
+        }
+        summaries = summarize_samples(device_id, times_us, columns, self.summary_seconds)
+        _write_summaries(summaries)
+        ids = [row['id'] for row in batch]
+        for lo in range(0, len(ids), DELETE_CHUNK):
+            db.session.execute(delete(table).where(table.c.id.in_(ids[lo:lo + DELETE_CHUNK])))
+        db.session.commit()
+        report['rows_deleted'] += len(batch)
+        report['samples_summarized'] += len(batch)
+        report['summaries_written'] += len(summaries)
+        return len(batch) == self.batch_size
+
+    def _compact_chunks(self, device_id, cutoff, report):
+        # Chunks hold many samples each; size the batch by samples, not chunks
+        chunks = db.session.execute(
+            select(SensorChunk.id, SensorChunk.start_time, SensorChunk.sample_count, SensorChunk.data)
+            .where(SensorChunk.device_id == device_id, SensorChunk.end_time < cutoff)
+            .order_by(SensorChunk.end_time)
+            .limit(max(1, self.batch_size // 500))
+        ).all()
+        if not chunks:
+            return False
+        decoded = np.concatenate([decode_chunk(start, count, blob) for _, start, count, blob in chunks])
+        summaries = summarize_samples(device_id, decoded['t'], decoded, self.summary_seconds)
+        _write_summaries(summaries)
+        db.session.execute(delete(SensorChunk.__table__).where(
+            SensorChunk.__table__.c.id.in_([chunk.id for chunk in chunks])))
+        db.session.commit()
+        report['chunks_deleted'] += len(chunks)
+        report['samples_summarized'] += len(decoded)
+        report['summaries_written'] += len(summaries)
+        return len(chunks) == max(1, self.batch_size // 500)
+
+    def vacuum(self):
+        """
+        Return freed pages to the filesystem (SQLite only; locks the whole
+        database while it runs, so schedule it off-peak).
+        """
+        if db.engine.dialect.name != 'sqlite':
+            return False
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+        return True
+
+    def start(self):
+        """
+        Run ``compact`` every ``interval`` seconds from a daemon thread.
+        Safe to call repeatedly; create_app calls it before each request.
+        """
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name='sensor-compactor', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Sensor compaction failed: {e}")
+
+
+compactor = Compactor()
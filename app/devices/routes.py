@@ -1,11 +1,25 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask.views import MethodView
 from ..models.models import db, Device, User
+from ..utils.streaming import stream_mode, stream_response
+from ..utils.columnar import columnar_format, columnar_response
+from .registry import device_registry
+from .chunks import (
+    CHUNK_COLUMNS, query_sample_columns, iter_samples,
+    parse_cursor, parse_timestamp, sample_cursor, sample_dicts
+)
+from .export import EXPORT_AVAILABLE, EXPORT_FORMATS, stream_export
 from datetime import datetime
 import uuid
 
 devices_bp = Blueprint('devices', __name__, url_prefix='/devices')
 
+def _iter_devices(batch_size=500):
+    # Runs lazily inside the streamed response, not in the view
+    devices = db.session.execute(db.select(Device).execution_options(yield_per=batch_size)).scalars()
+    for device in devices:
+        yield device.to_dict()
+
 class DeviceView(MethodView):
     def get(self, device_id=None):
         """
@@ -19,6 +33,11 @@ class DeviceView(MethodView):
             
             return jsonify(device.to_dict()), 200
         else:
+            mode = stream_mode()
+            if mode:
+                # Stream the listing in batches rather than loading every device
+                return stream_response(_iter_devices(), mode)
+
             # Get list of all devices
             devices = Device.query.all()
             return jsonify([device.to_dict() for device in devices]), 200
@@ -54,6 +73,7 @@ class DeviceView(MethodView):
         
         db.session.add(new_device)
         db.session.commit()
+        device_registry.put(new_device)
         
         return jsonify(new_device.to_dict()), 201
     
@@ -82,8 +102,10 @@ class DeviceView(MethodView):
             if not user:
                 return jsonify({"error": "User not found"}), 404
             device.user_id = data['user_id']
+            device.auto_created = False
         
         db.session.commit()
+        device_registry.put(device)
         
         return jsonify(device.to_dict()), 200
     
@@ -97,6 +119,7 @@ class DeviceView(MethodView):
         
         db.session.delete(device)
         db.session.commit()
+        device_registry.remove(device_id)
         
         return jsonify({"message": "Device deleted successfully"}), 200
 
@@ -109,30 +132,145 @@ devices_bp.add_url_rule('/<string:device_id>', view_func=device_view, methods=['
 @devices_bp.route('/<string:device_id>/sensor-data', methods=['GET'])
 def get_sensor_data(device_id):
     """
-    Get sensor data for a specific device
+    Get sensor data for a specific device, newest first.
+
+    Query parameters: limit, start/end (ISO 8601 time range), before/after
+    (keyset cursors from the X-Next-Cursor header; ``after`` pages run
+    oldest first), offset (kept for old clients; slow when deep).
+
+    With ``stream=ndjson`` (or ``Accept: application/x-ndjson``) or
+    ``stream=json`` the samples are streamed instead, and ``limit`` is
+    optional: without it everything in range is sent.
+
+    ``format=msgpack`` or ``format=columns`` (or the matching Accept
+    header) returns the page as columnar binary instead of JSON: 't' in
+    epoch microseconds and one float32 array per sensor column; see
+    app/utils/columnar.py.
     """
-    from ..models.models import SensorData
-    
     # Check if device exists
     device = Device.query.get(device_id)
     if not device:
         return jsonify({"error": "Device not found"}), 404
     
+    try:
+        fmt = columnar_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 406
+    mode = None if fmt else stream_mode()
+
     # Get query parameters for filtering
-    limit = request.args.get('limit', 100, type=int)
+    limit = request.args.get('limit', None if mode else 100, type=int)
     offset = request.args.get('offset', 0, type=int)
     
-    # Query sensor data
-    sensor_data = (
-        SensorData.query
-        .filter_by(device_id=device_id)
-        .order_by(SensorData.timestamp.desc())
-        .limit(limit)
-        .offset(offset)
-        .all()
-    )
+    # Time range and keyset cursors; see query_sample_columns
+    try:
+        bounds = {
+            key: parse_timestamp(request.args[key])
+            for key in ('start', 'end') if request.args.get(key)
+        }
+        cursors = {
+            key: parse_cursor(request.args[key])
+            for key in ('before', 'after') if request.args.get(key)
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid time or cursor: {e}"}), 400
     
-    return jsonify([data.to_dict() for data in sensor_data]), 200
+    chunk_seconds = current_app.config.get('SENSOR_CHUNK_SECONDS', 60)
+    if mode:
+        samples = iter_samples(device_id, limit, offset, chunk_seconds=chunk_seconds,
+                               page_size=current_app.config.get('SENSOR_STREAM_PAGE', 1000),
+                               **bounds, **cursors)
+        return stream_response(samples, mode)
+
+    # Rows and compressed chunks are merged, so the storage mode is invisible here
+    samples = query_sample_columns(device_id, limit, offset, chunk_seconds=chunk_seconds,
+                                   **bounds, **cursors)
+    headers = {}
+    if len(samples) and len(samples) == limit:
+        # Pass as ?before= (or ?after= when paging forward) for the next
+        # page; a short page is the last one
+        headers['X-Next-Cursor'] = sample_cursor(samples[-1])
+
+    if fmt:
+        columns = {'t': samples['t']}
+        columns.update((name, samples[name].astype('<f4')) for name in CHUNK_COLUMNS)
+        return columnar_response(columns, fmt, meta={'device_id': device_id}, headers=headers)
+
+    response = jsonify(sample_dicts(device_id, samples))
+    response.headers.extend(headers)
+    return response, 200
+
+@devices_bp.route('/<string:device_id>/sensor-summary', methods=['GET'])
+def get_sensor_summary(device_id):
+    """
+    Downsampled statistics for samples past the retention window, oldest
+    first. Query parameters: start/end (ISO 8601), limit.
+    """
+    from ..models.models import SensorSummary
+
+    device = Device.query.get(device_id)
+    if not device:
+        return jsonify({"error": "Device not found"}), 404
+
+    limit = request.args.get('limit', 1000, type=int)
+    query = SensorSummary.query.filter_by(device_id=device_id)
+    try:
+        if request.args.get('start'):
+            query = query.filter(SensorSummary.bucket_start >= parse_timestamp(request.args['start']))
+        if request.args.get('end'):
+            query = query.filter(SensorSummary.bucket_start < parse_timestamp(request.args['end']))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid time: {e}"}), 400
+
+    summaries = query.order_by(SensorSummary.bucket_start).limit(limit).all()
+    return jsonify([summary.to_dict() for summary in summaries]), 200
+
+def _export_response(device_ids, name):
+    """
+    Stream samples of ``device_ids`` as Arrow IPC or Parquet. Query
+    parameters: format (parquet, arrow), start/end (ISO 8601).
+    """
+    if not EXPORT_AVAILABLE:
+        return jsonify({"error": "Export is not available: pyarrow is not installed"}), 501
+    fmt = request.args.get('format', 'parquet')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format: {fmt}"}), 400
+    try:
+        bounds = {
+            key: parse_timestamp(request.args[key])
+            for key in ('start', 'end') if request.args.get(key)
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid time: {e}"}), 400
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    chunks = stream_export(device_ids, fmt, batch_rows=current_app.config.get('SENSOR_EXPORT_BATCH', 50000),
+                           **bounds)
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{name}.{extension}"',
+    })
+
+@devices_bp.route('/<string:device_id>/export', methods=['GET'])
+def export_sensor_data(device_id):
+    """
+    Bulk export of a device's raw samples, streamed in record batches
+    """
+    device = Device.query.get(device_id)
+    if not device:
+        return jsonify({"error": "Device not found"}), 404
+    return _export_response([device_id], f'sensor-data-{device_id}')
+
+@devices_bp.route('/user/<string:user_id>/export', methods=['GET'])
+def export_user_sensor_data(user_id):
+    """
+    Bulk export of the raw samples of all of a user's devices, one device
+    after the other
+    """
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    device_ids = [device.id for device in Device.query.filter_by(user_id=user_id).order_by(Device.id)]
+    return _export_response(device_ids, f'sensor-data-user-{user_id}')
 
 # Add route for users to select a device
 @devices_bp.route('/user/<string:user_id>/select', methods=['GET'])
@@ -179,10 +317,12 @@ def assign_device_to_user():
     
     # Update device
     device.user_id = data['user_id']
+    device.auto_created = False
     if 'name' in data:
         device.name = data['name']
     
     db.session.commit()
+    device_registry.put(device)
     
     return jsonify({
         "message": "Device assigned successfully",
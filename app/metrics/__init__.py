@@ -0,0 +1,4 @@
+from .routes import metrics_bp
+from .registry import registry
+
+__all__ = ['metrics_bp', 'registry']
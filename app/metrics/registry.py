@@ -0,0 +1,181 @@
+"""
+Small in-process metrics registry rendered in the Prometheus text format.
+
+Counters and gauges are plain numbers behind a lock. Histograms use an
+HDR-style log-linear bucket layout (``SUB_BUCKETS`` buckets per power of
+two, from 1 microsecond to about 1 minute), so recording a value is a
+``math.frexp`` and an index increment, with no search and no allocation.
+"""
+import math
+import threading
+
+SUB_BUCKETS = 4
+OCTAVES = 26  # 1us .. 2**26us (~67s)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    inner = ','.join(f'{k}="{str(v)}"' for k, v in pairs)
+    return '{' + inner + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in items]
+
+
+class Gauge:
+    """
+    A gauge whose value is read from ``func`` at scrape time.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        return [f'{self.name} {self.func()}']
+
+
+class Histogram:
+    """
+    Latency histogram in seconds with log-linear (HDR-style) buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._counts = [0] * (OCTAVES * SUB_BUCKETS + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def bucket_index(seconds):
+        micros = seconds * 1e6
+        if micros < 1:
+            return 0
+        mantissa, exponent = math.frexp(micros)
+        octave = exponent - 1
+        if octave >= OCTAVES:
+            return OCTAVES * SUB_BUCKETS
+        sub = int((mantissa * 2 - 1) * SUB_BUCKETS)
+        return octave * SUB_BUCKETS + sub
+
+    @staticmethod
+    def bucket_bound(index):
+        """Upper bound of a bucket, in seconds."""
+        octave, sub = divmod(index, SUB_BUCKETS)
+        return (2 ** octave) * (1 + (sub + 1) / SUB_BUCKETS) / 1e6
+
+    def observe(self, seconds):
+        index = self.bucket_index(seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            self._count += 1
+
+    def percentile(self, q):
+        """
+        Approximate q-th percentile (0-100), as the upper bound of the bucket.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if not total:
+            return 0.0
+        rank = math.ceil(total * q / 100)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.bucket_bound(index) if index < len(counts) - 1 else float('inf')
+        return float('inf')
+
+    def render(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, total_sum = self._count, self._sum
+        lines = []
+        cumulative = 0
+        for index, count in enumerate(counts[:-1]):
+            cumulative += count
+            bound = f'{self.bucket_bound(index):.9g}'
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f'{self.name}_sum {total_sum}')
+        lines.append(f'{self.name}_count {total}')
+        return lines
+
+
+class CallbackMetric:
+    """
+    Labelled values produced by ``func`` at scrape time, as (labels, value) pairs.
+    """
+
+    def __init__(self, name, help, kind, labels, func):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.func = func
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in self.func()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, func):
+        return self.register(Gauge(name, help, func))
+
+    def histogram(self, name, help):
+        return self.register(Histogram(name, help))
+
+    def callback(self, name, help, kind, labels, func):
+        return self.register(CallbackMetric(name, help, kind, labels, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
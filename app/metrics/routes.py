@@ -0,0 +1,13 @@
+from flask import Blueprint, Response
+
+from .registry import registry
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus text exposition of the in-process metrics.
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,3 +1,3 @@
-from .models import db, User, Device, SensorData
+from .models import db, User, Device, SensorData, SensorChunk, SensorSummary
 
-__all__ = ['db', 'User', 'Device', 'SensorData']
\ No newline at end of file
+__all__ = ['db', 'User', 'Device', 'SensorData', 'SensorChunk', 'SensorSummary']
@@ -1,6 +1,7 @@
 import uuid
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import declared_attr
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
@@ -70,8 +71,13 @@ class Device(db.Model):
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_seen = db.Column(db.DateTime, nullable=True)
+    # Created by the WebSocket server for an unknown UUID and parked on the
+    # first user until someone assigns it
+    auto_created = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     
     sensor_data = db.relationship('SensorData', backref='device', lazy=True)
+    sensor_chunks = db.relationship('SensorChunk', backref='device', lazy=True)
+    sensor_summaries = db.relationship('SensorSummary', backref='device', lazy=True)
 
     def to_dict(self):
         return {
@@ -80,11 +86,15 @@ class Device(db.Model):
             'device_type': self.device_type,
             'user_id': self.user_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'last_seen': self.last_seen.isoformat() if self.last_seen else None
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'auto_created': bool(self.auto_created)
         }
 
 class SensorData(db.Model):
     __tablename__ = 'sensordata'
+    __table_args__ = (
+        db.Index('ix_sensordata_device_timestamp', 'device_id', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.String(36), db.ForeignKey('device.id'), nullable=False)
@@ -110,14 +120,109 @@ class SensorData(db.Model):
             'gyro_z': self.gyro_z,
             'battery_level': self.battery_level
         }
-    
+
+class SensorChunk(db.Model):
+    """
+    Up to one chunk period (SENSOR_CHUNK_SECONDS) of a device's samples packed
+    into a compressed columnar block; see app/devices/chunks.py for the format.
+    """
+    __tablename__ = 'sensor_chunk'
+    __table_args__ = (
+        db.Index('ix_sensor_chunk_device_start', 'device_id', 'start_time'),
+        db.Index('ix_sensor_chunk_device_end', 'device_id', 'end_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(36), db.ForeignKey('device.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'start_time': self.start_time.isoformat(),
+            'end_time': self.end_time.isoformat(),
+            'sample_count': self.sample_count,
+            'size_bytes': len(self.data)
+        }
+
+class SensorSummary(db.Model):
+    """
+    Downsampled statistics of one device's samples over one summary period
+    (SENSOR_SUMMARY_SECONDS); written by the compaction job in
+    app/devices/retention.py when raw samples age out.
+    """
+    __tablename__ = 'sensor_summary'
+
+    device_id = db.Column(db.String(36), db.ForeignKey('device.id'), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    bucket_seconds = db.Column(db.Integer, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)
+    accel_x_mean = db.Column(db.Float, nullable=True)
+    accel_x_min = db.Column(db.Float, nullable=True)
+    accel_x_max = db.Column(db.Float, nullable=True)
+    accel_x_rms = db.Column(db.Float, nullable=True)
+    accel_y_mean = db.Column(db.Float, nullable=True)
+    accel_y_min = db.Column(db.Float, nullable=True)
+    accel_y_max = db.Column(db.Float, nullable=True)
+    accel_y_rms = db.Column(db.Float, nullable=True)
+    accel_z_mean = db.Column(db.Float, nullable=True)
+    accel_z_min = db.Column(db.Float, nullable=True)
+    accel_z_max = db.Column(db.Float, nullable=True)
+    accel_z_rms = db.Column(db.Float, nullable=True)
+    gyro_x_mean = db.Column(db.Float, nullable=True)
+    gyro_x_min = db.Column(db.Float, nullable=True)
+    gyro_x_max = db.Column(db.Float, nullable=True)
+    gyro_x_rms = db.Column(db.Float, nullable=True)
+    gyro_y_mean = db.Column(db.Float, nullable=True)
+    gyro_y_min = db.Column(db.Float, nullable=True)
+    gyro_y_max = db.Column(db.Float, nullable=True)
+    gyro_y_rms = db.Column(db.Float, nullable=True)
+    gyro_z_mean = db.Column(db.Float, nullable=True)
+    gyro_z_min = db.Column(db.Float, nullable=True)
+    gyro_z_max = db.Column(db.Float, nullable=True)
+    gyro_z_rms = db.Column(db.Float, nullable=True)
+    battery_level_mean = db.Column(db.Float, nullable=True)
+    battery_level_min = db.Column(db.Float, nullable=True)
+    battery_level_max = db.Column(db.Float, nullable=True)
+    battery_level_rms = db.Column(db.Float, nullable=True)
+    # Samples that had a value for each column (mean and RMS are over these);
+    # NULL in summaries written before they were counted
+    accel_x_count = db.Column(db.Integer, nullable=True)
+    accel_y_count = db.Column(db.Integer, nullable=True)
+    accel_z_count = db.Column(db.Integer, nullable=True)
+    gyro_x_count = db.Column(db.Integer, nullable=True)
+    gyro_y_count = db.Column(db.Integer, nullable=True)
+    gyro_z_count = db.Column(db.Integer, nullable=True)
+    battery_level_count = db.Column(db.Integer, nullable=True)
+
+    def to_dict(self):
+        result = {
+            'device_id': self.device_id,
+            'bucket_start': self.bucket_start.isoformat(),
+            'bucket_seconds': self.bucket_seconds,
+            'sample_count': self.sample_count
+        }
+        for column in self.__table__.columns.keys()[4:]:
+            result[column] = getattr(self, column)
+        return result
+
 class ParkinsonMetric(db.Model):
     __tablename__ = 'parkinson_metric'
+    __table_args__ = (
+        db.Index('ix_parkinson_metric_user_timestamp', 'user_id', 'timestamp'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     shake_per_minute = db.Column(db.Float, nullable=False)
+    # Samples averaged into a minute computed from the WebSocket stream;
+    # NULL for metrics posted by clients
+    sample_count = db.Column(db.Integer, nullable=True)
 
     def to_dict(self):
         return {
@@ -127,8 +232,55 @@ class ParkinsonMetric(db.Model):
             'shake_per_minute': self.shake_per_minute
         }
 
+class ShakeRollupMixin:
+    """
+    Count, sum, min and max of ParkinsonMetric.shake_per_minute per user per
+    time bucket; kept current by app/parkinson/rollups.py as metrics are written.
+    """
+    # Spelled out: declared_attr columns come last, which would otherwise
+    # make the key (bucket_start, user_id) and every per-user read a scan
+    # across all users (the migration already creates it this way round)
+    __table_args__ = (db.PrimaryKeyConstraint('user_id', 'bucket_start'),)
+
+    @declared_attr
+    def user_id(cls):
+        return db.Column(db.String(36), db.ForeignKey('user.id'), primary_key=True)
+
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    metric_count = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    min_value = db.Column(db.Float, nullable=False)
+    max_value = db.Column(db.Float, nullable=False)
+
+    @property
+    def average(self):
+        return self.total / self.metric_count
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'bucket_start': self.bucket_start.isoformat(),
+            'count': self.metric_count,
+            'sum': self.total,
+            'min': self.min_value,
+            'max': self.max_value,
+            'avg': self.average
+        }
+
+class ShakeRollupMinute(ShakeRollupMixin, db.Model):
+    __tablename__ = 'shake_rollup_minute'
+
+class ShakeRollupHour(ShakeRollupMixin, db.Model):
+    __tablename__ = 'shake_rollup_hour'
+
+class ShakeRollupDay(ShakeRollupMixin, db.Model):
+    __tablename__ = 'shake_rollup_day'
+
 class MedicationLog(db.Model):
     __tablename__ = 'medication_log'
+    __table_args__ = (
+        db.Index('ix_medication_log_user_timestamp', 'user_id', 'timestamp'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
@@ -0,0 +1,24 @@
+"""
+Guard for Alembic migrations.
+
+Databases set up with ``db.create_all()`` already have the current
+schema, so migrations check whether the object they would create (or
+drop) is there before touching it.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+def exists(table, index=None, column=None):
+    """
+    True if ``table`` exists, and with ``index`` or ``column`` given, if it
+    has an index or column of that name.
+    """
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        return False
+    if index is not None:
+        return index in {ix['name'] for ix in inspector.get_indexes(table)}
+    if column is not None:
+        return column in {col['name'] for col in inspector.get_columns(table)}
+    return True
@@ -1,3 +1,7 @@
 from .routes import parkinson_bp
+from .commands import parkinson_cli
+from .medication import dose_cache
+from .cache import response_cache
+from .daily import daily_series
 
-__all__ = ['parkinson_bp']
\ No newline at end of file
+__all__ = ['parkinson_bp', 'parkinson_cli', 'dose_cache', 'response_cache', 'daily_series']
@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+import uuid
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models.models import db, ParkinsonMetric
+from app.utils.shake_analysis import calculate_shake_batch
+from app.parkinson.rollups import update_rollups, refresh_rollups
+
+logger = logging.getLogger(__name__)
+
+# Metrics kept for retry while the database is unavailable
+MAX_UNSAVED = 100000
+
+
+SHAKE_FIELDS = ('accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z')
+
+
+def shake_magnitudes(samples):
+    """
+    Shake magnitude for every sample of a SAMPLE_DTYPE array.
+    """
+    return calculate_shake_batch(*(samples[k] for k in SHAKE_FIELDS))
+
+
+class ShakeAggregator:
+    """
+    Turns the WebSocket sensor stream into one ParkinsonMetric per user per
+    minute, so devices no longer need to POST every sample to /parkinson/log.
+
+    Each sample's shake magnitude is added to a running (sum, count) for
+    its user and minute. A minute is emitted once the user has data for a
+    later minute and the bucket has been quiet for ``grace`` seconds, or
+    once it has been idle for ``idle_timeout`` seconds (device went quiet).
+
+    Samples for a minute that was already written (a late frame, or the
+    same user's devices served by another ingest worker) are folded into
+    the stored metric, weighted by its ``sample_count``, so each user
+    keeps one streamed ParkinsonMetric per minute.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.grace = 2.0
+        self.idle_timeout = 65.0
+        # (user_id, epoch minute) -> [sum, count, last update (monotonic)]
+        self._buckets = {}
+        self._latest_minute = {}
+        self._unsaved = []
+        self._unsaved_lock = threading.Lock()
+        self.metrics_written = 0
+        self.minutes_merged = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SHAKE_INGEST_ENABLED', self.enabled)
+        self.grace = app.config.get('SHAKE_INGEST_GRACE', self.grace)
+        self.idle_timeout = app.config.get('SHAKE_INGEST_IDLE_TIMEOUT', self.idle_timeout)
+
+    def add(self, user_id, timestamps, samples):
+        """
+        Accumulate a device batch. ``timestamps`` is datetime64, ``samples``
+        a SAMPLE_DTYPE array, both in time order.
+        """
+        if not self.enabled or user_id is None or not len(samples):
+            return
+        shake = shake_magnitudes(samples)
+        minutes = timestamps.astype('datetime64[m]').astype(np.int64)
+        valid = ~np.isnan(shake)
+        if not valid.all():
+            shake, minutes = shake[valid], minutes[valid]
+            if not len(shake):
+                return
+        now = time.monotonic()
+
+        if minutes[0] == minutes[-1]:
+            self._accumulate(user_id, int(minutes[0]), float(shake.sum()), len(shake), now)
+            return
+        starts = np.flatnonzero(np.r_[True, minutes[1:] != minutes[:-1]])
+        sums = np.add.reduceat(shake, starts)
+        counts = np.diff(np.r_[starts, len(shake)])
+        for minute, total, count in zip(minutes[starts].tolist(), sums.tolist(), counts.tolist()):
+            self._accumulate(user_id, minute, total, count, now)
+
+    def _accumulate(self, user_id, minute, total, count, now):
+        bucket = self._buckets.get((user_id, minute))
+        if bucket is None:
+            self._buckets[(user_id, minute)] = [total, count, now]
+        else:
+            bucket[0] += total
+            bucket[1] += count
+            bucket[2] = now
+        if minute > self._latest_minute.get(user_id, minute - 1):
+            self._latest_minute[user_id] = minute
+
+    def collect(self, force=False):
+        """
+        Remove finished minutes and return them as ParkinsonMetric rows.
+        With ``force`` every open minute is returned (shutdown).
+        """
+        now = time.monotonic()
+        with self._unsaved_lock:
+            rows, self._unsaved = self._unsaved, []
+        for key, (total, count, updated) in list(self._buckets.items()):
+            user_id, minute = key
+            idle = now - updated
+            finished = (self._latest_minute.get(user_id, minute) > minute and idle >= self.grace) \
+                or idle >= self.idle_timeout
+            if force or finished:
+                del self._buckets[key]
+                rows.append({
+                    'id': str(uuid.uuid4()),
+                    'user_id': user_id,
+                    'timestamp': np.datetime64(minute, 'm').astype('datetime64[us]').item(),
+                    'shake_per_minute': total / count,
+                    'sample_count': count,
+                })
+        return rows
+
+    def save(self, app, rows):
+        """
+        Write collected rows; runs on the ingest DB thread. Rows that fail
+        to write are kept for the next call.
+        """
+        if not rows:
+            return 0
+        try:
+            with app.app_context():
+                written, merged = self._write(rows)
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"Saving {len(rows)} shake metrics failed: {getattr(e, 'orig', e)}")
+            with self._unsaved_lock:
+                self._unsaved = (rows + self._unsaved)[-MAX_UNSAVED:]
+            return 0
+        self.metrics_written += written
+        self.minutes_merged += merged
+        return written + merged
+
+    def _write(self, rows):
+        """
+        Insert new minutes and merge the rest into the streamed metric
+        already stored for their (user, minute). Returns (inserted, merged).
+        """
+        rows = _combine(rows)
+        metrics = ParkinsonMetric.__table__
+        stored = {}
+        for user_id in {row['user_id'] for row in rows}:
+            query = (
+                select(metrics.c.id, metrics.c.timestamp, metrics.c.shake_per_minute, metrics.c.sample_count)
+                .where(metrics.c.user_id == user_id,
+                       metrics.c.timestamp.in_([row['timestamp'] for row in rows if row['user_id'] == user_id]),
+                       metrics.c.sample_count.isnot(None))
+                .with_for_update()
+            )
+            for current in db.session.execute(query).mappings():
+                stored[(user_id, current['timestamp'])] = current
+
+        new, late = [], []
+        for row in rows:
+            current = stored.get((row['user_id'], row['timestamp']))
+            if current is None:
+                new.append(row)
+                continue
+            count = current['sample_count'] + row['sample_count']
+            value = (current['shake_per_minute'] * current['sample_count']
+                     + row['shake_per_minute'] * row['sample_count']) / count
+            db.session.execute(
+                metrics.update().where(metrics.c.id == current['id'])
+                .values(shake_per_minute=value, sample_count=count))
+            late.append(row)
+
+        if new:
+            db.session.execute(metrics.insert(), new)
+            update_rollups(new)
+        refresh_rollups([row['user_id'] for row in late], [row['timestamp'] for row in late])
+        return len(new), len(late)
+
+
+def _combine(rows):
+    """
+    Merge rows for the same (user, minute), e.g. a retried minute and a late
+    bucket for it, into one row weighted by sample count.
+    """
+    combined = {}
+    for row in rows:
+        key = (row['user_id'], row['timestamp'])
+        current = combined.get(key)
+        if current is None:
+            combined[key] = dict(row)
+            continue
+        count = current['sample_count'] + row['sample_count']
+        current['shake_per_minute'] = (current['shake_per_minute'] * current['sample_count']
+                                       + row['shake_per_minute'] * row['sample_count']) / count
+        current['sample_count'] = count
+    return list(combined.values())
+
+
+shake_aggregator = ShakeAggregator()
@@ -0,0 +1,253 @@
+"""
+Versioned response cache for the Parkinson analytics endpoints.
+
+Each user has a data version that is bumped after every commit that
+writes their ParkinsonMetric or MedicationLog rows, changes the User row
+itself (e.g. the medication list), or retrains their model. Cached
+responses are keyed by route, user, data version, query parameters and
+Accept header, so a write makes the user's old entries unreachable and
+they simply age out; nothing has to be deleted.
+
+Entries expire after ``RESPONSE_CACHE_TTL`` seconds as well, which bounds
+staleness when a write happens in a process whose bumps this one can't
+see (standalone ingest workers with the in-process backend). With a
+shared backend the versions are shared too.
+
+``RESPONSE_CACHE_BACKEND`` is ``memory`` (per-process LRU of
+``RESPONSE_CACHE_SIZE`` entries), a ``redis://`` URL (needs the redis
+package; configure the server with an LRU maxmemory-policy), or
+``module:factory`` for anything else, called with the app and returning an
+object with the CacheBackend methods.
+
+Responses carry an ETag, and a matching If-None-Match gets a 304.
+"""
+import hashlib
+import importlib
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.metrics.registry import registry
+from app.models.models import ParkinsonMetric, MedicationLog, User
+
+logger = logging.getLogger(__name__)
+
+cache_hits_total = registry.counter(
+    'neurotrack_response_cache_hits_total', 'Analytics responses served from the cache', labels=('route',))
+cache_misses_total = registry.counter(
+    'neurotrack_response_cache_misses_total', 'Analytics responses computed and cached', labels=('route',))
+
+
+class CacheBackend:
+    """
+    Interface of a response cache backend.
+    """
+
+    def get(self, key):
+        """Cached value or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def version(self, user_id):
+        """Current data version of a user."""
+        raise NotImplementedError
+
+    def bump(self, user_id):
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Process-local LRU with per-entry expiry.
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend(CacheBackend):
+    """
+    Shared backend: entries and versions live in Redis, so every API and
+    ingest process sees the same versions.
+    """
+
+    def __init__(self, url, prefix='neurotrack:cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def version(self, user_id):
+        return int(self.client.get(f'{self.prefix}version:{user_id}') or 0)
+
+    def bump(self, user_id):
+        self.client.incr(f'{self.prefix}version:{user_id}')
+
+
+def _load_backend(app, spec):
+    if spec == 'memory':
+        return MemoryBackend(app.config.get('RESPONSE_CACHE_SIZE', 2000))
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(spec)
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)(app)
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.ttl = 300
+        self.backend = MemoryBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', self.enabled)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.backend = _load_backend(app, app.config.get('RESPONSE_CACHE_BACKEND', 'memory'))
+
+    def bump(self, user_ids):
+        """
+        Invalidate everything cached for these users.
+        """
+        for user_id in set(user_ids):
+            try:
+                self.backend.bump(user_id)
+            except Exception as e:
+                # Cached entries still expire after the TTL
+                logger.error(f"Response cache version bump failed for {user_id}: {e}")
+
+    def cached(self, route, vary=None):
+        """
+        Cache a view's 200 responses per user (the ``user_id`` view
+        argument). ``vary`` returns anything else the response depends on.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(user_id, **kwargs):
+                if not self.enabled:
+                    return view(user_id, **kwargs)
+                try:
+                    key = self._key(route, user_id, vary() if vary else None)
+                    entry = self.backend.get(key)
+                except Exception as e:
+                    logger.error(f"Response cache unavailable: {e}")
+                    return view(user_id, **kwargs)
+
+                if entry is not None:
+                    cache_hits_total.inc(route)
+                    body, mimetype, etag = entry
+                    return _conditional(Response(body, mimetype=mimetype), etag)
+
+                cache_misses_total.inc(route)
+                response = current_app.make_response(view(user_id, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                try:
+                    self.backend.set(key, (body, response.mimetype, etag), self.ttl)
+                except Exception as e:
+                    logger.error(f"Response cache write failed: {e}")
+                return _conditional(response, etag)
+            return wrapper
+        return decorator
+
+    def _key(self, route, user_id, extra):
+        params = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        accept = request.headers.get('Accept', '')
+        raw = f'{route}|{user_id}|{self.backend.version(user_id)}|{params}|{accept}|{extra}'
+        # Fixed-length keys whatever the query string looks like
+        return f'{route}:{user_id}:' + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _conditional(response, etag):
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+response_cache = ResponseCache()
+
+
+# Users whose data changed in the current transaction, bumped on commit.
+# Core bulk inserts (which flush events don't see) call mark_changed.
+_CHANGED = 'response_cache_users'
+
+
+def mark_changed(session, user_ids):
+    session.info.setdefault(_CHANGED, set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed(session, flush_context):
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (ParkinsonMetric, MedicationLog)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, User):
+            user_ids.add(obj.id)
+    if user_ids:
+        mark_changed(session, user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_changed(session):
+    user_ids = session.info.pop(_CHANGED, None)
+    if user_ids:
+        response_cache.bump(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop(_CHANGED, None)
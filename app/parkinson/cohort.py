@@ -0,0 +1,238 @@
+"""
+Cohort report: daily shake averages, trends and medication response for
+many patients at once.
+
+Two aggregate queries serve the whole cohort, however many patients it
+has. The first reads the day rollup rows of every patient in the range
+as columns. The second joins each medication log to the minute rollup
+buckets in its before/after windows and sums them per dose in the
+database (on databases without date arithmetic, from per-patient
+cumulative sums in NumPy instead). Everything else is NumPy group-bys
+over those arrays (bincount by patient), with no per-patient queries.
+
+Medication response works at minute resolution here: the minute bucket
+that contains the dose counts as "before". /medication-response computes
+it from raw metrics for a single patient.
+"""
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import select, func, case, and_, text
+
+from app.models.models import db, Device, MedicationLog, ShakeRollupDay, ShakeRollupMinute
+
+DAY_US = 86400 * 1_000_000
+
+
+def cohort_user_ids(user_ids=None, device_type=None):
+    """
+    The explicit ``user_ids``, plus every user with a device of
+    ``device_type``, de-duplicated in order.
+    """
+    ids = list(user_ids or [])
+    if device_type:
+        ids += db.session.execute(
+            select(Device.user_id).where(Device.device_type == device_type).distinct()
+        ).scalars().all()
+    return list(dict.fromkeys(ids))
+
+
+def _shift(column, seconds):
+    """
+    SQL expression for a DateTime column moved by ``seconds``, or None on
+    databases without one (doses are then matched to buckets in NumPy).
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # Same text layout SQLAlchemy stores, so comparisons stay lexical
+        return func.strftime('%Y-%m-%d %H:%M:%f', column, f'{int(seconds):+d} seconds')
+    if dialect == 'postgresql':
+        return column + timedelta(seconds=seconds)
+    if dialect == 'mysql':
+        return func.date_add(column, text(f'INTERVAL {int(seconds)} SECOND'))
+    return None
+
+
+def _daily_rows(user_ids, start, end):
+    table = ShakeRollupDay.__table__
+    rows = db.session.execute(
+        select(table.c.user_id, table.c.bucket_start, table.c.metric_count, table.c.total)
+        .where(table.c.user_id.in_(user_ids), table.c.bucket_start >= start, table.c.bucket_start < end)
+    ).all()
+    users, days, counts, totals = zip(*rows) if rows else ((),) * 4
+    return (users, np.array(days, dtype='datetime64[us]').astype(np.int64),
+            np.array(counts, dtype=np.int64), np.array(totals, dtype=np.float64))
+
+
+def _dose_rows(user_ids, start, end, before, after):
+    logs = MedicationLog.__table__
+    minutes = ShakeRollupMinute.__table__
+    window_start = _shift(logs.c.timestamp, -before.total_seconds())
+    window_end = _shift(logs.c.timestamp, after.total_seconds())
+    if window_start is None:
+        return _dose_rows_numpy(user_ids, start, end, before, after)
+    is_before = minutes.c.bucket_start < logs.c.timestamp
+    window = and_(
+        minutes.c.user_id == logs.c.user_id,
+        minutes.c.bucket_start >= window_start,
+        minutes.c.bucket_start < window_end,
+    )
+    rows = db.session.execute(
+        select(
+            logs.c.user_id,
+            func.sum(case((is_before, minutes.c.metric_count), else_=0)),
+            func.sum(case((is_before, minutes.c.total), else_=0.0)),
+            func.sum(case((is_before, 0), else_=minutes.c.metric_count)),
+            func.sum(case((is_before, 0.0), else_=minutes.c.total)),
+        )
+        .select_from(logs.join(minutes, window))
+        .where(logs.c.user_id.in_(user_ids), logs.c.timestamp >= start, logs.c.timestamp < end)
+        .group_by(logs.c.id, logs.c.user_id)
+    ).all()
+    users, before_n, before_sum, after_n, after_sum = zip(*rows) if rows else ((),) * 5
+    return (users, np.array(before_n, dtype=np.int64), np.array(before_sum, dtype=np.float64),
+            np.array(after_n, dtype=np.int64), np.array(after_sum, dtype=np.float64))
+
+
+def _dose_rows_numpy(user_ids, start, end, before, after):
+    """
+    _dose_rows without date arithmetic in SQL: read the doses and the minute
+    buckets around them, then sum each dose's windows from per-patient
+    cumulative sums (searchsorted on the bucket times).
+    """
+    logs = MedicationLog.__table__
+    minutes = ShakeRollupMinute.__table__
+    doses = db.session.execute(
+        select(logs.c.user_id, logs.c.timestamp)
+        .where(logs.c.user_id.in_(user_ids), logs.c.timestamp >= start, logs.c.timestamp < end)
+    ).all()
+    buckets = db.session.execute(
+        select(minutes.c.user_id, minutes.c.bucket_start, minutes.c.metric_count, minutes.c.total)
+        .where(minutes.c.user_id.in_(user_ids),
+               minutes.c.bucket_start >= start - before, minutes.c.bucket_start < end + after)
+        .order_by(minutes.c.bucket_start)
+    ).all()
+
+    dose_users, dose_times = zip(*doses) if doses else ((), ())
+    dose_users = np.array(dose_users, dtype=object)
+    dose_times = np.array(dose_times, dtype='datetime64[us]')
+    bucket_users, bucket_times, counts, totals = zip(*buckets) if buckets else ((),) * 4
+    bucket_users = np.array(bucket_users, dtype=object)
+    bucket_times = np.array(bucket_times, dtype='datetime64[us]')
+    counts = np.array(counts, dtype=np.int64)
+    totals = np.array(totals, dtype=np.float64)
+
+    before_n = np.zeros(len(doses), dtype=np.int64)
+    after_n = np.zeros(len(doses), dtype=np.int64)
+    before_sum = np.zeros(len(doses))
+    after_sum = np.zeros(len(doses))
+    for user_id in set(dose_users.tolist()):
+        mine = dose_users == user_id
+        ours = bucket_users == user_id
+        times = bucket_times[ours]
+        count_sums = np.r_[0, np.cumsum(counts[ours])]
+        total_sums = np.r_[0.0, np.cumsum(totals[ours])]
+        at = dose_times[mine]
+        # Window bounds as bucket positions: [at - before, at) and [at, at + after)
+        lo = np.searchsorted(times, at - np.timedelta64(before, 'us'))
+        mid = np.searchsorted(times, at)
+        hi = np.searchsorted(times, at + np.timedelta64(after, 'us'))
+        before_n[mine] = count_sums[mid] - count_sums[lo]
+        before_sum[mine] = total_sums[mid] - total_sums[lo]
+        after_n[mine] = count_sums[hi] - count_sums[mid]
+        after_sum[mine] = total_sums[hi] - total_sums[mid]
+    return (tuple(dose_users.tolist()), before_n, before_sum, after_n, after_sum)
+
+
+def _dose_counts(user_ids, start, end):
+    logs = MedicationLog.__table__
+    return dict(db.session.execute(
+        select(logs.c.user_id, func.count())
+        .where(logs.c.user_id.in_(user_ids), logs.c.timestamp >= start, logs.c.timestamp < end)
+        .group_by(logs.c.user_id)
+    ).all())
+
+
+def _index(user_ids, users):
+    position = {user_id: i for i, user_id in enumerate(user_ids)}
+    return np.array([position[user_id] for user_id in users], dtype=np.int64)
+
+
+def _none_if_nan(values, digits=4):
+    return [None if value != value else round(value, digits) for value in values.tolist()]
+
+
+def cohort_report(user_ids, start, end, before=timedelta(minutes=30),
+                  after=timedelta(minutes=90), include_daily=False):
+    """
+    One row per patient for days ``start <= day < end`` (day-aligned
+    datetimes): days with data, metric count, overall average, first and
+    last daily average, trend (least-squares slope of the daily average,
+    per day), doses, doses with data on both sides, mean before-after
+    delta and the share of those doses that were effective. With
+    ``include_daily`` also a patients x days matrix of daily averages.
+    """
+    n = len(user_ids)
+    start_us = int(np.datetime64(start, 'us').astype(np.int64))
+    day_count = max(0, int((np.datetime64(end, 'us') - np.datetime64(start, 'us')) // np.timedelta64(1, 'D')))
+
+    # Daily averages, then per-patient sums for the regression, all by bincount
+    users, days, counts, totals = _daily_rows(user_ids, start, end)
+    idx = _index(user_ids, users)
+    x = ((days - start_us) // DAY_US).astype(np.float64)
+    y = totals / np.maximum(counts, 1)
+    k = np.bincount(idx, minlength=n).astype(np.float64)
+    sx, sy = np.bincount(idx, x, n), np.bincount(idx, y, n)
+    sxy, sxx = np.bincount(idx, x * y, n), np.bincount(idx, x * x, n)
+    metric_count = np.bincount(idx, counts, n)
+    metric_total = np.bincount(idx, totals, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trend = (k * sxy - sx * sy) / (k * sxx - sx * sx)
+        average = metric_total / metric_count
+    trend[k < 2] = np.nan
+
+    first = np.full(n, np.nan)
+    last = np.full(n, np.nan)
+    if len(idx):
+        # Sort by (patient, day): first/last daily average per patient
+        order = np.lexsort((x, idx))
+        sorted_idx = idx[order]
+        bounds = np.flatnonzero(np.r_[True, sorted_idx[1:] != sorted_idx[:-1]])
+        ends = np.r_[bounds[1:], len(order)] - 1
+        first[sorted_idx[bounds]] = y[order][bounds]
+        last[sorted_idx[bounds]] = y[order][ends]
+
+    # Medication response per dose, summarized per patient
+    dose_users, before_n, before_sum, after_n, after_sum = _dose_rows(user_ids, start, end, before, after)
+    didx = _index(user_ids, dose_users)
+    valid = (before_n > 0) & (after_n > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = before_sum / before_n - after_sum / after_n
+    evaluated = np.bincount(didx[valid], minlength=n)
+    effective = np.bincount(didx[valid], delta[valid] > 0, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_delta = np.bincount(didx[valid], delta[valid], n) / evaluated
+        effective_share = effective / evaluated
+    doses = _dose_counts(user_ids, start, end)
+
+    columns = ['user_id', 'days', 'metric_count', 'average', 'first_day_avg', 'last_day_avg',
+               'trend_per_day', 'doses', 'doses_evaluated', 'mean_delta', 'effective_share']
+    table = zip(
+        user_ids, k.astype(np.int64).tolist(), metric_count.astype(np.int64).tolist(),
+        _none_if_nan(average), _none_if_nan(first), _none_if_nan(last), _none_if_nan(trend, 6),
+        [doses.get(user_id, 0) for user_id in user_ids], evaluated.tolist(),
+        _none_if_nan(mean_delta), _none_if_nan(effective_share),
+    )
+    report = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'columns': columns,
+        'rows': [list(row) for row in table],
+    }
+    if include_daily:
+        matrix = np.full((n, day_count), np.nan)
+        inside = (x >= 0) & (x < day_count)
+        matrix[idx[inside], x[inside].astype(np.int64)] = y[inside]
+        report['days'] = [(np.datetime64(start, 'D') + i).item().isoformat() for i in range(day_count)]
+        report['daily_avg'] = {user_id: _none_if_nan(row) for user_id, row in zip(user_ids, matrix)}
+    return report
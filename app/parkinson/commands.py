@@ -0,0 +1,15 @@
+import click
+from flask.cli import AppGroup
+
+from .rollups import rebuild_rollups
+
+parkinson_cli = AppGroup('parkinson', help='Parkinson metric maintenance.')
+
+
+@parkinson_cli.command('rollup-backfill')
+@click.option('--user', 'user_id', default=None, help='Only rebuild this user.')
+@click.option('--batch-size', default=50000, show_default=True, help='Metrics read per query.')
+def rollup_backfill_command(user_id, batch_size):
+    """Rebuild the minute/hour/day shake rollups from raw metrics."""
+    total = rebuild_rollups(user_id, batch_size, log=click.echo)
+    click.echo(f"Rolled up {total} metrics")
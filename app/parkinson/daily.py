@@ -0,0 +1,179 @@
+"""
+Per-user daily shake series (day dates and daily averages) shared by LSTM
+training and prediction.
+
+Completed days don't change unless late metrics arrive for them, so
+``daily_series`` keeps them per user and only reads day rollup rows newer
+than the last one it holds. A day counts as completed once
+``DAILY_SERIES_SETTLE_MINUTES`` have passed since it ended, so samples
+still being flushed for it (the shake aggregator, queued ingest) are seen;
+until then it is read fresh on every call, like the current day.
+
+Metrics written through this process (``update_rollups``) cut a user's
+series back to the earliest day they touch once their transaction commits.
+Rewrites through another process (``WS_IN_PROCESS=0`` ingest workers,
+``flask parkinson rollup-backfill`` run elsewhere) are picked up when the
+series is reloaded in full, at most ``DAILY_SERIES_TTL`` seconds later.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+
+from app.models.models import db, ShakeRollupDay
+
+
+def _empty():
+    return np.empty(0, dtype='datetime64[D]'), np.empty(0)
+
+
+def _datetime(day):
+    return day.astype('datetime64[us]').item()
+
+
+def _load_days(user_id, start=None, end=None):
+    """
+    (dates, daily averages) of a user's day rollup rows with
+    ``start <= day < end``, in time order.
+    """
+    table = ShakeRollupDay.__table__
+    query = select(table.c.bucket_start, table.c.metric_count, table.c.total).where(table.c.user_id == user_id)
+    if start is not None:
+        query = query.where(table.c.bucket_start >= start)
+    if end is not None:
+        query = query.where(table.c.bucket_start < end)
+    rows = db.session.execute(query.order_by(table.c.bucket_start)).all()
+    if not rows:
+        return _empty()
+    days, counts, totals = zip(*rows)
+    return (np.array(days, dtype='datetime64[D]'),
+            np.array(totals, dtype=np.float64) / np.array(counts, dtype=np.float64))
+
+
+class DailySeriesStore:
+    """
+    Process-local LRU of users' completed days, appended to as days end.
+    """
+
+    def __init__(self, app=None, max_users=1000, settle_minutes=15, ttl=3600):
+        self.max_users = max_users
+        self.settle = timedelta(minutes=settle_minutes)
+        self.ttl = ttl
+        # user_id -> (days, values, loaded until (exclusive), monotonic time
+        # of the first read)
+        self._series = OrderedDict()
+        # Bumped by every invalidation, so reads that overlapped one aren't
+        # stored
+        self._generation = defaultdict(int)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_users = app.config.get('DAILY_SERIES_CACHE_SIZE', self.max_users)
+        self.settle = timedelta(minutes=app.config.get('DAILY_SERIES_SETTLE_MINUTES', self.settle.total_seconds() / 60))
+        self.ttl = app.config.get('DAILY_SERIES_TTL', self.ttl)
+
+    def get(self, user_id, now=None):
+        """
+        (dates as datetime64[D], daily averages) for every day of a user
+        with metrics, today included.
+        """
+        # Days before this one are complete
+        cutoff = np.datetime64((now or datetime.utcnow()) - self.settle, 'D')
+        with self._lock:
+            generation = self._generation[user_id]
+            entry = self._series.get(user_id)
+            if entry is not None:
+                self._series.move_to_end(user_id)
+        if entry is None or entry[2] > cutoff or time.monotonic() - entry[3] > self.ttl:
+            # Not loaded yet, expired, or asked about an earlier day than
+            # last time: start over
+            entry = (*_empty(), None, time.monotonic())
+        days, values, loaded_until, loaded_at = entry
+
+        if loaded_until != cutoff:
+            # Only the days completed since the last call
+            start = _datetime(loaded_until) if loaded_until is not None else None
+            new_days, new_values = _load_days(user_id, start, _datetime(cutoff))
+            days, values = np.concatenate((days, new_days)), np.concatenate((values, new_values))
+            with self._lock:
+                # Unless a write invalidated the series while we were reading
+                if self._generation[user_id] == generation:
+                    self._series[user_id] = (days, values, cutoff, loaded_at)
+                    self._series.move_to_end(user_id)
+                while len(self._series) > self.max_users:
+                    self._series.popitem(last=False)
+
+        recent_days, recent_values = _load_days(user_id, _datetime(cutoff))
+        return np.concatenate((days, recent_days)), np.concatenate((values, recent_values))
+
+    def invalidate(self, user_id, since=None):
+        """
+        Forget a user's days from ``since`` (datetime64[D]) on, or all of
+        them; they are reloaded on the next call.
+        """
+        with self._lock:
+            self._generation[user_id] += 1
+            entry = self._series.get(user_id)
+            if entry is None or (since is not None and since >= entry[2]):
+                return
+            if since is None:
+                del self._series[user_id]
+                return
+            days, values, _, loaded_at = entry
+            keep = np.searchsorted(days, since)
+            self._series[user_id] = (days[:keep], values[:keep], since, loaded_at)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            for user_id in self._generation:
+                self._generation[user_id] += 1
+
+    def __len__(self):
+        return len(self._series)
+
+
+daily_series = DailySeriesStore()
+
+
+# Earliest day per user written in the current transaction (None: all of
+# them), cut from the series on commit: invalidating before the commit
+# would let a concurrent read store the old rows as final
+_CHANGED = 'daily_series_days'
+
+
+def mark_days_written(session, user_ids, timestamps=None):
+    """
+    Record newly written metrics (parallel lists of user ids and
+    datetime64 timestamps; None for a user's whole history) for
+    invalidation when ``session`` commits.
+    """
+    changed = session.info.setdefault(_CHANGED, {})
+    if timestamps is None:
+        changed.update(dict.fromkeys(user_ids))
+        return
+    if not len(timestamps):
+        return
+    user_ids = np.asarray(user_ids)
+    for user_id in np.unique(user_ids).tolist():
+        since = timestamps[user_ids == user_id].min().astype('datetime64[D]')
+        if user_id in changed:
+            since = None if changed[user_id] is None else min(since, changed[user_id])
+        changed[user_id] = since
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written(session):
+    for user_id, since in session.info.pop(_CHANGED, {}).items():
+        daily_series.invalidate(user_id, since)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written(session):
+    session.info.pop(_CHANGED, None)
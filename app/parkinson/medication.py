@@ -0,0 +1,246 @@
+"""
+Medication response: average shake in a window before each dose versus a
+window after it.
+
+Metrics are loaded once per request, only for the time spans the doses'
+windows cover, as sorted arrays; every window is then two binary searches
+into a prefix sum, so the cost grows with the number of metrics in the
+windows rather than doses x metrics.
+
+Results for doses whose after-window closed at least
+``MEDICATION_RESPONSE_SETTLE_MINUTES`` ago are kept in ``dose_cache``.
+Metrics written through this process (``update_rollups``) drop the cached
+doses they touch; metrics for a past window that arrive through another
+process after the settle time are only picked up once the entry ages out
+of the cache. Invalidation happens when the writing transaction commits;
+a computation that overlapped the write doesn't store its result.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+
+from app.models.models import db, ParkinsonMetric, MedicationLog
+
+
+class DoseResponseCache:
+    """
+    Process-local LRU of per-dose results keyed by (user_id, dose time,
+    before, after). A cached value of None means the dose had no data on
+    one side.
+    """
+
+    def __init__(self, app=None, max_entries=100000):
+        self.max_entries = max_entries
+        self.settle = timedelta(minutes=10)
+        self._entries = OrderedDict()
+        self._by_user = defaultdict(set)
+        # Latest window end cached per user; writes after it can't matter
+        self._horizon = {}
+        # Bumped by every invalidation, so results computed across one
+        # aren't stored
+        self._generation = defaultdict(int)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('MEDICATION_RESPONSE_CACHE_SIZE', self.max_entries)
+        self.settle = timedelta(minutes=app.config.get('MEDICATION_RESPONSE_SETTLE_MINUTES', 10))
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def generation(self, user_id):
+        return self._generation[user_id]
+
+    def put(self, key, value, generation=None):
+        user_id, dose, _, after = key
+        with self._lock:
+            if generation is not None and generation != self._generation[user_id]:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._by_user[user_id].add(key)
+            self._horizon[user_id] = max(self._horizon.get(user_id, dose), dose + after)
+            while len(self._entries) > self.max_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._by_user[old[0]].discard(old)
+
+    def invalidate(self, user_id, start, end):
+        """
+        Forget cached doses of ``user_id`` whose windows overlap
+        ``[start, end]``.
+        """
+        with self._lock:
+            self._generation[user_id] += 1
+            horizon = self._horizon.get(user_id)
+            if horizon is None or start >= horizon:
+                return
+            for key in list(self._by_user[user_id]):
+                _, dose, before, after = key
+                if dose - before <= end and start < dose + after:
+                    del self._entries[key]
+                    self._by_user[user_id].discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._horizon.clear()
+            for user_id in self._generation:
+                self._generation[user_id] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+dose_cache = DoseResponseCache()
+
+
+def _merge_spans(doses, before, after):
+    spans = []
+    for dose in doses:
+        lo, hi = dose - before, dose + after
+        if spans and lo <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], hi)
+        else:
+            spans.append([lo, hi])
+    return spans
+
+
+def _load_metrics(user_id, spans):
+    """
+    (timestamps in us, shake values) of a user's metrics inside ``spans``,
+    sorted by time, NaN-free.
+    """
+    table = ParkinsonMetric.__table__
+    times, values = [], []
+    # One (user_id, timestamp) index range scan per span; OR-ing spans
+    # together makes planners fall back to scanning all of the user's rows
+    for start, end in spans:
+        rows = db.session.execute(
+            select(table.c.timestamp, table.c.shake_per_minute)
+            .where(table.c.user_id == user_id, table.c.timestamp >= start, table.c.timestamp < end)
+            .order_by(table.c.timestamp)
+        ).all()
+        if rows:
+            batch_times, batch_values = zip(*rows)
+            times.append(np.array(batch_times, dtype='datetime64[us]').astype(np.int64))
+            values.append(np.array(batch_values, dtype=np.float64))
+    if not times:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    times, values = np.concatenate(times), np.concatenate(values)
+    keep = ~np.isnan(values)
+    return times[keep], values[keep]
+
+
+def _window_means(times, prefix, starts, ends):
+    lo = np.searchsorted(times, starts, side='left')
+    hi = np.searchsorted(times, ends, side='left')
+    counts = hi - lo
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (prefix[hi] - prefix[lo]) / counts, counts
+
+
+def compute_responses(user_id, doses, before, after):
+    """
+    Before/after averages for sorted dose datetimes, as a list aligned
+    with ``doses`` holding a result dict, or None where either window has
+    no metrics.
+    """
+    if not doses:
+        return []
+    times, values = _load_metrics(user_id, _merge_spans(doses, before, after))
+    prefix = np.concatenate(([0.0], np.cumsum(values)))
+    dose_us = np.array(doses, dtype='datetime64[us]').astype(np.int64)
+    before_us = int(before / timedelta(microseconds=1))
+    after_us = int(after / timedelta(microseconds=1))
+    before_avg, before_n = _window_means(times, prefix, dose_us - before_us, dose_us)
+    after_avg, after_n = _window_means(times, prefix, dose_us, dose_us + after_us)
+
+    results = []
+    for dose, b_avg, b_n, a_avg, a_n in zip(doses, before_avg.tolist(), before_n.tolist(),
+                                            after_avg.tolist(), after_n.tolist()):
+        if not b_n or not a_n:
+            results.append(None)
+            continue
+        results.append({
+            "med_time": dose.isoformat(),
+            "before_avg": round(b_avg, 2),
+            "after_avg": round(a_avg, 2),
+            "delta": round(b_avg - a_avg, 2),
+            "effective": b_avg > a_avg
+        })
+    return results
+
+
+def medication_responses(user_id, before, after, now=None):
+    """
+    Results for every logged dose of a user that has data on both sides,
+    oldest first, served from ``dose_cache`` where possible.
+    """
+    now = now or datetime.utcnow()
+    generation = dose_cache.generation(user_id)
+    doses = db.session.execute(
+        select(MedicationLog.timestamp)
+        .where(MedicationLog.user_id == user_id)
+        .order_by(MedicationLog.timestamp)
+    ).scalars().all()
+
+    results = {}
+    missing = []
+    for dose in doses:
+        try:
+            results[dose] = dose_cache.get((user_id, dose, before, after))
+        except KeyError:
+            missing.append(dose)
+
+    for dose, result in zip(missing, compute_responses(user_id, missing, before, after)):
+        results[dose] = result
+        if dose + after <= now - dose_cache.settle:
+            # The window is over: its result won't change any more
+            dose_cache.put((user_id, dose, before, after), result, generation)
+
+    return [results[dose] for dose in doses if results[dose] is not None]
+
+
+# Metric time spans per user written in the current transaction, dropped
+# from the cache on commit: invalidating before the commit would let a
+# concurrent request recompute from the old rows and cache that for good
+_CHANGED = 'dose_cache_spans'
+
+
+def mark_metrics_written(session, user_ids, timestamps):
+    """
+    Record newly written metrics (parallel lists of user ids and
+    datetime64 timestamps) for invalidation when ``session`` commits.
+    """
+    if not len(timestamps):
+        return
+    spans = session.info.setdefault(_CHANGED, {})
+    user_ids = np.asarray(user_ids)
+    for user_id in np.unique(user_ids).tolist():
+        mine = timestamps[user_ids == user_id]
+        start, end = mine.min(), mine.max()
+        if user_id in spans:
+            start, end = min(start, spans[user_id][0]), max(end, spans[user_id][1])
+        spans[user_id] = (start, end)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written(session):
+    for user_id, (start, end) in session.info.pop(_CHANGED, {}).items():
+        dose_cache.invalidate(user_id, start.item(), end.item())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written(session):
+    session.info.pop(_CHANGED, None)
@@ -0,0 +1,352 @@
+"""
+Minute, hour and day rollups of ParkinsonMetric.
+
+Every path that writes ParkinsonMetric rows (/parkinson/log, /log-batch and
+the WebSocket shake aggregator) calls ``update_rollups`` in the same
+transaction, which adds the rows' count, sum, min and max to the matching
+bucket of each rollup table with a single upsert per table; a metric changed
+in place calls ``refresh_rollups`` to recompute its buckets. Analytics read
+the coarsest table that answers their question instead of raw metrics.
+``flask parkinson rollup-backfill`` rebuilds the tables from raw metrics.
+"""
+import numpy as np
+from sqlalchemy import select, delete, func, and_, or_, cast, extract, text, literal, BigInteger
+
+from app.models.models import (
+    db, ParkinsonMetric, ShakeRollupMinute, ShakeRollupHour, ShakeRollupDay
+)
+from app.parkinson.medication import mark_metrics_written
+from app.parkinson.daily import mark_days_written
+from app.parkinson.cache import mark_changed
+
+# name -> (model, numpy datetime unit, bucket length in seconds), finest first
+RESOLUTIONS = {
+    'minute': (ShakeRollupMinute, 'm', 60),
+    'hour': (ShakeRollupHour, 'h', 3600),
+    'day': (ShakeRollupDay, 'D', 86400),
+}
+# Bucket sizes the shake series endpoints accept, in seconds
+SERIES_STEPS = {'minute': 60, '5min': 300, 'hour': 3600, 'day': 86400}
+
+
+def summarize(user_ids, timestamps, values, unit):
+    """
+    Group metrics by (user, bucket) and return rollup row dicts.
+    ``timestamps`` is datetime64, ``values`` float; NaN values are skipped.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    keep = ~np.isnan(values)
+    users, codes = np.unique(np.asarray(user_ids, dtype=object)[keep], return_inverse=True)
+    buckets = np.asarray(timestamps)[keep].astype(f'datetime64[{unit}]')
+    values = values[keep]
+    if not len(values):
+        return []
+
+    order = np.lexsort((buckets, codes))
+    codes, buckets, values = codes[order], buckets[order], values[order]
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (buckets[1:] != buckets[:-1])])
+    counts = np.diff(np.r_[starts, len(values)])
+    return [
+        {
+            'user_id': users[code],
+            'bucket_start': bucket,
+            'metric_count': count,
+            'total': total,
+            'min_value': low,
+            'max_value': high,
+        }
+        for code, bucket, count, total, low, high in zip(
+            codes[starts].tolist(),
+            buckets[starts].astype('datetime64[us]').tolist(),
+            counts.tolist(),
+            np.add.reduceat(values, starts).tolist(),
+            np.minimum.reduceat(values, starts).tolist(),
+            np.maximum.reduceat(values, starts).tolist())
+    ]
+
+
+def update_rollups(rows):
+    """
+    Fold newly written ParkinsonMetric rows (dicts with user_id, timestamp
+    and shake_per_minute) into every rollup table. Call it inside the
+    transaction that writes the rows; the caller commits.
+    """
+    if not rows:
+        return
+    user_ids = [row['user_id'] for row in rows]
+    timestamps = np.array([row['timestamp'] for row in rows], dtype='datetime64[us]')
+    values = np.array([row['shake_per_minute'] for row in rows], dtype=np.float64)
+    for model, unit, _ in RESOLUTIONS.values():
+        _upsert(model.__table__, summarize(user_ids, timestamps, values, unit))
+    # Cached medication responses, daily series and analytics responses
+    # covering these times are dropped when this transaction commits
+    mark_metrics_written(db.session, user_ids, timestamps)
+    mark_days_written(db.session, user_ids, timestamps)
+    mark_changed(db.session, user_ids)
+
+
+def refresh_rollups(user_ids, timestamps):
+    """
+    Recompute the rollup buckets holding ``timestamps`` from raw metrics,
+    for metrics that were changed in place rather than added (a min or max
+    can't be taken back out of a bucket). Call it inside the transaction
+    that changed them; the caller commits.
+    """
+    if not user_ids:
+        return
+    metrics = ParkinsonMetric.__table__
+    timestamps = np.array(timestamps, dtype='datetime64[us]')
+    for model, unit, seconds in RESOLUTIONS.values():
+        table = model.__table__
+        starts = timestamps.astype(f'datetime64[{unit}]').astype('datetime64[us]')
+        for user_id, start in sorted(set(zip(user_ids, starts.tolist()))):
+            end = (np.datetime64(start, 'us') + np.timedelta64(seconds, 's')).item()
+            db.session.execute(delete(table).where(
+                and_(table.c.user_id == user_id, table.c.bucket_start == start)))
+            rows = db.session.execute(
+                select(metrics.c.timestamp, metrics.c.shake_per_minute)
+                .where(metrics.c.user_id == user_id, metrics.c.timestamp >= start, metrics.c.timestamp < end)
+            ).all()
+            if not rows:
+                continue
+            times, values = zip(*rows)
+            buckets = summarize([user_id] * len(rows), np.array(times, dtype='datetime64[us]'), values, unit)
+            if buckets:
+                db.session.execute(table.insert(), buckets)
+    mark_metrics_written(db.session, user_ids, timestamps)
+    mark_days_written(db.session, user_ids, timestamps)
+    mark_changed(db.session, user_ids)
+
+
+def _upsert(table, rows):
+    """
+    Add ``rows`` to existing buckets or insert them, in one statement where
+    the database supports it, so concurrent writers never lose an update.
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    c = table.c
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+            least, greatest = func.min, func.max
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+            least, greatest = func.least, func.greatest
+        stmt = insert(table)
+        new = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.user_id, c.bucket_start],
+            set_={
+                'metric_count': c.metric_count + new.metric_count,
+                'total': c.total + new.total,
+                'min_value': least(c.min_value, new.min_value),
+                'max_value': greatest(c.max_value, new.max_value),
+            })
+        db.session.execute(stmt, rows)
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        new = stmt.inserted
+        stmt = stmt.on_duplicate_key_update(
+            metric_count=c.metric_count + new.metric_count,
+            total=c.total + new.total,
+            min_value=func.least(c.min_value, new.min_value),
+            max_value=func.greatest(c.max_value, new.max_value))
+        db.session.execute(stmt, rows)
+    else:
+        # Read-merge-write for other databases
+        for row in rows:
+            key = and_(c.user_id == row['user_id'], c.bucket_start == row['bucket_start'])
+            current = db.session.execute(select(table).where(key)).mappings().first()
+            if current is None:
+                db.session.execute(table.insert(), row)
+            else:
+                db.session.execute(table.update().where(key).values(
+                    metric_count=current['metric_count'] + row['metric_count'],
+                    total=current['total'] + row['total'],
+                    min_value=min(current['min_value'], row['min_value']),
+                    max_value=max(current['max_value'], row['max_value'])))
+
+
+def coarsest_resolution(step_seconds, start=None, end=None):
+    """
+    Name of the coarsest rollup whose buckets fit evenly into ``step_seconds``
+    and line up with the ``start``/``end`` bounds, or None if only raw
+    metrics can answer.
+    """
+    for name, (_, unit, seconds) in reversed(RESOLUTIONS.items()):
+        if step_seconds % seconds:
+            continue
+        aligned = all(
+            bound is None or np.datetime64(bound, 'us') == np.datetime64(bound, unit)
+            for bound in (start, end)
+        )
+        if aligned:
+            return name
+    return None
+
+
+def rollup_columns(user_id, resolution, start=None, end=None):
+    """
+    Rollup rows of one user in time order, optionally limited to
+    ``start <= bucket_start < end``, as a dict of arrays straight from the
+    result tuples: 't' (bucket start, int64 microseconds since the Unix
+    epoch), 'count', 'average', 'min' and 'max'.
+    """
+    table = RESOLUTIONS[resolution][0].__table__
+    query = select(table.c.bucket_start, table.c.metric_count, table.c.total,
+                   table.c.min_value, table.c.max_value).where(table.c.user_id == user_id)
+    if start is not None:
+        query = query.where(table.c.bucket_start >= start)
+    if end is not None:
+        query = query.where(table.c.bucket_start < end)
+    rows = db.session.execute(query.order_by(table.c.bucket_start)).all()
+
+    starts, counts, totals, mins, maxes = zip(*rows) if rows else ((),) * 5
+    return _series(np.array(starts, dtype='datetime64[us]').astype(np.int64), counts, totals, mins, maxes)
+
+
+def _series(times_us, counts, totals, mins, maxes):
+    counts = np.array(counts, dtype=np.int64)
+    return {
+        't': times_us,
+        'count': counts,
+        'average': np.array(totals, dtype=np.float64) / np.maximum(counts, 1),
+        'min': np.array(mins, dtype=np.float64),
+        'max': np.array(maxes, dtype=np.float64),
+    }
+
+
+def _bucket_index(column, step_seconds):
+    """
+    SQL expression numbering ``step_seconds`` buckets since the Unix epoch
+    (UTC, as stored) for a naive DateTime column, or None on databases
+    without one (shake_series then buckets in Python).
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        seconds = cast(func.strftime('%s', column), BigInteger)
+    elif dialect == 'postgresql':
+        seconds = cast(func.floor(extract('epoch', column)), BigInteger)
+    elif dialect == 'mysql':
+        # TIMESTAMPDIFF, unlike UNIX_TIMESTAMP, ignores the session time zone
+        seconds = func.timestampdiff(text('SECOND'), '1970-01-01', column)
+    else:
+        return None
+    # Floor division: "/" would be true division in SQL too
+    return seconds // step_seconds
+
+
+def shake_series(user_id, step_seconds, start=None, end=None):
+    """
+    Shake count/average/min/max per ``step_seconds`` bucket (aligned to the
+    Unix epoch) in ``start <= t < end``, as rollup_columns-style arrays.
+
+    Reads the coarsest rollup table whose buckets fit the step and the
+    bounds; if that table's buckets are the step it is read as is,
+    otherwise the database groups its rows (or, for bounds finer than a
+    minute, the raw metrics) into steps and returns only the aggregates.
+    """
+    name = coarsest_resolution(step_seconds, start, end)
+    if name is not None and RESOLUTIONS[name][2] == step_seconds:
+        return rollup_columns(user_id, name, start, end)
+
+    if name is not None:
+        table = RESOLUTIONS[name][0].__table__
+        time_column = table.c.bucket_start
+        count, total = func.sum(table.c.metric_count), func.sum(table.c.total)
+        low, high = func.min(table.c.min_value), func.max(table.c.max_value)
+    else:
+        table = ParkinsonMetric.__table__
+        time_column = table.c.timestamp
+        count, total = func.count(table.c.shake_per_minute), func.sum(table.c.shake_per_minute)
+        low, high = func.min(table.c.shake_per_minute), func.max(table.c.shake_per_minute)
+
+    bucket = _bucket_index(time_column, step_seconds)
+    if bucket is None:
+        return _group_series(table, time_column, user_id, step_seconds, start, end)
+    bucket = bucket.label('bucket')
+    query = select(bucket, count, total, low, high).where(table.c.user_id == user_id)
+    if start is not None:
+        query = query.where(time_column >= start)
+    if end is not None:
+        query = query.where(time_column < end)
+    rows = db.session.execute(query.group_by(bucket).order_by(bucket)).all()
+
+    buckets, counts, totals, mins, maxes = zip(*rows) if rows else ((),) * 5
+    times_us = np.array(buckets, dtype=np.int64) * (step_seconds * 1_000_000)
+    return _series(times_us, counts, totals, mins, maxes)
+
+
+def _group_series(table, time_column, user_id, step_seconds, start, end):
+    """
+    shake_series for databases without a bucket expression: read the rows
+    in the range and group them into steps with NumPy.
+    """
+    if table is ParkinsonMetric.__table__:
+        value = table.c.shake_per_minute
+        columns = (time_column, literal(1), value, value, value)
+    else:
+        columns = (time_column, table.c.metric_count, table.c.total, table.c.min_value, table.c.max_value)
+    query = select(*columns).where(table.c.user_id == user_id)
+    if start is not None:
+        query = query.where(time_column >= start)
+    if end is not None:
+        query = query.where(time_column < end)
+    rows = db.session.execute(query.order_by(time_column)).all()
+    if not rows:
+        return _series(np.array([], dtype=np.int64), (), (), (), ())
+
+    times, counts, totals, mins, maxes = zip(*rows)
+    step_us = step_seconds * 1_000_000
+    buckets = np.array(times, dtype='datetime64[us]').astype(np.int64) // step_us
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    return _series(
+        buckets[starts] * step_us,
+        np.add.reduceat(np.array(counts, dtype=np.int64), starts),
+        np.add.reduceat(np.array(totals, dtype=np.float64), starts),
+        np.minimum.reduceat(np.array(mins, dtype=np.float64), starts),
+        np.maximum.reduceat(np.array(maxes, dtype=np.float64), starts))
+
+
+def rebuild_rollups(user_id=None, batch_size=50000, log=print):
+    """
+    Recompute the rollup tables from raw ParkinsonMetric rows, one user per
+    transaction. Returns the number of metrics read.
+    """
+    metrics = ParkinsonMetric.__table__
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = db.session.execute(select(metrics.c.user_id).distinct()).scalars().all()
+
+    total = 0
+    for current in user_ids:
+        for model, _, _ in RESOLUTIONS.values():
+            db.session.execute(delete(model.__table__).where(model.__table__.c.user_id == current))
+        mark_days_written(db.session, [current])
+        last = None
+        count = 0
+        while True:
+            query = (
+                select(metrics.c.id, metrics.c.user_id, metrics.c.timestamp, metrics.c.shake_per_minute)
+                .where(metrics.c.user_id == current)
+                .order_by(metrics.c.timestamp, metrics.c.id)
+                .limit(batch_size)
+            )
+            if last is not None:
+                query = query.where(or_(
+                    metrics.c.timestamp > last[0],
+                    and_(metrics.c.timestamp == last[0], metrics.c.id > last[1])))
+            batch = db.session.execute(query).mappings().all()
+            if not batch:
+                break
+            update_rollups(batch)
+            last = (batch[-1]['timestamp'], batch[-1]['id'])
+            count += len(batch)
+        db.session.commit()
+        total += count
+        log(f"{current}: rolled up {count} metrics")
+    return total
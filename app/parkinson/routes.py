@@ -1,15 +1,28 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime, timedelta
-from statistics import mean
+import uuid
+
+import numpy as np
 
 from app.models.models import db, ParkinsonMetric, User, MedicationLog
-from app.utils.shake_analysis import calculate_shake
+from app.utils.shake_analysis import calculate_shake, calculate_shake_batch
+from app.parkinson.rollups import update_rollups, shake_series, SERIES_STEPS
+from app.devices.chunks import parse_timestamp
+from app.parkinson.medication import medication_responses
+from app.parkinson.cohort import cohort_user_ids, cohort_report
+from app.parkinson.daily import daily_series
+from app.parkinson.cache import response_cache
+from app.utils.columnar import columnar_format, columnar_response
 import os
 from tensorflow.keras.models import load_model
-from app.utils.progress_lstm import train_lstm_model, build_lstm_data, MODEL_DIR
+from app.utils.progress_lstm import train_lstm_model, lstm_windows, MODEL_DIR, TIMESTEPS
 
 parkinson_bp = Blueprint('parkinson', __name__, url_prefix='/parkinson')
 
+SHAKE_COLUMNS = ['accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z']
+# Binary /log-batch record: int64 epoch milliseconds + 6 float32, little-endian (32 bytes)
+BATCH_RECORD_DTYPE = np.dtype([('t', '<i8')] + [(name, '<f4') for name in SHAKE_COLUMNS])
+
 
 @parkinson_bp.route('/log', methods=['POST'])
 def log_shake_data():
@@ -32,6 +45,7 @@ def log_shake_data():
             shake_per_minute=shake
         )
         db.session.add(metric)
+        update_rollups([{'user_id': user_id, 'timestamp': metric.timestamp, 'shake_per_minute': shake}])
         db.session.commit()
 
         return jsonify(metric.to_dict()), 201
@@ -39,59 +53,219 @@ def log_shake_data():
         return jsonify({'error': str(e)}), 500
 
 
+def _parse_batch_timestamps(values, count):
+    """
+    Timestamps for a JSON batch: epoch milliseconds or ISO 8601 strings,
+    defaulting to now for every sample.
+    """
+    if values is None:
+        return np.full(count, np.datetime64(datetime.utcnow(), 'us'))
+    if len(values) != count:
+        raise ValueError("timestamps must have one entry per sample")
+    if count and isinstance(values[0], str):
+        return np.array([v[:-1] if v.endswith('Z') else v for v in values], dtype='datetime64[us]')
+    return np.asarray(values, dtype=np.int64).astype('datetime64[ms]').astype('datetime64[us]')
+
+
+@parkinson_bp.route('/log-batch', methods=['POST'])
+def log_shake_batch():
+    """
+    Log many samples in one request and one transaction.
+
+    JSON body: {"user_id": ..., "samples": [[ax, ay, az, gx, gy, gz], ...],
+    "timestamps": [...]} or one array per column ("accel_x": [...], ...);
+    timestamps are optional epoch milliseconds or ISO 8601 strings.
+    Binary body (Content-Type: application/octet-stream, ?user_id=...):
+    packed BATCH_RECORD_DTYPE records.
+    """
+    max_samples = current_app.config.get('PARKINSON_BATCH_MAX_SAMPLES', 500000)
+    too_many = f'Too many samples; the limit is {max_samples}'
+    try:
+        if request.mimetype == 'application/octet-stream':
+            user_id = request.args.get('user_id')
+            body = request.get_data()
+            if len(body) % BATCH_RECORD_DTYPE.itemsize:
+                return jsonify({'error': f'Body must be a whole number of {BATCH_RECORD_DTYPE.itemsize}-byte records'}), 400
+            if len(body) // BATCH_RECORD_DTYPE.itemsize > max_samples:
+                return jsonify({'error': too_many}), 413
+            records = np.frombuffer(body, dtype=BATCH_RECORD_DTYPE)
+            shake = calculate_shake_batch(*(records[name] for name in SHAKE_COLUMNS))
+            timestamps = records['t'].astype('datetime64[ms]').astype('datetime64[us]')
+        else:
+            data = request.get_json(silent=True) or {}
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Body must be a JSON object'}), 400
+            user_id = data.get('user_id')
+            if 'samples' in data:
+                if not isinstance(data['samples'], list):
+                    return jsonify({'error': '"samples" must be a list of 6-value samples'}), 400
+                if len(data['samples']) > max_samples:
+                    return jsonify({'error': too_many}), 413
+                samples = np.asarray(data['samples'] or np.empty((0, len(SHAKE_COLUMNS))), dtype=np.float64)
+                if samples.ndim != 2 or samples.shape[1] != len(SHAKE_COLUMNS):
+                    return jsonify({'error': '"samples" must be a list of 6-value samples'}), 400
+                shake = calculate_shake_batch(samples)
+            elif all(name in data for name in SHAKE_COLUMNS):
+                columns = [data[name] for name in SHAKE_COLUMNS]
+                if not all(isinstance(column, list) for column in columns) \
+                        or len({len(column) for column in columns}) != 1:
+                    return jsonify({'error': 'Sensor axis arrays must be lists of equal length'}), 400
+                if len(columns[0]) > max_samples:
+                    return jsonify({'error': too_many}), 413
+                shake = calculate_shake_batch(*(np.asarray(column, dtype=np.float64) for column in columns))
+            else:
+                return jsonify({'error': 'Provide "samples" or one array per sensor axis'}), 400
+            timestamps = _parse_batch_timestamps(data.get('timestamps'), len(shake))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid batch: {e}'}), 400
+
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    if not len(shake):
+        return jsonify({'error': 'No samples provided'}), 400
+    if not User.query.get(user_id):
+        return jsonify({'error': 'User not found'}), 404
+
+    rows = [
+        {'id': str(uuid.uuid4()), 'user_id': user_id, 'timestamp': ts, 'shake_per_minute': value}
+        for ts, value in zip(timestamps.tolist(), shake.tolist())
+    ]
+    try:
+        db.session.execute(ParkinsonMetric.__table__.insert(), rows)
+        update_rollups(rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'inserted': len(rows),
+        'first_timestamp': timestamps.min().item().isoformat(),
+        'last_timestamp': timestamps.max().item().isoformat()
+    }), 201
+
+
+def _series_params(default_resolution):
+    """
+    (start, end, resolution) from the start/end (ISO 8601) and resolution
+    query parameters; raises ValueError on bad input.
+    """
+    resolution = request.args.get('resolution', default_resolution)
+    if resolution not in SERIES_STEPS:
+        raise ValueError(f'Unknown resolution "{resolution}"; use one of {", ".join(SERIES_STEPS)}')
+    start = parse_timestamp(request.args['start']) if request.args.get('start') else None
+    end = parse_timestamp(request.args['end']) if request.args.get('end') else None
+    if start is not None and end is not None and end <= start:
+        raise ValueError('"end" must be after "start"')
+    return start, end, resolution
+
+
+def _series_columns(series):
+    # Binary payload: bucket start times and one array per statistic
+    return {'t': series['t'], 'shake': series['average'], 'count': series['count'],
+            'min': series['min'], 'max': series['max']}
+
+
 @parkinson_bp.route('/<user_id>/shake-by-minute', methods=['GET'])
+@response_cache.cached('shake-by-minute')
 def get_shake_by_minute(user_id):
+    """
+    Average shake per time bucket, aggregated by the database.
+
+    ``day=YYYY-MM-DD`` returns that day keyed by "HH:MM". ``start``/``end``
+    (ISO 8601) select any range instead and return a list of buckets with
+    count, avg, min and max. ``resolution`` is minute (default), 5min,
+    hour or day.
+    """
     day_str = request.args.get('day')  # expected format: YYYY-MM-DD
-    if not day_str:
-        return jsonify({'error': 'Missing "day" query parameter'}), 400
+    if not day_str and not request.args.get('start'):
+        return jsonify({'error': 'Missing "day" or "start" query parameter'}), 400
 
     try:
-        day = datetime.strptime(day_str, "%Y-%m-%d")
-    except ValueError:
-        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
+        start, end, resolution = _series_params('minute')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid range: {e}'}), 400
+    if day_str:
+        try:
+            start = datetime.strptime(day_str, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
+        end = start + timedelta(days=1)
 
-    next_day = day + timedelta(days=1)
-
-    metrics = (
-        ParkinsonMetric.query
-        .filter(ParkinsonMetric.user_id == user_id,
-                ParkinsonMetric.timestamp >= day,
-                ParkinsonMetric.timestamp < next_day)
-        .order_by(ParkinsonMetric.timestamp)
-        .all()
-    )
-
-    results = {}
-    for m in metrics:
-        key = m.timestamp.strftime("%H:%M")
-        results.setdefault(key, []).append(m.shake_per_minute)
+    try:
+        fmt = columnar_format()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 406
+
+    # GROUP BY on the coarsest rollup that fits; only aggregate rows come back
+    series = shake_series(user_id, SERIES_STEPS[resolution], start, end)
+    if fmt:
+        return columnar_response(_series_columns(series), fmt, meta={'resolution': resolution})
+
+    times = series['t'].astype('datetime64[us]').tolist()
+    if day_str:
+        return jsonify({
+            bucket_start.strftime("%H:%M"): average
+            for bucket_start, average in zip(times, series['average'].tolist())
+        })
 
-    summarized = {k: sum(v) / len(v) for k, v in results.items()}
-    return jsonify(summarized)
+    return jsonify({
+        'resolution': resolution,
+        'buckets': [
+            {'bucket_start': bucket_start.isoformat(), 'count': count,
+             'avg': average, 'min': low, 'max': high}
+            for bucket_start, count, average, low, high in zip(
+                times, series['count'].tolist(), series['average'].tolist(),
+                series['min'].tolist(), series['max'].tolist())
+        ]
+    })
 
 
 @parkinson_bp.route('/<user_id>/medication-effect', methods=['GET'])
+@response_cache.cached('medication-effect')
 def analyze_medication_effect(user_id):
+    """
+    The user's medications and their average shake per day over all of
+    their history, or per ``resolution`` bucket between ``start`` and
+    ``end`` (ISO 8601) when given.
+    """
     user = User.query.get(user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    meds = user.get_medicamente()
-    metrics = ParkinsonMetric.query.filter_by(user_id=user_id).all()
-
-    timeline = {}
-    for m in metrics:
-        date = m.timestamp.date().isoformat()
-        timeline.setdefault(date, []).append(m.shake_per_minute)
+    try:
+        start, end, resolution = _series_params('day')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid range: {e}'}), 400
 
-    analysis = {
-        date: sum(vals) / len(vals)
-        for date, vals in timeline.items()
-    }
+    meds = user.get_medicamente()
+    try:
+        fmt = columnar_format()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 406
+
+    series = shake_series(user_id, SERIES_STEPS[resolution], start, end)
+    if fmt:
+        return columnar_response(_series_columns(series), fmt,
+                                 meta={'medications': meds, 'resolution': resolution})
+
+    times = series['t'].astype('datetime64[us]').tolist()
+    if resolution == 'day':
+        return jsonify({
+            "medications": meds,
+            "daily_shake_avg": {
+                bucket_start.date().isoformat(): average
+                for bucket_start, average in zip(times, series['average'].tolist())
+            }
+        })
 
     return jsonify({
         "medications": meds,
-        "daily_shake_avg": analysis
+        "resolution": resolution,
+        "shake_avg": {
+            bucket_start.isoformat(): average
+            for bucket_start, average in zip(times, series['average'].tolist())
+        }
     })
 
 
@@ -124,42 +298,25 @@ def log_medication(user_id):
 
 
 @parkinson_bp.route('/<user_id>/medication-response', methods=['GET'])
+@response_cache.cached('medication-response')
 def medication_response(user_id):
     """
     Check if medication was effective after each intake.
-    Compares 30 minutes before vs 90 minutes after medication log.
+    Compares the average shake in the ``before`` minutes (default 30)
+    before each medication log with the ``after`` minutes (default 90)
+    after it.
     """
     user = User.query.get(user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    logs = MedicationLog.query.filter_by(user_id=user_id).all()
-    metrics = ParkinsonMetric.query.filter_by(user_id=user_id).all()
-
-    response = []
-
-    for log in logs:
-        before = [
-            m.shake_per_minute
-            for m in metrics
-            if log.timestamp - timedelta(minutes=30) <= m.timestamp < log.timestamp
-        ]
-        after = [
-            m.shake_per_minute
-            for m in metrics
-            if log.timestamp <= m.timestamp < log.timestamp + timedelta(minutes=90)
-        ]
+    before = request.args.get('before', 30, type=int)
+    after = request.args.get('after', 90, type=int)
+    if not (0 < before <= 1440 and 0 < after <= 1440):
+        return jsonify({'error': '"before" and "after" must be between 1 and 1440 minutes'}), 400
 
-        if before and after:
-            before_avg = mean(before)
-            after_avg = mean(after)
-            response.append({
-                "med_time": log.timestamp.isoformat(),
-                "before_avg": round(before_avg, 2),
-                "after_avg": round(after_avg, 2),
-                "delta": round(before_avg - after_avg, 2),
-                "effective": before_avg > after_avg
-            })
+    # Sorted arrays + prefix sums; settled doses come from the cache
+    response = medication_responses(user_id, timedelta(minutes=before), timedelta(minutes=after))
 
     return jsonify({
         "medication_response": response
@@ -167,6 +324,48 @@ def medication_response(user_id):
 
 
 
+@parkinson_bp.route('/cohort', methods=['POST'])
+def cohort_analytics():
+    """
+    One table for many patients: pass "user_ids" and/or "device_type"
+    (every user with such a device), an optional "start"/"end" (ISO 8601,
+    default the last 30 days, rounded down to whole days), "before"/"after"
+    medication windows in minutes and "daily": true for the full daily
+    average matrix.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    user_ids = data.get('user_ids') or []
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+        return jsonify({'error': '"user_ids" must be a list of strings'}), 400
+    if not isinstance(data.get('device_type') or '', str):
+        return jsonify({'error': '"device_type" must be a string'}), 400
+    user_ids = cohort_user_ids(user_ids, data.get('device_type'))
+    if not user_ids:
+        return jsonify({'error': 'Provide "user_ids" or a "device_type" with users'}), 400
+
+    try:
+        end = parse_timestamp(data['end']) if data.get('end') else datetime.utcnow() + timedelta(days=1)
+        end = datetime.combine(end.date(), datetime.min.time())
+        start = parse_timestamp(data['start']) if data.get('start') else end - timedelta(days=30)
+        start = datetime.combine(start.date(), datetime.min.time())
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid range: {e}'}), 400
+    if end <= start:
+        return jsonify({'error': '"end" must be after "start"'}), 400
+
+    before = data.get('before', 30)
+    after = data.get('after', 90)
+    if not all(isinstance(v, int) and 0 < v <= 1440 for v in (before, after)):
+        return jsonify({'error': '"before" and "after" must be between 1 and 1440 minutes'}), 400
+
+    # Two aggregate queries for the whole cohort, then NumPy group-bys
+    report = cohort_report(user_ids, start, end, timedelta(minutes=before), timedelta(minutes=after),
+                           include_daily=bool(data.get('daily')))
+    return jsonify(report)
+
+
 @parkinson_bp.route('/<user_id>/train-progress-lstm', methods=['POST'])
 def train_progress_lstm(user_id):
     """
@@ -177,12 +376,16 @@ def train_progress_lstm(user_id):
 
     try:
         model_path = train_lstm_model(user_id)
+        # Predictions cached from the previous model are stale
+        response_cache.bump([user_id])
         return jsonify({'message': 'LSTM model trained', 'model_path': model_path}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @parkinson_bp.route('/<user_id>/predict-progress-lstm', methods=['GET'])
+# The default date is today, so the answer also changes at midnight
+@response_cache.cached('predict-progress-lstm', vary=lambda: datetime.utcnow().date())
 def predict_progress_lstm(user_id):
     """
     Predict if user is better or worse for a given date (YYYY-MM-DD), default today.
@@ -198,9 +401,9 @@ def predict_progress_lstm(user_id):
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
 
-    # Build daily sequence data
-    X, _ = build_lstm_data(user_id)
-    if X is None:
+    # One read of the daily series serves both the date lookup and the window
+    days, shakes = daily_series.get(user_id)
+    if len(shakes) < TIMESTEPS + 1:
         return jsonify({'error': 'Not enough data for prediction'}), 400
 
     # Load model file
@@ -209,22 +412,14 @@ def predict_progress_lstm(user_id):
         return jsonify({'error': 'Model not trained. Call /train-progress-lstm first.'}), 400
     model = load_model(model_file)
 
-    # Map dates to sequence indices
-    qs = ParkinsonMetric.query.filter_by(user_id=user_id) \
-                              .order_by(ParkinsonMetric.timestamp).all()
-    df = pd.DataFrame([{'date': m.timestamp.date(), 'shake': m.shake_per_minute}
-                       for m in qs])
-    daily = df.groupby('date').shake.mean().sort_index().reset_index()
-    dates = list(daily.date.values)
-
-    if target_date not in dates:
+    # Map the date to its position in the sorted series
+    idx = int(np.searchsorted(days, np.datetime64(target_date, 'D')))
+    if idx == len(days) or days[idx] != np.datetime64(target_date, 'D'):
         return jsonify({'error': f'No data for {target_date}'}), 400
-    idx = dates.index(target_date)
-    timesteps = X.shape[1]
-    if idx < timesteps:
+    if idx < TIMESTEPS:
         return jsonify({'error': 'Insufficient history for prediction'}), 400
 
-    seq = daily.shake.values[idx-timesteps:idx].reshape(1, timesteps, 1)
+    seq = lstm_windows(shakes[idx - TIMESTEPS:idx])
     prob = float(model.predict(seq)[0][0])
     label = 'better' if prob >= 0.5 else 'worse'
 
@@ -0,0 +1,181 @@
+"""
+Streaming tremor-frequency analysis on the ingest path.
+
+Every device gets a preallocated ring buffer of its last ``window``
+acceleration magnitudes. Each ``hop`` new samples the current window is
+copied into a preallocated pending matrix; ``analyze`` then runs one
+batched real FFT (Hann window, mean removed) over every pending window of
+the whole fleet and reports, per window:
+
+    dominant_hz   frequency of the strongest non-DC bin
+    band_power    power in the tremor band (default 4-6 Hz), (m/s^2)^2
+    total_power   power over all non-DC bins
+    band_ratio    band_power / total_power
+
+Parkinsonian rest tremor shows up as a dominant frequency inside the band
+with a high band ratio; ordinary movement spreads its power below it.
+"""
+import math
+
+import numpy as np
+
+
+class DeviceWindow:
+    """
+    Ring buffer of one device's most recent acceleration magnitudes.
+    """
+
+    def __init__(self, size, rate):
+        self.values = np.zeros(size, dtype=np.float32)
+        self.size = size
+        self.rate = rate
+        self.head = 0
+        self.filled = 0
+        self.since_hop = 0
+        self.last_ts = None
+
+
+class TremorAnalyzer:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.window = 256
+        self.hop = 64
+        self.band = (4.0, 6.0)
+        self.default_rate = 50
+        self.max_pending = 1024
+        self._devices = {}
+        self._pending = None
+        self._pending_meta = []
+        self._results = []
+        self.latest = {}
+        self.windows_analyzed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('TREMOR_ANALYSIS_ENABLED', self.enabled)
+        self.window = app.config.get('TREMOR_WINDOW', self.window)
+        self.hop = min(app.config.get('TREMOR_HOP', self.hop), self.window)
+        self.band = (app.config.get('TREMOR_BAND_LOW', self.band[0]),
+                     app.config.get('TREMOR_BAND_HIGH', self.band[1]))
+        self.default_rate = app.config.get('TREMOR_DEFAULT_RATE', self.default_rate)
+        self._devices = {}
+        self._allocate()
+
+    def _allocate(self):
+        self._pending = np.empty((self.max_pending, self.window), dtype=np.float32)
+        self._pending_meta = []
+        # Hann window and its power normalisation, shared by every FFT
+        self._taper = np.hanning(self.window).astype(np.float32)
+        self._taper_power = float(np.sum(self._taper.astype(np.float64) ** 2))
+
+    def add(self, device_id, timestamps, samples, sample_rate=None):
+        """
+        Feed a decoded batch. ``timestamps`` is datetime64[us], ``samples`` a
+        SAMPLE_DTYPE array, both in time order. Legacy frames carry no sample
+        rate, so ``TREMOR_DEFAULT_RATE`` is assumed for them.
+        """
+        if not self.enabled or not len(samples):
+            return
+        if self._pending is None:
+            self._allocate()
+
+        rate = sample_rate or self.default_rate
+        times_us = timestamps.astype('datetime64[us]').astype(np.int64)
+        state = self._devices.get(device_id)
+        # A new rate or a gap of more than a second starts a fresh window
+        if state is None or state.rate != rate or (
+                state.last_ts is not None and times_us[0] - state.last_ts > 1e6 + 1e6 / rate):
+            state = self._devices[device_id] = DeviceWindow(self.window, rate)
+
+        magnitude = np.sqrt(np.square(samples['accel_x']) + np.square(samples['accel_y'])
+                            + np.square(samples['accel_z']))
+        if np.isnan(magnitude).any():
+            # Fill gaps with the previous sample so one bad value does not
+            # blank out a whole window
+            magnitude = np.where(np.isnan(magnitude), state.values[state.head - 1], magnitude)
+
+        offset, count = 0, len(magnitude)
+        while offset < count:
+            take = min(count - offset, self.hop - state.since_hop)
+            self._write(state, magnitude[offset:offset + take])
+            offset += take
+            state.since_hop += take
+            if state.since_hop == self.hop:
+                state.since_hop = 0
+                if state.filled == self.window:
+                    self._queue_window(device_id, state, times_us[offset - 1])
+        state.last_ts = times_us[-1]
+
+    def _write(self, state, values):
+        n = len(values)
+        first = min(n, state.size - state.head)
+        state.values[state.head:state.head + first] = values[:first]
+        state.values[:n - first] = values[first:]
+        state.head = (state.head + n) % state.size
+        state.filled = min(state.filled + n, state.size)
+
+    def _queue_window(self, device_id, state, end_us):
+        if len(self._pending_meta) == self.max_pending:
+            self._results.extend(self._run())
+        row = self._pending[len(self._pending_meta)]
+        tail = state.size - state.head
+        row[:tail] = state.values[state.head:]
+        row[tail:] = state.values[:state.head]
+        self._pending_meta.append((device_id, int(end_us), state.rate))
+
+    def analyze(self):
+        """
+        Compute every pending window and return the results as dicts.
+        """
+        results, self._results = self._results + self._run(), []
+        for result in results:
+            self.latest[result['device_id']] = result
+        return results
+
+    def _run(self):
+        count = len(self._pending_meta)
+        if not count:
+            return []
+        meta, self._pending_meta = self._pending_meta, []
+        windows = self._pending[:count]
+        windows -= windows.mean(axis=1, keepdims=True)
+        windows *= self._taper
+        spectrum = np.fft.rfft(windows, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+
+        rates = np.array([m[2] for m in meta], dtype=np.float64)
+        df = rates / self.window
+        # One-sided power spectral density integrated over each bin
+        power *= (2.0 / (rates * self._taper_power) * df)[:, None]
+        power[:, 0] = 0.0
+
+        cumulative = np.cumsum(power, axis=1)
+        last_bin = power.shape[1] - 1
+        low = np.clip(np.ceil(self.band[0] / df).astype(np.int64), 1, last_bin)
+        high = np.clip(np.floor(self.band[1] / df).astype(np.int64), 0, last_bin)
+        rows = np.arange(count)
+        band_power = np.where(high >= low, cumulative[rows, high] - cumulative[rows, low - 1], 0.0)
+        total_power = cumulative[:, -1]
+        dominant_hz = power.argmax(axis=1) * df
+        with np.errstate(divide='ignore', invalid='ignore'):
+            band_ratio = np.where(total_power > 0, band_power / total_power, 0.0)
+
+        self.windows_analyzed += count
+        return [
+            {
+                'device_id': device_id,
+                'timestamp': np.datetime64(end_us, 'us').item(),
+                'dominant_hz': round(hz, 3),
+                'band_power': bp,
+                'total_power': tp,
+                'band_ratio': ratio,
+            }
+            for (device_id, end_us, _), hz, bp, tp, ratio in zip(
+                meta, dominant_hz.tolist(), band_power.tolist(),
+                total_power.tolist(), band_ratio.tolist())
+            if not math.isnan(tp)
+        ]
+
+
+tremor_analyzer = TremorAnalyzer()
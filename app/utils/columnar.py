@@ -0,0 +1,85 @@
+"""
+Columnar binary responses for read endpoints that return long series.
+
+Clients pick the encoding with ``?format=`` or the Accept header:
+
+``msgpack`` (application/x-msgpack, needs the msgpack package)
+    A map ``{"count": N, "columns": {name: [values...]}, "meta": {...}}``
+    with one array per column.
+
+``columns`` (application/vnd.neurotrack.columns)
+    Raw little-endian arrays, readable with ``numpy.frombuffer`` or a JS
+    typed array without any parsing:
+
+        I       header length H
+        H bytes JSON header {"count": N, "columns": [[name, dtype], ...],
+                "meta": {...}}, space-padded so the arrays start on an
+                8-byte boundary
+        then each column's N values back to back, in header order
+
+Timestamps are int64 microseconds since the Unix epoch; missing values are
+NaN rather than null. Either way the payload is built from whole arrays,
+with no per-row dicts.
+"""
+import json
+import struct
+
+import numpy as np
+from flask import Response, request
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+COLUMNS_MIMETYPE = 'application/vnd.neurotrack.columns'
+COLUMNAR_FORMATS = {'msgpack': MSGPACK_MIMETYPE, 'columns': COLUMNS_MIMETYPE}
+
+
+def columnar_format():
+    """
+    'msgpack', 'columns' or None (plain JSON) for the current request.
+    Raises ValueError for an explicit ?format= this server can't produce.
+    """
+    fmt = request.args.get('format')
+    if fmt:
+        if fmt == 'json':
+            return None
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unknown format: {fmt}")
+        if fmt == 'msgpack' and msgpack is None:
+            raise ValueError("MessagePack responses need the msgpack package installed")
+        return fmt
+    offered = ['application/json', COLUMNS_MIMETYPE] + ([MSGPACK_MIMETYPE] if msgpack else [])
+    best = request.accept_mimetypes.best_match(offered)
+    for name, mimetype in COLUMNAR_FORMATS.items():
+        if best == mimetype:
+            return name
+    return None
+
+
+def encode_columns(columns, fmt, meta=None):
+    """
+    Encode a dict of equal-length numpy arrays (in column order).
+    """
+    count = len(next(iter(columns.values()))) if columns else 0
+    if fmt == 'msgpack':
+        return msgpack.packb({
+            'count': count,
+            'columns': {name: values.tolist() for name, values in columns.items()},
+            'meta': meta or {},
+        })
+
+    arrays = [np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<')) for values in columns.values()]
+    header = json.dumps({
+        'count': count,
+        'columns': [[name, values.dtype.str] for name, values in zip(columns, arrays)],
+        'meta': meta or {},
+    }).encode()
+    header += b' ' * (-(4 + len(header)) % 8)
+    return b''.join([struct.pack('<I', len(header)), header] + [values.tobytes() for values in arrays])
+
+
+def columnar_response(columns, fmt, meta=None, headers=None):
+    return Response(encode_columns(columns, fmt, meta), mimetype=COLUMNAR_FORMATS[fmt], headers=headers)
@@ -1,46 +1,43 @@
 import os
 import numpy as np
-import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 from tensorflow.keras.callbacks import EarlyStopping
 
-from app.models.models import ParkinsonMetric
+from app.parkinson.daily import daily_series
 
 # Directory for saving models
 MODEL_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
 os.makedirs(MODEL_DIR, exist_ok=True)
 
-def build_lstm_data(user_id, timesteps=3):
+# Days of history per LSTM sample
+TIMESTEPS = 3
+
+def lstm_windows(shakes, timesteps=TIMESTEPS):
+    """
+    Every run of ``timesteps`` consecutive daily averages, as a read-only
+    (n, timesteps, 1) view onto ``shakes`` (no copy).
+    """
+    return sliding_window_view(shakes, timesteps)[..., np.newaxis]
+
+def build_lstm_data(user_id, timesteps=TIMESTEPS):
     """
     Build sequences of daily shake averages for LSTM input.
     Each sample: [shake_{t-3}, shake_{t-2}, shake_{t-1}], 
     label: better(1)/worse(0) at t
     """
-    qs = ParkinsonMetric.query.filter_by(user_id=user_id) \
-                              .order_by(ParkinsonMetric.timestamp).all()
-    if len(qs) < timesteps + 1:
+    # Daily averages from the shared store, which only reads new days
+    _, shakes = daily_series.get(user_id)
+    if len(shakes) < timesteps + 1:
         return None, None
 
-    # Compute daily average shake
-    df = pd.DataFrame([{'date': m.timestamp.date(), 'shake': m.shake_per_minute}
-                       for m in qs])
-    daily = df.groupby('date').shake.mean().sort_index().reset_index()
-    shakes = daily.shake.values
-
-    X, y = [], []
-    for i in range(timesteps, len(shakes)):
-        seq = shakes[i - timesteps:i]
-        label = 1 if shakes[i] < shakes[i-1] else 0
-        X.append(seq)
-        y.append(label)
-
-    X = np.array(X).reshape(-1, timesteps, 1)
-    y = np.array(y)
+    X = lstm_windows(shakes[:-1], timesteps)
+    y = (shakes[timesteps:] < shakes[timesteps - 1:-1]).astype(int)
     return X, y
 
-def train_lstm_model(user_id, timesteps=3, epochs=50, batch_size=8):
+def train_lstm_model(user_id, timesteps=TIMESTEPS, epochs=50, batch_size=8):
     """
     Trains LSTM on the user's daily shake sequences.
     Saves to MODEL_DIR as 'progress_lstm_{user_id}.h5'.
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 def calculate_shake(accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
     """
     Computes shake magnitude using a basic root sum square method.
@@ -8,5 +10,22 @@ def calculate_shake(accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z):
     gyro_magnitude = math.sqrt(gyro_x**2 + gyro_y**2 + gyro_z**2)
     return accel_magnitude + gyro_magnitude
 
+def calculate_shake_batch(*columns):
+    """
+    Vectorized calculate_shake over many samples in one pass.
+    Accepts either six equal-length arrays (accel_x, accel_y, accel_z,
+    gyro_x, gyro_y, gyro_z) or a single (N, 6) matrix in that column order.
+    Returns a float64 array of N shake magnitudes.
+    """
+    if len(columns) == 1:
+        matrix = np.asarray(columns[0], dtype=np.float64)
+        if matrix.ndim != 2 or matrix.shape[1] != 6:
+            raise ValueError(f"Expected an (N, 6) matrix, got shape {matrix.shape}")
+        accel, gyro = matrix[:, :3], matrix[:, 3:]
+    elif len(columns) == 6:
+        accel = np.column_stack([np.asarray(c, dtype=np.float64) for c in columns[:3]])
+        gyro = np.column_stack([np.asarray(c, dtype=np.float64) for c in columns[3:]])
+    else:
+        raise ValueError("Pass six component arrays or one (N, 6) matrix")
 
-
+    return np.sqrt(np.einsum('ij,ij->i', accel, accel)) + np.sqrt(np.einsum('ij,ij->i', gyro, gyro))
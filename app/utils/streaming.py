@@ -0,0 +1,60 @@
+"""
+Opt-in streaming responses for list endpoints.
+
+A client asks for a stream with ``?stream=ndjson`` (or an ``Accept:
+application/x-ndjson`` header) to get one JSON object per line, or with
+``?stream=json`` to get an ordinary JSON array sent in chunks. Either way
+the items come from a generator, so the first ones go out while the
+database is still producing the rest and the worker never holds the whole
+result.
+"""
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_MODES = ('ndjson', 'json')
+# Items encoded per chunk written to the socket
+CHUNK_ITEMS = 200
+
+
+def stream_mode():
+    """
+    'ndjson', 'json' or None (no streaming) for the current request.
+    """
+    mode = request.args.get('stream')
+    if mode in STREAM_MODES:
+        return mode
+    # Plain JSON wins ties, so "Accept: */*" clients keep getting a list
+    if request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        return 'ndjson'
+    return None
+
+
+def _encode(items, mode):
+    dumps = current_app.json.dumps
+    parts = []
+    first = True
+    if mode == 'json':
+        parts.append('[')
+    for item in items:
+        if mode == 'ndjson':
+            parts.append(dumps(item) + '\n')
+        else:
+            parts.append(dumps(item) if first else ',' + dumps(item))
+        first = False
+        if len(parts) >= CHUNK_ITEMS:
+            yield ''.join(parts)
+            parts = []
+    if mode == 'json':
+        parts.append(']')
+    if parts:
+        yield ''.join(parts)
+
+
+def stream_response(items, mode, headers=None):
+    """
+    Stream an iterable of JSON-serializable items in the given mode. The
+    iterable is consumed inside the request context, so it may keep
+    reading from the database.
+    """
+    mimetype = NDJSON_MIMETYPE if mode == 'ndjson' else 'application/json'
+    return Response(stream_with_context(_encode(items, mode)), mimetype=mimetype, headers=headers)
@@ -0,0 +1,204 @@
+"""
+Acknowledgement modes for the WebSocket ingest protocol.
+
+A client picks its mode either with query parameters on the connect URL
+(``ws://host:8765/?ack=cumulative&ack_every=50&ack_interval_ms=200``) or by
+sending a JSON hello as its first message:
+
+    {"type": "hello", "ack": "cumulative", "ack_every": 50,
+     "ack_interval_ms": 200, "encoding": "binary"}
+
+Modes:
+    message     one ack per message (default, today's behaviour)
+    cumulative  one ack every ``ack_every`` messages or ``ack_interval_ms``
+                milliseconds, carrying the highest sequence number received
+    errors      fire-and-forget, only errors are answered
+
+Clients that never negotiate get the original JSON replies. Negotiated
+clients get compact acks: a 5-byte binary ack (kind byte + uint32 sequence)
+for binary frames unless they ask for ``"encoding": "json"``.
+"""
+import asyncio
+import json
+from struct import Struct
+from urllib.parse import urlsplit, parse_qs
+
+ACK_PER_MESSAGE = 'message'
+ACK_CUMULATIVE = 'cumulative'
+ACK_ERRORS_ONLY = 'errors'
+ACK_MODES = (ACK_PER_MESSAGE, ACK_CUMULATIVE, ACK_ERRORS_ONLY)
+
+KIND_ACK = 0x06
+KIND_NAK = 0x15
+BINARY_ACK = Struct('<BI')
+
+# Replies for clients that did not negotiate, encoded once
+LEGACY_BINARY_ACK = json.dumps({"status": "success", "message": "Binary data received"})
+LEGACY_JSON_ACK = json.dumps({"status": "success", "message": "Data received"})
+JSON_SEQ_ACK = '{"status":"success","seq":%d}'
+ENCODINGS = (None, 'binary', 'json')
+
+
+def parse_seq(value):
+    """
+    A JSON message's sequence number as an int (None if absent); raises
+    ValueError for anything that isn't a whole number >= 0.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid seq: {value!r}")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if not isinstance(value, int) or value < 0:
+        raise ValueError(f"Invalid seq: {value!r}")
+    return value
+
+
+def _options(mode, every, interval_ms, encoding):
+    """
+    Validated (mode, every, interval in seconds, encoding); raises
+    ValueError without touching any policy.
+    """
+    if mode not in ACK_MODES:
+        raise ValueError(f"Unknown ack mode: {mode}")
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown ack encoding: {encoding}")
+    try:
+        every = max(int(every), 1)
+        interval = max(float(interval_ms), 0.0) / 1000
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid ack_every / ack_interval_ms: {every!r}, {interval_ms!r}")
+    return mode, every, interval, encoding
+
+
+class AckPolicy:
+    """
+    Per-connection acknowledgement state.
+    """
+
+    def __init__(self, websocket, mode=ACK_PER_MESSAGE, every=1, interval_ms=0,
+                 encoding=None, negotiated=False):
+        self.websocket = websocket
+        self.mode, self.every, self.interval, self.encoding = _options(mode, every, interval_ms, encoding)
+        self.negotiated = negotiated
+
+        self.received = 0
+        # Highest sequence number received; None until the first message
+        self.last_seq = None
+        self._pending = 0
+        self._pending_binary = False
+        self._timer = None
+
+    @classmethod
+    def from_path(cls, websocket, path):
+        """
+        Build the policy from the connect URL's query string, if any.
+        Raises ValueError for bad parameters.
+        """
+        query = parse_qs(urlsplit(path or '').query)
+        if 'ack' not in query:
+            return cls(websocket)
+        return cls(
+            websocket,
+            mode=query['ack'][0],
+            every=query.get('ack_every', [1])[0],
+            interval_ms=query.get('ack_interval_ms', [0])[0],
+            encoding=query.get('encoding', [None])[0],
+            negotiated=True
+        )
+
+    def negotiate(self, hello):
+        """
+        Apply a JSON hello message and return the reply to send back.
+        A hello that doesn't parse leaves the policy as it was.
+        """
+        self.mode, self.every, self.interval, self.encoding = _options(
+            hello.get('ack', ACK_PER_MESSAGE), hello.get('ack_every', 1),
+            hello.get('ack_interval_ms', 0), hello.get('encoding'))
+        self.negotiated = True
+        return json.dumps({"status": "success", "type": "hello", "ack": self.mode,
+                           "ack_every": self.every, "ack_interval_ms": int(self.interval * 1000)})
+
+    async def ack(self, seq=None, binary=False):
+        """
+        Record one successfully processed message and ack it if the mode says so.
+        ``seq`` is the frame's sequence number; messages without one are
+        numbered by arrival. JSON sequence numbers go through parse_seq
+        before the message is processed. A reordered or retransmitted
+        frame doesn't move the acked sequence number back.
+        """
+        self.received += 1
+        if seq is None:
+            seq = self.received
+        if self.last_seq is None or seq > self.last_seq:
+            self.last_seq = seq
+
+        if self.mode == ACK_ERRORS_ONLY:
+            return
+        if self.mode == ACK_PER_MESSAGE:
+            await self.websocket.send(self._encode_ack(binary))
+            return
+
+        self._pending += 1
+        self._pending_binary = binary
+        if self._pending >= self.every:
+            await self.flush()
+        elif self.interval and self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.interval, self._on_timer)
+
+    async def nack(self, error, binary=False):
+        """
+        Errors are always answered, whatever the mode.
+        """
+        if self.negotiated and self._binary(binary):
+            await self.websocket.send(BINARY_ACK.pack(KIND_NAK, self._acked_seq & 0xFFFFFFFF) + str(error).encode()[:200])
+        else:
+            await self.websocket.send(json.dumps({"status": "error", "message": str(error)}))
+
+    async def flush(self):
+        """
+        Send the pending cumulative ack, if any.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        self._pending = 0
+        await self.websocket.send(self._encode_ack(self._pending_binary))
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self._flush_quietly())
+
+    async def _flush_quietly(self):
+        try:
+            await self.flush()
+        except Exception:
+            # The connection went away; the handler cleans up
+            pass
+
+    @property
+    def _acked_seq(self):
+        return self.last_seq if self.last_seq is not None else 0
+
+    def _binary(self, binary):
+        if self.encoding:
+            return self.encoding == 'binary'
+        return binary
+
+    def _encode_ack(self, binary):
+        if not self.negotiated:
+            return LEGACY_BINARY_ACK if binary else LEGACY_JSON_ACK
+        if self._binary(binary):
+            return BINARY_ACK.pack(KIND_ACK, self._acked_seq & 0xFFFFFFFF)
+        return JSON_SEQ_ACK % self._acked_seq
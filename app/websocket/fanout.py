@@ -0,0 +1,255 @@
+"""
+Live fan-out of decoded sensor samples to dashboard subscribers.
+
+Dashboards connect to ``ws://host:8765/live`` and pick devices either in the
+query string (``/live?devices=<id>,<id>&rate=10``) or with a message:
+
+    {"type": "subscribe", "device_ids": ["<id>", ...], "rate": 10}
+    {"type": "unsubscribe", "device_ids": ["<id>", ...]}
+
+``rate`` is the maximum samples per second per device the subscriber wants
+(0 = every sample); the server decimates before queueing. Each update is a
+JSON object with one array per column:
+
+    {"device_id": "<id>", "t": [epoch_us, ...], "accel_x": [...], ...}
+
+Tremor analysis results for subscribed devices arrive as
+
+    {"type": "tremor", "device_id": "<id>", "timestamp": "...", "dominant_hz": 4.9, ...}
+
+The ingest path publishes every decoded batch into a per-device ring buffer
+(the last ``LIVE_RING_SIZE`` samples, sent as a backlog on subscribe) and
+into each subscriber's bounded queue; a slow subscriber loses its oldest
+updates rather than holding up ingest. Live views never touch the database.
+With several ingest workers a subscriber only sees devices connected to the
+same worker process.
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from .protocol import SAMPLE_FIELDS
+
+RING_DTYPE = np.dtype([('t', '<i8')] + [(name, '<f4') for name in SAMPLE_FIELDS])
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRing:
+    """
+    Preallocated ring buffer of the most recent samples of one device.
+    """
+
+    def __init__(self, size):
+        self.data = np.zeros(size, dtype=RING_DTYPE)
+        self.size = size
+        self.count = 0
+        self.head = 0
+
+    def extend(self, timestamps_us, samples):
+        n = len(timestamps_us)
+        if n >= self.size:
+            timestamps_us, samples = timestamps_us[-self.size:], samples[-self.size:]
+            n = self.size
+        end = self.head + n
+        first = min(end, self.size) - self.head
+        for name in SAMPLE_FIELDS:
+            self.data[name][self.head:self.head + first] = samples[name][:first]
+            self.data[name][:n - first] = samples[name][first:]
+        self.data['t'][self.head:self.head + first] = timestamps_us[:first]
+        self.data['t'][:n - first] = timestamps_us[first:]
+        self.head = end % self.size
+        self.count = min(self.count + n, self.size)
+
+    def snapshot(self):
+        if self.count < self.size:
+            return self.data[:self.count].copy()
+        return np.concatenate((self.data[self.head:], self.data[:self.head]))
+
+
+class Subscriber:
+    def __init__(self, websocket, rate=0, queue_size=100):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.devices = set()
+        self.dropped = 0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.interval_us = int(1e6 / rate) if rate else 0
+        # device_id -> last decimation bucket sent, in units of interval_us,
+        # so a new interval starts over
+        self._last_bucket = {}
+
+    def decimate(self, device_id, timestamps_us):
+        """
+        Boolean mask keeping at most one sample per ``interval_us`` bucket.
+        """
+        if not self.interval_us:
+            return None
+        if not len(timestamps_us):
+            return np.zeros(0, dtype=bool)
+        buckets = timestamps_us // self.interval_us
+        mask = np.empty(len(buckets), dtype=bool)
+        mask[0] = True
+        np.not_equal(buckets[1:], buckets[:-1], out=mask[1:])
+        mask &= buckets > self._last_bucket.get(device_id, -1)
+        if mask.any():
+            self._last_bucket[device_id] = int(buckets[mask][-1])
+        return mask
+
+    def offer(self, message):
+        """
+        Queue an update without waiting; drops the oldest one when full.
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class LiveHub:
+    def __init__(self, app=None):
+        self.ring_size = 500
+        self.queue_size = 100
+        self._rings = {}
+        self._subscribers = {}  # device_id -> set of Subscriber
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ring_size = app.config.get('LIVE_RING_SIZE', self.ring_size)
+        self.queue_size = app.config.get('LIVE_QUEUE_SIZE', self.queue_size)
+
+    @property
+    def subscriber_count(self):
+        return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    def publish(self, device_id, timestamps, samples):
+        """
+        Called from the ingest path for every decoded batch. ``timestamps``
+        is a datetime64[us] array, ``samples`` a SAMPLE_DTYPE array.
+        """
+        timestamps_us = timestamps.astype('datetime64[us]').astype(np.int64)
+        ring = self._rings.get(device_id)
+        if ring is None:
+            ring = self._rings[device_id] = DeviceRing(self.ring_size)
+        ring.extend(timestamps_us, samples)
+
+        for sub in self._subscribers.get(device_id, ()):
+            mask = sub.decimate(device_id, timestamps_us)
+            if mask is None:
+                sub.offer(encode_update(device_id, timestamps_us, samples))
+            elif mask.any():
+                sub.offer(encode_update(device_id, timestamps_us[mask], samples[mask]))
+
+    def publish_event(self, device_id, event):
+        """
+        Send a derived result (e.g. a tremor window) to the device's
+        subscribers as is, without decimation or ring buffering.
+        """
+        subs = self._subscribers.get(device_id)
+        if subs:
+            message = json.dumps(event, default=str)
+            for sub in subs:
+                sub.offer(message)
+
+    def subscribe(self, sub, device_ids):
+        for device_id in device_ids:
+            self._subscribers.setdefault(device_id, set()).add(sub)
+            sub.devices.add(device_id)
+            ring = self._rings.get(device_id)
+            if ring is not None and ring.count:
+                backlog = ring.snapshot()
+                mask = sub.decimate(device_id, backlog['t'])
+                if mask is not None:
+                    backlog = backlog[mask]
+                if len(backlog):
+                    sub.offer(encode_update(device_id, backlog['t'], backlog))
+
+    def unsubscribe(self, sub, device_ids=None):
+        for device_id in list(device_ids if device_ids is not None else sub.devices):
+            subs = self._subscribers.get(device_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[device_id]
+            sub.devices.discard(device_id)
+
+
+def parse_rate(value):
+    """
+    Samples per second from a query string or message value; raises
+    ValueError unless it is a finite number >= 0.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid rate: {value}")
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid rate: {value}")
+    if not np.isfinite(rate) or rate < 0:
+        raise ValueError(f"Invalid rate: {value}")
+    return rate
+
+
+def _json_values(values):
+    # Missing axes are NaN in the arrays and null on the wire
+    if np.isnan(values).any():
+        return [None if value != value else value for value in values.tolist()]
+    return values.tolist()
+
+
+def encode_update(device_id, timestamps_us, samples):
+    update = {'device_id': device_id, 't': timestamps_us.tolist()}
+    for name in SAMPLE_FIELDS:
+        update[name] = _json_values(samples[name])
+    return json.dumps(update)
+
+
+live_hub = LiveHub()
+
+
+async def handle_subscriber(websocket, path):
+    """
+    Connection handler for dashboard subscribers on /live.
+    """
+    query = parse_qs(urlsplit(path or '').query)
+    try:
+        rate = parse_rate(query.get('rate', [0])[0])
+    except ValueError as e:
+        await websocket.send(json.dumps({"status": "error", "message": str(e)}))
+        await websocket.close()
+        return
+    sub = Subscriber(websocket, rate=rate, queue_size=live_hub.queue_size)
+    if 'devices' in query:
+        live_hub.subscribe(sub, [d for d in query['devices'][0].split(',') if d])
+
+    async def sender():
+        while True:
+            await websocket.send(await sub.queue.get())
+
+    send_task = asyncio.ensure_future(sender())
+    try:
+        async for message in websocket:
+            try:
+                data = json.loads(message)
+                device_ids = data.get('device_ids', [])
+                if data.get('type') == 'subscribe':
+                    if 'rate' in data:
+                        sub.set_rate(parse_rate(data['rate']))
+                    live_hub.subscribe(sub, device_ids)
+                elif data.get('type') == 'unsubscribe':
+                    live_hub.unsubscribe(sub, device_ids)
+                else:
+                    raise ValueError(f"Unknown message type: {data.get('type')}")
+            except Exception as e:
+                await websocket.send(json.dumps({"status": "error", "message": str(e)}))
+    except Exception as e:
+        logger.info(f"Live subscriber closed: {e}")
+    finally:
+        send_task.cancel()
+        live_hub.unsubscribe(sub)
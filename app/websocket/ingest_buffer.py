@@ -0,0 +1,351 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import bindparam
+from sqlalchemy.exc import DBAPIError, DataError, IntegrityError, OperationalError, StatementError
+
+from ..models.models import db, Device, SensorData, SensorChunk
+from ..devices.chunks import pack_rows, check_chunk_seconds, merge_period
+from .metrics import flush_seconds, rows_flushed_total
+
+logger = logging.getLogger(__name__)
+
+
+class IngestBuffer:
+    """
+    Write-behind buffer for incoming sensor samples.
+
+    Rows from every WebSocket connection are collected in memory and written
+    with one bulk INSERT once ``batch_size`` rows are pending or
+    ``flush_interval`` seconds have passed, whichever comes first.
+    ``max_unflushed`` is the number of rows we accept losing on a crash:
+    once that many rows are pending, ``is_full`` turns true and producers
+    are expected to wait for a flush before queueing more.
+
+    With ``storage`` set to ``'chunks'`` each flush packs every device's rows
+    into SensorChunk blocks instead of inserting one SensorData row each.
+    A period's samples then arrive over several flushes; the partial chunks
+    are merged into one a period after the period is over
+    (``merge_closed``), so crash loss stays bounded by ``max_unflushed``.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.max_unflushed = 5000
+        self.storage = 'rows'
+        self.chunk_seconds = 60
+
+        # device_id -> rows queued for that device, oldest first
+        self._rows = {}
+        self._depth = 0
+        self._last_seen = {}
+        # (device_id, chunk start_time) -> chunks written for that period
+        self._periods = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.rows_flushed = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.last_flush_failed = False
+        self.rows_rejected = 0
+        self.chunks_merged = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('INGEST_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('INGEST_FLUSH_INTERVAL', self.flush_interval)
+        self.max_unflushed = max(
+            app.config.get('INGEST_MAX_UNFLUSHED_ROWS', self.max_unflushed),
+            self.batch_size
+        )
+        self.storage = app.config.get('SENSOR_STORAGE', self.storage)
+        self.chunk_seconds = app.config.get('SENSOR_CHUNK_SECONDS', self.chunk_seconds)
+        # Fail at startup rather than on every flush
+        check_chunk_seconds(self.chunk_seconds)
+
+    def start(self):
+        """
+        Start the background flusher thread. Safe to call more than once.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Stop the flusher thread and write out whatever is still pending.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.flush()
+
+    @property
+    def depth(self):
+        """Number of rows waiting to be written."""
+        return self._depth
+
+    @property
+    def is_full(self):
+        return self._depth >= self.max_unflushed
+
+    def device_depth(self, device_id):
+        return len(self._rows.get(device_id, ()))
+
+    def add(self, row):
+        """
+        Queue one SensorData row, given as a dict of column values.
+        """
+        self.add_many(row['device_id'], [row])
+
+    def add_many(self, device_id, rows):
+        """
+        Queue rows that all belong to ``device_id``.
+        """
+        with self._lock:
+            self._rows.setdefault(device_id, []).extend(rows)
+            self._depth += len(rows)
+            pending = self._depth
+
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def drop_oldest(self, device_id, count):
+        """
+        Discard up to ``count`` of a device's oldest queued rows.
+        Returns how many were discarded.
+        """
+        with self._lock:
+            queued = self._rows.get(device_id)
+            if not queued:
+                return 0
+            dropped = min(count, len(queued))
+            del queued[:dropped]
+            self._depth -= dropped
+            return dropped
+
+    def touch(self, device_id, when):
+        """
+        Record that a device was seen; written together with the next flush.
+        """
+        with self._lock:
+            self._last_seen[device_id] = when
+
+    def flush(self):
+        """
+        Write all pending rows in a single transaction.
+        Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                by_device, self._rows = self._rows, {}
+                self._depth = 0
+                last_seen, self._last_seen = self._last_seen, {}
+            rows = [row for queued in by_device.values() for row in queued]
+            if not rows and not last_seen:
+                return 0
+
+            started = time.perf_counter()
+            unwritten = []
+            table = SensorChunk.__table__ if self.storage == 'chunks' else SensorData.__table__
+            try:
+                if self.storage == 'chunks':
+                    # Inside the try: a row that can't be packed takes the
+                    # per-row path below like one the database rejects
+                    records = [chunk for device_id, queued in by_device.items()
+                               for chunk in pack_rows(device_id, queued, self.chunk_seconds)]
+                    self._note_periods(records)
+                else:
+                    records = rows
+                with self.app.app_context():
+                    if records:
+                        db.session.execute(table.insert(), records)
+                    if last_seen:
+                        db.session.execute(
+                            Device.__table__.update()
+                            .where(Device.__table__.c.id == bindparam('_id'))
+                            .values(last_seen=bindparam('_last_seen')),
+                            [{'_id': k, '_last_seen': v} for k, v in last_seen.items()]
+                        )
+                    db.session.commit()
+            except OperationalError as e:
+                # Database unreachable or locked: keep the rows for the next try
+                logger.error(f"Ingest flush of {len(rows)} rows failed: {getattr(e, 'orig', e)}")
+                self.failed_flushes += 1
+                self.last_flush_failed = True
+                with self.app.app_context():
+                    db.session.rollback()
+                self._requeue(by_device, len(rows), last_seen)
+                return 0
+            except Exception as e:
+                # A bad row (e.g. a device deleted while its samples were
+                # queued) would fail every retry; write the batch row by row
+                logger.error(f"Ingest flush of {len(rows)} rows rejected, retrying per row: {getattr(e, 'orig', e)}")
+                self.failed_flushes += 1
+                with self.app.app_context():
+                    db.session.rollback()
+                pairs = self._record_rows(by_device, rows)
+                if self.storage == 'chunks':
+                    self._note_periods(record for record, _ in pairs)
+                rows, unwritten = self._insert_each(table, pairs)
+                with self._lock:
+                    for device_id, when in last_seen.items():
+                        self._last_seen.setdefault(device_id, when)
+                if unwritten:
+                    # The database itself failed part way: keep what is left
+                    # for the next try
+                    self.last_flush_failed = True
+                    pending = {}
+                    for row in unwritten:
+                        pending.setdefault(row['device_id'], []).append(row)
+                    self._requeue(pending, len(unwritten), {})
+
+            elapsed = time.perf_counter() - started
+            if not unwritten:
+                self.last_flush_failed = False
+            self.rows_flushed += len(rows)
+            self.flush_count += 1
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            flush_seconds.observe(elapsed)
+            rows_flushed_total.inc(amount=len(rows))
+            return len(rows)
+
+    def _note_periods(self, chunks):
+        self._periods.update((chunk['device_id'], chunk['start_time']) for chunk in chunks)
+
+    def merge_closed(self, now=None):
+        """
+        Merge the partial chunks of periods that ended at least one chunk
+        period ago (leaving time for samples still queued for them).
+        Returns the number of chunks merged away.
+        """
+        if not self._periods:
+            return 0
+        horizon = (now or datetime.utcnow()) - 2 * timedelta(seconds=self.chunk_seconds)
+        closed = [key for key in self._periods if key[1] <= horizon]
+        merged = 0
+        with self.app.app_context():
+            for key in closed:
+                if self._periods.pop(key) > 1:
+                    merged += merge_period(*key, self.chunk_seconds)
+        self.chunks_merged += merged
+        return merged
+
+    def _requeue(self, by_device, count, last_seen):
+        # Put the rows back in front so ordering is kept for the retry
+        with self._lock:
+            for device_id, queued in by_device.items():
+                queued.extend(self._rows.get(device_id, ()))
+                self._rows[device_id] = queued
+            self._depth += count
+            for device_id, when in last_seen.items():
+                self._last_seen.setdefault(device_id, when)
+
+    def _record_rows(self, by_device, rows):
+        """
+        (record to insert, the queued rows it holds) pairs: one per row, or
+        one per chunk with the rows packed into it.
+        """
+        if self.storage != 'chunks':
+            return [(row, [row]) for row in rows]
+        period_us = int(self.chunk_seconds * 1e6)
+        pairs = []
+        for device_id, queued in by_device.items():
+            periods = {}
+            for row in queued:
+                try:
+                    key = int(np.datetime64(row['timestamp'], 'us').astype(np.int64)) // period_us
+                except Exception:
+                    # Unusable timestamp: rejected when packed on its own
+                    key = None
+                periods.setdefault(key, []).append(row)
+            for group in periods.values():
+                try:
+                    pairs.extend((chunk, group) for chunk in pack_rows(device_id, group, self.chunk_seconds))
+                except Exception:
+                    # Find the rows that can't be packed; keep the rest
+                    for row in group:
+                        try:
+                            pairs.extend((chunk, [row]) for chunk in pack_rows(device_id, [row], self.chunk_seconds))
+                        except Exception as e:
+                            self._reject(row, [row], e)
+        return pairs
+
+    def _insert_each(self, table, pairs):
+        """
+        Insert records one per transaction, skipping the ones the database
+        rejects as invalid (integrity or data errors). Stops at any other
+        database error, since the rest would fail the same way.
+        Returns (rows written, rows not attempted because of that error).
+        """
+        written = []
+        with self.app.app_context():
+            for index, (record, rows) in enumerate(pairs):
+                try:
+                    db.session.execute(table.insert(), record)
+                    db.session.commit()
+                    written.extend(rows)
+                except (IntegrityError, DataError) as e:
+                    db.session.rollback()
+                    self._reject(record, rows, e)
+                except StatementError as e:
+                    db.session.rollback()
+                    if isinstance(e, DBAPIError):
+                        logger.error(f"Per-row ingest fallback failed: {getattr(e, 'orig', e)}")
+                        return written, [row for _, rows in pairs[index:] for row in rows]
+                    # Failed to bind (a value of the wrong type)
+                    self._reject(record, rows, e)
+        return written, []
+
+    def _reject(self, record, rows, error):
+        self.rows_rejected += len(rows)
+        logger.warning(f"Dropping {len(rows)} sensor rows for {record.get('device_id')}: {getattr(error, 'orig', error)}")
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth,
+            'rows_flushed': self.rows_flushed,
+            'flushes': self.flush_count,
+            'failed_flushes': self.failed_flushes,
+            'rows_rejected': self.rows_rejected,
+            'chunks_merged': self.chunks_merged,
+            'last_flush_ms': round(self.last_flush_seconds * 1000, 3),
+            'max_flush_ms': round(self.max_flush_seconds * 1000, 3),
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.storage == 'chunks':
+                    self.merge_closed()
+            except Exception:
+                # Keep the flusher alive; a dead one lets the queue fill up
+                logger.exception("Ingest flush failed")
+
+
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,377 @@
+"""
+Append-only, memory-mapped ingest journal.
+
+With ``INGEST_JOURNAL_DIR`` set, the ingest path appends every decoded
+batch to the journal and acknowledges the device as soon as the append
+returns; a consumer thread loads the journal into the database through the
+ingest buffer and checkpoints how far it got. After a crash or a database
+outage the consumer resumes from the checkpoint, so a slow database only
+makes the journal grow instead of holding up the sockets. Delivery to the
+database is at-least-once: a batch written just before a crash, but not yet
+checkpointed, is written again on replay.
+
+The journal is a directory of fixed-size segment files named after the
+global byte offset they start at (``00000000000000000000.seg``), each
+preallocated and written through mmap. A record is
+
+    I    payload length (0 = end of written data in this segment)
+    I    CRC32 of the payload
+    16s  device UUID
+    I    sample count N
+    N x int64      sample timestamps, microseconds since the Unix epoch
+    N x SAMPLE_DTYPE samples
+
+A record that does not fit in the current segment starts a new one.
+``checkpoint`` holds the offset of the first record not yet in the database.
+"""
+import logging
+import mmap
+import os
+import threading
+import zlib
+from struct import Struct
+from uuid import UUID
+
+import numpy as np
+
+from .protocol import SAMPLE_DTYPE, sample_rows
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = Struct('<II')
+PAYLOAD_HEADER = Struct('<16sI')
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_FILE = 'checkpoint'
+
+
+def _segment_name(base):
+    return f'{base:020d}{SEGMENT_SUFFIX}'
+
+
+def list_segments(directory):
+    """
+    Base offsets of the segment files in ``directory``, oldest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                  if name.endswith(SEGMENT_SUFFIX))
+
+
+def read_checkpoint(directory):
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(directory, offset):
+    # Write-then-rename so a crash never leaves a torn checkpoint
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _scan(buf, pos):
+    """
+    Position just past the last complete record at or after ``pos``.
+    """
+    while pos + RECORD_HEADER.size <= len(buf):
+        length, crc = RECORD_HEADER.unpack_from(buf, pos)
+        end = pos + RECORD_HEADER.size + length
+        if length == 0 or end > len(buf) or zlib.crc32(buf[pos + RECORD_HEADER.size:end]) != crc:
+            break
+        pos = end
+    return pos
+
+
+class JournalWriter:
+    """
+    Appends records to the newest segment; used by the event loop only.
+    """
+
+    def __init__(self, directory, segment_bytes=64 << 20, sync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self._file = None
+        self._map = None
+        self._base = 0
+        self._pos = 0
+
+    @property
+    def offset(self):
+        """Global offset where the next record will be written."""
+        return self._base + self._pos
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+        if segments:
+            # Resume after the last complete record of the newest segment
+            self._map_segment(segments[-1])
+            self._pos = _scan(self._map, 0)
+        else:
+            self._new_segment(read_checkpoint(self.directory))
+
+    def _map_segment(self, base):
+        self.close()
+        self._file = open(os.path.join(self.directory, _segment_name(base)), 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._base = base
+        self._pos = 0
+
+    def _new_segment(self, base, size=None):
+        self.close()
+        path = os.path.join(self.directory, _segment_name(base))
+        with open(path, 'wb') as f:
+            f.truncate(max(size or 0, self.segment_bytes))
+        self._map_segment(base)
+
+    def append(self, device_id, timestamps_us, samples):
+        """
+        Append one batch and return the offset just past it.
+        """
+        payload_size = PAYLOAD_HEADER.size + len(samples) * (8 + SAMPLE_DTYPE.itemsize)
+        size = RECORD_HEADER.size + payload_size
+        if self._pos + size > len(self._map):
+            if self._pos == 0:
+                # Record larger than a segment: give it a bigger one
+                self._new_segment(self._base, size)
+            else:
+                # Leave the rest of this segment zeroed; readers move on to the next
+                self._new_segment(self._base + len(self._map), size)
+
+        start = self._pos + RECORD_HEADER.size
+        view = memoryview(self._map)[start:start + payload_size]
+        PAYLOAD_HEADER.pack_into(view, 0, UUID(device_id).bytes, len(samples))
+        cursor = PAYLOAD_HEADER.size
+        times = np.frombuffer(view, dtype='<i8', count=len(samples), offset=cursor)
+        times[...] = timestamps_us
+        cursor += times.nbytes
+        np.frombuffer(view, dtype=SAMPLE_DTYPE, count=len(samples), offset=cursor)[...] = samples
+        del times
+        crc = zlib.crc32(view)
+        view.release()
+        # Header last: a record is only visible once it is complete
+        RECORD_HEADER.pack_into(self._map, self._pos, payload_size, crc)
+        self._pos += size
+        if self.sync:
+            self._map.flush()
+        return self.offset
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+
+class JournalReader:
+    """
+    Reads records from a checkpoint onwards; safe to run in another thread
+    or process while the writer appends.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.position = self.committed = read_checkpoint(directory)
+
+    def read(self, max_samples):
+        """
+        Up to about ``max_samples`` samples of complete records from the
+        current position, as a list of (device_id, timestamps_us, samples)
+        copies. Advances ``position`` past what it returns.
+        """
+        records = []
+        total = 0
+        segments = list_segments(self.directory)
+        for index, base in enumerate(segments):
+            next_base = segments[index + 1] if index + 1 < len(segments) else None
+            if next_base is not None and next_base <= self.position:
+                continue
+            with open(os.path.join(self.directory, _segment_name(base)), 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pos = max(self.position - base, 0)
+                while total < max_samples and pos + RECORD_HEADER.size <= len(buf):
+                    length, crc = RECORD_HEADER.unpack_from(buf, pos)
+                    end = pos + RECORD_HEADER.size + length
+                    if length == 0 or end > len(buf):
+                        break
+                    payload = buf[pos + RECORD_HEADER.size:end]
+                    if zlib.crc32(payload) != crc:
+                        # Torn write at the tail of a crashed writer's segment
+                        break
+                    records.append(_decode(payload))
+                    total += len(records[-1][2])
+                    pos = end
+                self.position = base + pos
+            finally:
+                buf.close()
+            if total >= max_samples or next_base is None:
+                break
+            # Nothing more in this segment: continue with the next one
+            self.position = next_base
+        return records
+
+    def commit(self):
+        """
+        Checkpoint the current position and delete fully consumed segments.
+        """
+        write_checkpoint(self.directory, self.position)
+        self.committed = self.position
+        segments = list_segments(self.directory)
+        for base, next_base in zip(segments, segments[1:]):
+            if next_base <= self.position:
+                os.remove(os.path.join(self.directory, _segment_name(base)))
+
+
+def _decode(payload):
+    uuid_bytes, count = PAYLOAD_HEADER.unpack_from(payload)
+    timestamps_us = np.frombuffer(payload, dtype='<i8', count=count, offset=PAYLOAD_HEADER.size)
+    samples = np.frombuffer(payload, dtype=SAMPLE_DTYPE, count=count,
+                            offset=PAYLOAD_HEADER.size + count * 8)
+    return str(UUID(bytes=uuid_bytes)), timestamps_us, samples
+
+
+class IngestJournal:
+    """
+    The journal writer plus the consumer thread that loads it into the
+    database through the ingest buffer.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.segment_bytes = 64 << 20
+        self.sync = False
+        self.batch_samples = 20000
+        self.poll_interval = 0.2
+        self.writer = None
+        self.reader = None
+        self.buffer = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self.samples_replayed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('INGEST_JOURNAL_DIR') or None
+        self.segment_bytes = int(app.config.get('INGEST_JOURNAL_SEGMENT_MB', 64) * (1 << 20))
+        self.sync = app.config.get('INGEST_JOURNAL_SYNC', self.sync)
+        self.batch_samples = app.config.get('INGEST_JOURNAL_BATCH', self.batch_samples)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def open(self, buffer):
+        """
+        Open the writer and start the consumer, which first replays whatever
+        is left after the last checkpoint.
+        """
+        self.buffer = buffer
+        self.writer = JournalWriter(self.directory, self.segment_bytes, self.sync)
+        self.writer.open()
+        self.reader = JournalReader(self.directory)
+        if self.writer.offset > self.reader.position:
+            logger.info(f"Replaying {self.writer.offset - self.reader.position} journal bytes "
+                        f"from offset {self.reader.position}")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='journal-consumer', daemon=True)
+        self._thread.start()
+
+    def append(self, device_id, timestamps, samples):
+        return self.writer.append(device_id, timestamps.astype('datetime64[us]').astype(np.int64), samples)
+
+    def lag(self):
+        """Journal bytes not yet checkpointed as written to the database."""
+        if self.writer is None:
+            return 0
+        return self.writer.offset - self.reader.committed
+
+    def consume(self, retry=True):
+        """
+        Move one batch from the journal into the database. Returns the
+        number of samples loaded; the checkpoint only advances once the
+        ingest buffer has written them. With ``retry`` a failed write is
+        retried until it succeeds or the consumer is stopped.
+        """
+        records = self.reader.read(self.batch_samples)
+        for device_id, timestamps_us, samples in records:
+            self.buffer.add_many(device_id, sample_rows(
+                device_id, timestamps_us.astype('datetime64[us]'), samples))
+        self.buffer.flush()
+        while self.buffer.depth and retry and not self._stopping.is_set():
+            # Database unavailable: keep the rows and retry
+            self._stopping.wait(self.buffer.flush_interval)
+            self.buffer.flush()
+        if self.buffer.depth:
+            return 0
+        if records:
+            self.reader.commit()
+        count = sum(len(samples) for _, _, samples in records)
+        self.samples_replayed += count
+        return count
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if not self.consume():
+                    self._stopping.wait(self.poll_interval)
+            except Exception as e:
+                logger.error(f"Journal consumer failed: {e}")
+                self._stopping.wait(1.0)
+
+    def close(self):
+        """
+        Stop the consumer, load what is left in the journal and close it.
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        self.writer.flush()
+        # One flush attempt per batch: if the database is down, stop and
+        # leave the rest for replay rather than hang the shutdown
+        try:
+            while self.consume(retry=False):
+                pass
+        except Exception as e:
+            logger.error(f"Journal drain failed, will replay on next start: {e}")
+        self.writer.close()
+
+
+ingest_journal = IngestJournal()
+
+
+def replay_journal(directory, buffer, batch_samples=20000, log=logger.info):
+    """
+    Load everything after the checkpoint of a journal that no ingest worker
+    is writing to any more (e.g. after scaling down). Returns the number of
+    samples loaded; stops at the first database error.
+    """
+    journal = IngestJournal()
+    journal.directory = directory
+    journal.batch_samples = batch_samples
+    journal.buffer = buffer
+    journal.reader = JournalReader(directory)
+    total = 0
+    while True:
+        count = journal.consume(retry=False)
+        if not count:
+            break
+        total += count
+        log(f"{directory}: loaded {total} samples")
+    return total
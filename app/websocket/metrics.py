@@ -0,0 +1,19 @@
+from ..metrics.registry import registry
+
+decode_seconds = registry.histogram(
+    'neurotrack_ingest_decode_seconds', 'Time to decode one binary frame')
+flush_seconds = registry.histogram(
+    'neurotrack_ingest_flush_seconds', 'Time to write one ingest buffer batch')
+ack_seconds = registry.histogram(
+    'neurotrack_ingest_ack_seconds', 'Time from receiving a message to acknowledging it')
+
+messages_total = registry.counter(
+    'neurotrack_ingest_messages_total', 'Messages received per device', labels=('device_id',))
+samples_total = registry.counter(
+    'neurotrack_ingest_samples_total', 'Sensor samples received per device', labels=('device_id',))
+errors_total = registry.counter(
+    'neurotrack_ingest_errors_total', 'Messages that could not be processed')
+rows_flushed_total = registry.counter(
+    'neurotrack_ingest_rows_flushed_total', 'Sensor rows written to the database')
+tremor_windows_total = registry.counter(
+    'neurotrack_ingest_tremor_windows_total', 'Sensor windows run through tremor-frequency analysis')
@@ -0,0 +1,137 @@
+"""
+Admission control between frame decoding and the ingest buffer.
+
+The buffer holds at most ``INGEST_QUEUE_CAPACITY`` rows. What happens when
+the database falls behind and it fills up is set by ``INGEST_OVERLOAD_POLICY``:
+
+    backpressure  stop reading from the sending socket until there is room,
+                  so TCP flow control pushes back on the device
+    drop_oldest   make room by discarding the sending device's oldest
+                  queued samples
+    downsample    above ``INGEST_DOWNSAMPLE_WATERMARK`` (fraction of capacity)
+                  keep only every k-th sample, k growing as the queue fills;
+                  at capacity fall back to drop_oldest
+
+Per-device counters of deferred, downsampled and dropped samples are kept
+in ``stats()``.
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from .ingest_buffer import ingest_buffer
+
+POLICY_BACKPRESSURE = 'backpressure'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_DOWNSAMPLE = 'downsample'
+POLICIES = (POLICY_BACKPRESSURE, POLICY_DROP_OLDEST, POLICY_DOWNSAMPLE)
+
+MAX_DOWNSAMPLE_FACTOR = 10
+
+logger = logging.getLogger(__name__)
+
+
+class OverloadGuard:
+    def __init__(self, buffer, app=None):
+        self.buffer = buffer
+        self.policy = POLICY_BACKPRESSURE
+        self.capacity = 50000
+        self.watermark = 0.5
+
+        self.deferred = Counter()
+        self.downsampled = Counter()
+        self.dropped = Counter()
+        self._phase = Counter()
+        self._overloaded = set()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        policy = app.config.get('INGEST_OVERLOAD_POLICY', self.policy)
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown ingest overload policy: {policy}")
+        self.policy = policy
+        self.capacity = max(app.config.get('INGEST_QUEUE_CAPACITY', self.capacity),
+                            self.buffer.max_unflushed)
+        self.watermark = app.config.get('INGEST_DOWNSAMPLE_WATERMARK', self.watermark)
+
+    async def admit(self, device_id, rows):
+        """
+        Apply the overload policy to a device's incoming rows and return the
+        rows that should be queued. May wait (backpressure policy).
+        Raises ValueError for a frame that could never fit in the queue.
+        """
+        if len(rows) > self.capacity:
+            raise ValueError(f"Frame of {len(rows)} samples exceeds the ingest queue capacity ({self.capacity})")
+        if self.policy == POLICY_BACKPRESSURE:
+            await self._wait_for_room(device_id, len(rows))
+            return rows
+
+        shedding = False
+        if self.policy == POLICY_DOWNSAMPLE:
+            rows, shedding = self._downsample(device_id, rows)
+
+        overflow = self.buffer.depth + len(rows) - self.capacity
+        if overflow > 0:
+            removed = self.buffer.drop_oldest(device_id, overflow)
+            if removed < overflow:
+                # Not enough of this device queued; shed from the new batch
+                rows = rows[overflow - removed:]
+            self.dropped[device_id] += overflow
+            shedding = True
+
+        if shedding:
+            self._mark_overloaded(device_id)
+        else:
+            self._overloaded.discard(device_id)
+        return rows
+
+    async def _wait_for_room(self, device_id, count):
+        if self.buffer.depth + count <= self.capacity:
+            self._overloaded.discard(device_id)
+            return
+        self.deferred[device_id] += count
+        self._mark_overloaded(device_id)
+        delay = 0.01
+        while self.buffer.depth + count > self.capacity:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def _downsample(self, device_id, rows):
+        fill = self.buffer.depth / self.capacity
+        if fill < self.watermark:
+            return rows, False
+        span = max(1.0 - self.watermark, 1e-9)
+        factor = 2 + int((fill - self.watermark) / span * (MAX_DOWNSAMPLE_FACTOR - 2))
+        factor = min(factor, MAX_DOWNSAMPLE_FACTOR)
+
+        # Keep a running phase per device so single-sample frames thin out too
+        phase = self._phase[device_id]
+        kept = rows[(-phase) % factor::factor]
+        self._phase[device_id] = (phase + len(rows)) % factor
+        self.downsampled[device_id] += len(rows) - len(kept)
+        return kept, True
+
+    def _mark_overloaded(self, device_id):
+        if device_id not in self._overloaded:
+            self._overloaded.add(device_id)
+            logger.warning(f"Ingest queue over capacity ({self.policy}); shedding load for device {device_id}")
+
+    def stats(self):
+        devices = set(self.deferred) | set(self.downsampled) | set(self.dropped)
+        return {
+            'policy': self.policy,
+            'capacity': self.capacity,
+            'devices': {
+                device_id: {
+                    'deferred': self.deferred[device_id],
+                    'downsampled': self.downsampled[device_id],
+                    'dropped': self.dropped[device_id],
+                }
+                for device_id in devices
+            }
+        }
+
+
+overload_guard = OverloadGuard(ingest_buffer)
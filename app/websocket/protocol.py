@@ -0,0 +1,124 @@
+"""
+Binary frame formats accepted by the WebSocket ingest server.
+
+Legacy (v1) frame, 44 bytes, one sample:
+    16 bytes device UUID + 7 float32 (accel xyz, gyro xyz, battery)
+
+Multi-sample (v2) frame, 36-byte little-endian header followed by N samples:
+    2s  magic b'NT'
+    B   version (2)
+    B   flags (reserved, 0)
+    16s device UUID
+    I   sequence number
+    H   sample rate in Hz
+    H   sample count N (at least 1)
+    q   device base timestamp, microseconds since the Unix epoch (0 = unknown)
+    N x 7 float32 samples, same field order as the legacy frame
+
+A v2 frame is recognised by its magic and version, and its length must
+match the sample count; anything else of at least 44 bytes is decoded as a
+legacy frame, so old firmware keeps working.
+"""
+from collections import namedtuple
+from datetime import datetime
+from struct import Struct
+from uuid import UUID
+
+import numpy as np
+
+FRAME_MAGIC = b'NT'
+FRAME_VERSION = 2
+HEADER = Struct('<2sBB16sIHHq')
+LEGACY_FRAME_SIZE = 44
+
+SAMPLE_FIELDS = ('accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z', 'battery_level')
+SAMPLE_DTYPE = np.dtype([(name, '<f4') for name in SAMPLE_FIELDS])
+
+Frame = namedtuple('Frame', ['device_id', 'seq', 'sample_rate', 'base_ts', 'samples'])
+
+
+def decode_frame(data):
+    """
+    Decode a binary frame into a Frame whose ``samples`` is a structured
+    array viewing the frame buffer directly (no copy). Raises ValueError
+    for a malformed or empty frame.
+    """
+    if (len(data) >= HEADER.size and data[:2] == FRAME_MAGIC
+            and data[2] == FRAME_VERSION):
+        _, _, _, uuid_bytes, seq, rate, count, base_us = HEADER.unpack_from(data)
+        if len(data) != HEADER.size + count * SAMPLE_DTYPE.itemsize:
+            # Not a legacy frame either: its UUID would be the v2 header
+            raise ValueError("Frame length does not match sample count")
+        if not count:
+            raise ValueError("Frame carries no samples")
+        samples = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=count, offset=HEADER.size)
+        base_ts = datetime.utcfromtimestamp(base_us / 1e6) if base_us else None
+        return Frame(_parse_uuid(uuid_bytes), seq, rate, base_ts, samples)
+
+    if len(data) < LEGACY_FRAME_SIZE:
+        raise ValueError(f"Invalid binary packet size: {len(data)} bytes")
+
+    samples = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=1, offset=16)
+    return Frame(_parse_uuid(data[:16]), None, None, None, samples)
+
+
+def encode_frame(device_id, samples, seq=0, sample_rate=0, base_ts=None):
+    """
+    Build a v2 frame. ``samples`` is an (N, 7) float array or an array of
+    SAMPLE_DTYPE. Mainly used by tools and benchmarks that simulate devices.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype != SAMPLE_DTYPE:
+        samples = np.ascontiguousarray(samples, dtype='<f4').view(SAMPLE_DTYPE).reshape(-1)
+    base_us = int(base_ts.timestamp() * 1e6) if base_ts else 0
+    header = HEADER.pack(FRAME_MAGIC, FRAME_VERSION, 0, UUID(device_id).bytes,
+                         seq, sample_rate, len(samples), base_us)
+    return header + samples.tobytes()
+
+
+def sample_timestamps(frame, received_at):
+    """
+    Per-sample timestamps for a frame as a datetime64[us] array.
+    Samples are spaced by the frame's sample rate from the device base
+    timestamp, or back from ``received_at`` when the device has no clock.
+    """
+    count = len(frame.samples)
+    if count == 1 and frame.base_ts is None:
+        return np.array([received_at], dtype='datetime64[us]')
+
+    step_us = int(1e6 / frame.sample_rate) if frame.sample_rate else 0
+    offsets = np.arange(count, dtype=np.int64) * step_us
+    if frame.base_ts is not None:
+        start = np.datetime64(frame.base_ts, 'us')
+    else:
+        start = np.datetime64(received_at, 'us') - offsets[-1]
+    return start + offsets.astype('timedelta64[us]')
+
+
+def frame_rows(frame, timestamps):
+    """
+    Turn a decoded frame and its sample_timestamps into SensorData column
+    dicts for a bulk insert.
+    """
+    return sample_rows(frame.device_id, timestamps, frame.samples)
+
+
+def sample_rows(device_id, timestamps, samples):
+    """
+    SensorData column dicts for a SAMPLE_DTYPE array and its datetime64
+    timestamps. NaN (a missing JSON value) becomes NULL.
+    """
+    values = samples.tolist()
+    if any(np.isnan(samples[name]).any() for name in SAMPLE_FIELDS):
+        values = [tuple(None if v != v else v for v in row) for row in values]
+    return [
+        dict(zip(SAMPLE_FIELDS, row), device_id=device_id, timestamp=ts)
+        for row, ts in zip(values, timestamps.tolist())
+    ]
+
+
+def _parse_uuid(uuid_bytes):
+    try:
+        return str(UUID(bytes=bytes(uuid_bytes)))
+    except Exception as e:
+        raise ValueError(f"Failed to parse UUID: {e}")
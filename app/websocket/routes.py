@@ -1,11 +1,24 @@
 import json
 import asyncio
 import logging
+import time
+import numpy as np
 import websockets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from struct import unpack
-from uuid import UUID
-from ..models.models import db, Device, SensorData, User
+from flask import current_app
+from ..models.models import db, Device, User
+from ..devices.registry import device_registry, device_info
+from .acks import AckPolicy, parse_seq
+from .ingest_buffer import ingest_buffer
+from .journal import ingest_journal
+from .overload import overload_guard, POLICY_BACKPRESSURE
+from .metrics import ack_seconds, decode_seconds, errors_total, messages_total, samples_total
+from ..metrics.registry import registry
+from .protocol import SAMPLE_DTYPE, SAMPLE_FIELDS, decode_frame, frame_rows, sample_timestamps
+from .fanout import live_hub
+from ..parkinson.aggregator import shake_aggregator
+from ..parkinson.tremor import tremor_analyzer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,6 +26,36 @@ logger = logging.getLogger(__name__)
 
 connected_clients = set()
 
+registry.gauge('neurotrack_ingest_connected_clients', 'Open WebSocket connections',
+               lambda: len(connected_clients))
+registry.gauge('neurotrack_ingest_queue_depth', 'Sensor rows waiting to be written',
+               lambda: ingest_buffer.depth)
+registry.gauge('neurotrack_ingest_journal_lag_bytes', 'Journal bytes not yet loaded into the database',
+               lambda: ingest_journal.lag())
+registry.gauge('neurotrack_live_subscribers', 'Connected live dashboard subscribers',
+               lambda: live_hub.subscriber_count)
+registry.callback(
+    'neurotrack_ingest_shed_samples_total', 'Samples deferred, downsampled or dropped under overload',
+    'counter', ('device_id', 'reason'),
+    lambda: [((device_id, reason), count)
+             for reason, counts in (('deferred', overload_guard.deferred),
+                                    ('downsampled', overload_guard.downsampled),
+                                    ('dropped', overload_guard.dropped))
+             for device_id, count in list(counts.items())]
+)
+
+# All blocking database work for the ingest path runs on this thread, so the
+# event loop only handles framing and acks and one slow query can't stall
+# every connected device.
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest-db')
+
+async def run_db(func, *args):
+    """
+    Run a blocking database call on the ingest DB thread and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, func, *args)
+
 def get_first_user_id():
     """
     Helper function to get a valid user ID for auto-creating devices.
@@ -24,84 +67,173 @@ def get_first_user_id():
     logger.warning("No users found in the database for device auto-creation")
     return None
 
+def ensure_device(app, uuid):
+    """
+    Make sure a device row exists, auto-creating an ESP32 entry if needed.
+    Runs on the ingest DB thread; returns the device's DeviceInfo.
+    """
+    with app.app_context():
+        device = Device.query.get(uuid)
+        if not device:
+            logger.info(f"Creating new device with UUID: {uuid}")
+            device = Device(
+                id=uuid,
+                name=f"ESP32 Auto-created {uuid[:8]}",
+                device_type="ESP32",
+                user_id=get_first_user_id(),  # Helper function to get a valid user ID
+                created_at=datetime.utcnow(),
+                auto_created=True
+            )
+            db.session.add(device)
+            db.session.commit()
+        return device_info(device)
+
+def lookup_device(app, uuid):
+    """
+    Runs on the ingest DB thread; returns a DeviceInfo or None.
+    """
+    with app.app_context():
+        device = Device.query.get(uuid)
+        return device_info(device) if device else None
+
+async def resolve_device(uuid, auto_create=False):
+    """
+    Registry lookup for the ingest hot path. Only unknown devices go to the
+    database; whatever is found (or created) is cached in the registry.
+    """
+    info = device_registry.get(uuid)
+    if info is None:
+        loader = ensure_device if auto_create else lookup_device
+        info = await run_db(loader, current_app._get_current_object(), uuid)
+        if info is not None:
+            device_registry.put(info)
+    return info
+
+def json_float(data, key):
+    """
+    Read a numeric field from a JSON sample, rejecting values the database
+    would choke on at flush time.
+    """
+    value = data.get(key, 0.0)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {key}: {value!r}")
+
+async def queue_samples(device_id, rows):
+    """
+    Hand sensor rows to the write-behind buffer, subject to the overload
+    policy. Under backpressure, once the buffer has reached its
+    unflushed-rows limit, wait for a flush on the DB thread first; the
+    shedding policies leave flushing to the background flusher.
+    """
+    if device_registry.should_touch(device_id):
+        ingest_buffer.touch(device_id, datetime.utcnow())
+    rows = await overload_guard.admit(device_id, rows)
+    if rows:
+        ingest_buffer.add_many(device_id, rows)
+    # While the database is failing, retries are the flusher's job; an
+    # inline flush per frame would stall every connection behind it
+    if (ingest_buffer.is_full and overload_guard.policy == POLICY_BACKPRESSURE
+            and not ingest_buffer.last_flush_failed):
+        await run_db(ingest_buffer.flush)
+
+def journal_samples(device_id, timestamps, samples):
+    """
+    Append samples to the ingest journal; the device can be acked as soon
+    as this returns, and the journal consumer writes the rows.
+    """
+    if device_registry.should_touch(device_id):
+        ingest_buffer.touch(device_id, datetime.utcnow())
+    ingest_journal.append(device_id, timestamps, samples)
+
+
 async def register_device(websocket, path):
+    try:
+        acks = AckPolicy.from_path(websocket, path)
+    except ValueError as e:
+        await websocket.send(json.dumps({"status": "error", "message": str(e)}))
+        await websocket.close()
+        return
     connected_clients.add(websocket)
     logger.info(f"New client connected. Total clients: {len(connected_clients)}")
 
     try:
         async for message in websocket:
+            received = time.perf_counter()
+            is_binary = isinstance(message, bytes)
             try:
-                if isinstance(message, bytes):
-                    await process_binary_sensor_data(message)
-                    await websocket.send(json.dumps({"status": "success", "message": "Binary data received"}))
+                if is_binary:
+                    frame = await process_binary_sensor_data(message)
+                    await acks.ack(frame.seq, binary=True)
                 else:
                     data = json.loads(message)
-                    logger.info(f"Received JSON data: {data}")
+                    if data.get("type") == "hello":
+                        await websocket.send(acks.negotiate(data))
+                        continue
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Received JSON data: {data}")
+                    # A bad seq is rejected before the samples are queued,
+                    # so the error never refers to data that was stored
+                    seq = parse_seq(data.get("seq"))
                     await process_sensor_data(data)
-                    await websocket.send(json.dumps({"status": "success", "message": "Data received"}))
+                    await acks.ack(seq)
+                ack_seconds.observe(time.perf_counter() - received)
             except Exception as e:
+                errors_total.inc()
                 logger.error(f"Error processing message: {e}")
-                await websocket.send(json.dumps({"status": "error", "message": str(e)}))
+                await acks.nack(e, binary=is_binary)
+        await acks.flush()
     except websockets.exceptions.ConnectionClosed:
         logger.info("Client connection closed")
     finally:
+        acks.close()
         connected_clients.remove(websocket)
         logger.info(f"Client disconnected. Remaining clients: {len(connected_clients)}")
 
 
+def owned(device):
+    """
+    True if the device belongs to a real user. Auto-created devices are only
+    parked on the first user, so their samples must not land in that user's
+    Parkinson metrics until the device is assigned.
+    """
+    return device.user_id is not None and not device.auto_created
+
 async def process_binary_sensor_data(binary_data):
     """
-    Unpack binary data: 16 bytes UUID + 7 floats (28 bytes).
+    Decode a legacy single-sample frame or a v2 multi-sample frame
+    (see protocol.py) and queue its samples for a bulk insert.
+    Returns the decoded Frame.
     """
     try:
-        if len(binary_data) < 44:
-            raise ValueError(f"Invalid binary packet size: {len(binary_data)} bytes")
-
-        uuid_bytes = binary_data[:16]
-        try:
-            uuid = str(UUID(bytes=uuid_bytes))
-        except Exception as e:
-            raise ValueError(f"Failed to parse UUID: {e}")
-
-        # Unpack 7 floats from the next 28 bytes
-        float_data = unpack('7f', binary_data[16:44])
-        a_x, a_y, a_z, g_x, g_y, g_z, battery = float_data
-
-        logger.info(f"[BINARY] UUID: {uuid}, Accel: {a_x},{a_y},{a_z}, Gyro: {g_x},{g_y},{g_z}, Battery: {battery}")
-
-        from flask import current_app
-        with current_app.app_context():
-            device = Device.query.get(uuid)
-            
-            # Auto-create the device if it doesn't exist
-            if not device:
-                logger.info(f"Creating new device with UUID: {uuid}")
-                device = Device(
-                    id=uuid,
-                    name=f"ESP32 Auto-created {uuid[:8]}",
-                    device_type="ESP32",
-                    user_id=get_first_user_id(),  # Helper function to get a valid user ID
-                    created_at=datetime.utcnow()
-                )
-                db.session.add(device)
-            
-            # Update last_seen timestamp
-            device.last_seen = datetime.utcnow()
-                
-            # Add sensor data
-            sensor_data = SensorData(
-                device_id=uuid,
-                timestamp=datetime.utcnow(),
-                accel_x=a_x,
-                accel_y=a_y,
-                accel_z=a_z,
-                gyro_x=g_x,
-                gyro_y=g_y,
-                gyro_z=g_z,
-                battery_level=battery
-            )
-            db.session.add(sensor_data)
-            db.session.commit()
+        started = time.perf_counter()
+        frame = decode_frame(binary_data)
+        decode_seconds.observe(time.perf_counter() - started)
+        uuid = frame.device_id
+        messages_total.inc(uuid)
+        samples_total.inc(uuid, amount=len(frame.samples))
+
+        # Per-packet logging is debug only; formatting it costs more than decoding
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[BINARY] UUID: {uuid}, samples: {len(frame.samples)}, seq: {frame.seq}")
+
+        device = await resolve_device(uuid, auto_create=True)
+
+        timestamps = sample_timestamps(frame, datetime.utcnow())
+        live_hub.publish(uuid, timestamps, frame.samples)
+        if owned(device):
+            shake_aggregator.add(device.user_id, timestamps, frame.samples)
+        tremor_analyzer.add(uuid, timestamps, frame.samples, frame.sample_rate)
+
+        if ingest_journal.enabled:
+            journal_samples(uuid, timestamps, frame.samples)
+        else:
+            # Sensor rows and last_seen are written behind by the ingest buffer
+            await queue_samples(uuid, frame_rows(frame, timestamps))
+        return frame
     except Exception as e:
         logger.error(f"Error decoding binary sensor data: {e}")
         raise
@@ -116,26 +248,24 @@ async def process_sensor_data(data):
         if not uuid:
             raise ValueError("Missing device_id in JSON data")
 
-        from flask import current_app
-        with current_app.app_context():
-            device = Device.query.get(uuid)
-            if device:
-                device.last_seen = datetime.utcnow()
-                sensor_data = SensorData(
-                    device_id=uuid,
-                    timestamp=datetime.utcnow(),
-                    accel_x=data.get("accel_x", 0.0),
-                    accel_y=data.get("accel_y", 0.0),
-                    accel_z=data.get("accel_z", 0.0),
-                    gyro_x=data.get("gyro_x", 0.0),
-                    gyro_y=data.get("gyro_y", 0.0),
-                    gyro_z=data.get("gyro_z", 0.0),
-                    battery_level=data.get("battery_level", 0.0)
-                )
-                db.session.add(sensor_data)
-                db.session.commit()
+        device = await resolve_device(uuid)
+        if device:
+            messages_total.inc(uuid)
+            samples_total.inc(uuid)
+            now = datetime.utcnow()
+            row = {name: json_float(data, name) for name in SAMPLE_FIELDS}
+            timestamps = np.array([now], dtype='datetime64[us]')
+            samples = np.array([tuple(np.nan if v is None else v for v in row.values())], dtype=SAMPLE_DTYPE)
+            live_hub.publish(uuid, timestamps, samples)
+            if owned(device):
+                shake_aggregator.add(device.user_id, timestamps, samples)
+            tremor_analyzer.add(uuid, timestamps, samples)
+            if ingest_journal.enabled:
+                journal_samples(uuid, timestamps, samples)
             else:
-                logger.warning(f"Device with UUID {uuid} not found in JSON payload")
+                await queue_samples(uuid, [dict(row, device_id=uuid, timestamp=now)])
+        else:
+            logger.warning(f"Device with UUID {uuid} not found in JSON payload")
     except Exception as e:
         logger.error(f"Error processing JSON sensor data: {e}")
         raise
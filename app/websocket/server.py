@@ -1,31 +1,123 @@
 import asyncio
+import logging
+import signal
 import threading
 import websockets
 import os
+from urllib.parse import urlsplit
 
-from app.websocket.routes import register_device
+from app.websocket.routes import register_device, run_db
+from app.websocket.ingest_buffer import ingest_buffer
+from app.websocket.journal import ingest_journal
+from app.websocket.overload import overload_guard
+from app.websocket.fanout import handle_subscriber, live_hub
+from app.devices.registry import device_registry
+from app.parkinson.aggregator import shake_aggregator
+from app.parkinson.tremor import tremor_analyzer
+from app.websocket.metrics import tremor_windows_total
 
-def start_ws_server(app):
-    async def _serve():
+logger = logging.getLogger(__name__)
+
+def start_ws_server(app, host="0.0.0.0", port=8765, reuse_port=False, handle_signals=False):
+    """
+    Run the ingest WebSocket server on a fresh event loop until it is stopped.
+
+    ``reuse_port`` lets several worker processes bind the same port
+    (SO_REUSEPORT). With ``handle_signals`` (main thread only) SIGTERM and
+    SIGINT drain the server: stop accepting, close connections, flush.
+    """
+    device_registry.init_app(app)
+    device_registry.load()
+    ingest_buffer.init_app(app)
+    overload_guard.init_app(app)
+    live_hub.init_app(app)
+    shake_aggregator.init_app(app)
+    tremor_analyzer.init_app(app)
+    ingest_journal.init_app(app)
+    ingest_buffer.start()
+    if ingest_journal.enabled:
+        # Replays anything left from a previous run before new data
+        ingest_journal.open(ingest_buffer)
+
+    async def _refresh_registry(interval):
+        # Other processes (the REST API, other workers) change devices too
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_db(device_registry.load)
+            except Exception as e:
+                logger.error(f"Device registry refresh failed: {e}")
+
+    async def _save_shake_metrics(force=False):
+        rows = shake_aggregator.collect(force=force)
+        if rows:
+            await run_db(shake_aggregator.save, app, rows)
+
+    async def _shake_metrics_loop():
+        # Emit per-user per-minute shake metrics as minutes complete
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await _save_shake_metrics()
+            except Exception as e:
+                logger.error(f"Shake metric flush failed: {e}")
+
+    async def _tremor_loop():
+        # One batched FFT over every window completed since the last pass
+        while True:
+            await asyncio.sleep(app.config.get('TREMOR_ANALYSIS_INTERVAL', 0.5))
+            try:
+                results = tremor_analyzer.analyze()
+                tremor_windows_total.inc(amount=len(results))
+                for result in results:
+                    live_hub.publish_event(result['device_id'], dict(result, type='tremor'))
+            except Exception as e:
+                logger.error(f"Tremor analysis failed: {e}")
+
+    async def _serve(stop):
         async def wrapped_handler(websocket, path):
+            if urlsplit(path or '').path.rstrip('/') == '/live':
+                # Dashboards subscribing to live data; no database access
+                await handle_subscriber(websocket, path)
+                return
             # Push Flask app context here
             with app.app_context():
                 await register_device(websocket, path)
 
+        refresh_interval = app.config.get('DEVICE_REGISTRY_REFRESH', 0)
+        refresher = asyncio.ensure_future(_refresh_registry(refresh_interval)) if refresh_interval else None
+        shake_task = asyncio.ensure_future(_shake_metrics_loop())
+        tremor_task = asyncio.ensure_future(_tremor_loop()) if tremor_analyzer.enabled else None
+
         # Bind to all interfaces so ESP32 can connect
-        async with websockets.serve(wrapped_handler, "0.0.0.0", 8765):
-            print("WebSocket server started on port 8765")
-            await asyncio.Future()  # run forever
+        async with websockets.serve(wrapped_handler, host, port, reuse_port=reuse_port):
+            print(f"WebSocket server started on port {port} (pid {os.getpid()})")
+            await stop
+        # Leaving the block closed the listener and every open connection
+
+        if refresher:
+            refresher.cancel()
+        shake_task.cancel()
+        if tremor_task:
+            tremor_task.cancel()
+        await _save_shake_metrics(force=True)
 
     # Each thread needs its own event loop
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    stop = loop.create_future()
+    if handle_signals:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
     try:
-        loop.run_until_complete(_serve())
+        loop.run_until_complete(_serve(stop))
     except Exception as e:
         print(f"WebSocket server failure: {e}")
     finally:
         loop.close()
+        # Load what is left in the journal, then write out the ingest buffer
+        ingest_journal.close()
+        ingest_buffer.close()
 
 def launch_in_thread(app):
     t = threading.Thread(target=start_ws_server, args=(app,), daemon=True)
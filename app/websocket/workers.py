@@ -0,0 +1,143 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.metrics.registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port):
+    """
+    Serve this process's /metrics on its own port from a daemon thread.
+    Workers share the ingest port, so each needs a port of its own to be scraped.
+    """
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def run_worker(index, host, port, reuse_port):
+    """
+    Entry point of one ingest worker process: its own Flask app, event loop,
+    device registry and DB writer.
+    """
+    from app import create_app
+    from app.websocket.server import start_ws_server
+
+    app = create_app()
+    if app.config.get('INGEST_JOURNAL_DIR'):
+        # One journal per worker slot; a restarted worker replays its own
+        app.config['INGEST_JOURNAL_DIR'] = os.path.join(app.config['INGEST_JOURNAL_DIR'], f'worker-{index}')
+    metrics_port = app.config.get('INGEST_METRICS_PORT', 0)
+    if metrics_port:
+        serve_metrics(metrics_port + index)
+    start_ws_server(app, host, port, reuse_port=reuse_port, handle_signals=True)
+
+
+def serve_workers(workers, host="0.0.0.0", port=8765, drain_timeout=30,
+                  min_uptime=10, max_fast_failures=5, max_backoff=60):
+    """
+    Start ``workers`` ingest processes sharing one port through SO_REUSEPORT,
+    restart any that die, and drain them all on SIGTERM/SIGINT.
+
+    A worker that exits within ``min_uptime`` seconds of starting is
+    restarted after an exponential backoff (1 s doubling up to
+    ``max_backoff``); after ``max_fast_failures`` such exits in a row every
+    worker is stopped. Returns the exit status: 0 after a signal, 1 after
+    giving up.
+    """
+    reuse_port = workers > 1
+    if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+        logger.warning("SO_REUSEPORT is not available on this platform; starting a single worker")
+        workers, reuse_port = 1, False
+
+    ctx = multiprocessing.get_context('spawn')
+    procs = {}
+    started = {}
+    restart_at = {}
+    failures = dict.fromkeys(range(workers), 0)
+    stopping = False
+    status = 0
+
+    def start(index):
+        proc = ctx.Process(target=run_worker, args=(index, host, port, reuse_port),
+                           name=f'ingest-worker-{index}')
+        proc.start()
+        procs[index] = proc
+        started[index] = time.monotonic()
+
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    for index in range(workers):
+        start(index)
+    print(f"Started {workers} ingest worker(s) on port {port}")
+
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for index in list(restart_at):
+            if now >= restart_at[index] and not stopping:
+                del restart_at[index]
+                start(index)
+        for index, proc in list(procs.items()):
+            if proc.is_alive() or stopping:
+                continue
+            del procs[index]
+            if now - started[index] >= min_uptime:
+                failures[index] = 0
+                logger.warning(f"{proc.name} exited with code {proc.exitcode}; restarting")
+                start(index)
+                continue
+            failures[index] += 1
+            if failures[index] >= max_fast_failures:
+                logger.error(f"{proc.name} exited with code {proc.exitcode} within {min_uptime}s "
+                             f"of starting {failures[index]} times in a row; giving up")
+                stopping, status = True, 1
+                break
+            delay = min(2 ** (failures[index] - 1), max_backoff)
+            logger.warning(f"{proc.name} exited with code {proc.exitcode} shortly after starting; "
+                           f"restarting in {delay}s")
+            restart_at[index] = now + delay
+
+    # Graceful drain: each worker stops accepting, closes its connections
+    # and flushes its ingest buffer before exiting
+    for proc in procs.values():
+        if proc.is_alive():
+            os.kill(proc.pid, signal.SIGTERM)
+
+    deadline = time.monotonic() + drain_timeout
+    for proc in procs.values():
+        proc.join(max(0.0, deadline - time.monotonic()))
+    for proc in procs.values():
+        if proc.is_alive():
+            logger.warning(f"{proc.name} did not drain within {drain_timeout}s; killing it")
+            proc.kill()
+    print("Ingest workers stopped")
+    return status
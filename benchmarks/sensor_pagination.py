@@ -0,0 +1,103 @@
+"""
+Compare offset and keyset (cursor) paging on GET /devices/<id>/sensor-data.
+
+Fills a throwaway SQLite database with one device's samples at 50 Hz
+(as SensorData rows, or SensorChunk blocks with --storage chunks), then
+fetches one page at increasing depths both ways. Offset pages get slower
+with depth; keyset pages should take about the same time everywhere.
+
+Usage:
+    python benchmarks/sensor_pagination.py --rows 2000000 --page-size 100
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app  # noqa: E402
+from app.devices.chunks import CHUNK_COLUMNS, pack_columns  # noqa: E402
+from app.models.models import db, User, Device, SensorData, SensorChunk  # noqa: E402
+
+BATCH = 100000
+
+
+def populate(app, rows, storage):
+    with app.app_context():
+        db.create_all()
+        user = User(nume='bench', password='x', emails='bench@example.com')
+        db.session.add(user)
+        db.session.commit()
+        device = Device(name='bench', device_type='esp32', user_id=user.id)
+        db.session.add(device)
+        db.session.commit()
+
+        start = datetime(2025, 1, 1)
+        start_us = int((start - datetime(1970, 1, 1)).total_seconds() * 1e6)
+        for lo in range(0, rows, BATCH):
+            n = min(BATCH, rows - lo)
+            times_us = start_us + (lo + np.arange(n, dtype=np.int64)) * 20000
+            values = np.random.default_rng(lo).normal(size=(len(CHUNK_COLUMNS), n))
+            if storage == 'chunks':
+                records = pack_columns(device.id, times_us, dict(zip(CHUNK_COLUMNS, values)))
+                db.session.execute(SensorChunk.__table__.insert(), records)
+            else:
+                times = (times_us.astype('datetime64[us]')).tolist()
+                columns = [v.tolist() for v in values]
+                db.session.execute(SensorData.__table__.insert(), [
+                    dict(zip(CHUNK_COLUMNS, (c[i] for c in columns)), device_id=device.id, timestamp=times[i])
+                    for i in range(n)
+                ])
+            db.session.commit()
+        return device.id, start
+
+
+def timed(client, url, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        response = client.get(url)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.data
+    return statistics.median(samples), response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--storage', choices=('rows', 'chunks'), default='rows')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "bench.db")}',
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            'SECRET_KEY': 'bench',
+        })
+        started = time.perf_counter()
+        device_id, start = populate(app, args.rows, args.storage)
+        print(f"Loaded {args.rows} samples as {args.storage} in {time.perf_counter() - started:.1f}s")
+
+        client = app.test_client()
+        base = f'/devices/{device_id}/sensor-data?limit={args.page_size}'
+        print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+        for fraction in (0, 0.01, 0.1, 0.5, 0.9, 0.99):
+            depth = int(args.rows * fraction)
+            offset_s, offset_page = timed(client, f'{base}&offset={depth}', args.repeats)
+            # Cursor for the same position: the sample just newer than the page
+            cursor = (start + timedelta(microseconds=(args.rows - depth) * 20000)).isoformat()
+            keyset_s, keyset_page = timed(client, f'{base}&before={cursor}', args.repeats)
+            assert offset_page.json[0]['timestamp'] == keyset_page.json[0]['timestamp']
+            print(f"{depth:>10} {offset_s * 1000:>10.2f} {keyset_s * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
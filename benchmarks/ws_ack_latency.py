@@ -0,0 +1,116 @@
+"""
+Measure WebSocket ack latency as the number of concurrent clients grows.
+
+Starts the ingest server against a throwaway SQLite database, connects N
+simulated ESP32 clients that each send binary sensor frames in a
+send/wait-for-ack loop, and prints p50/p99 ack latency per concurrency
+level. If anything blocks the event loop, p99 climbs much faster than
+the client count does.
+
+Usage:
+    python benchmarks/ws_ack_latency.py --clients 1 10 50 100 200 --messages 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from struct import pack
+
+import numpy as np
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app  # noqa: E402
+from app.models.models import db, User  # noqa: E402
+from app.websocket.ingest_buffer import ingest_buffer  # noqa: E402
+from app.websocket.journal import ingest_journal  # noqa: E402
+from app.websocket.protocol import encode_frame  # noqa: E402
+from app.websocket.server import start_ws_server  # noqa: E402
+
+
+def make_app(db_path, journal_dir=''):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'bench',
+        'INGEST_JOURNAL_DIR': journal_dir,
+    })
+    with app.app_context():
+        db.create_all()
+        user = User(nume='bench', password='x', emails='bench@example.com')
+        db.session.add(user)
+        db.session.commit()
+    return app
+
+
+SAMPLE = (0.1, 0.2, 9.8, 0.01, 0.02, 0.03, 3.7)
+
+
+async def run_client(url, messages, samples_per_frame, latencies):
+    device_id = str(uuid.uuid4())
+    legacy_frame = uuid.UUID(device_id).bytes + pack('7f', *SAMPLE)
+    batch = np.tile(np.array(SAMPLE, dtype='<f4'), (samples_per_frame, 1))
+    async with websockets.connect(url) as ws:
+        for i in range(messages):
+            if samples_per_frame > 1:
+                frame = encode_frame(device_id, batch, seq=i, sample_rate=50)
+            else:
+                frame = legacy_frame
+            started = time.perf_counter()
+            await ws.send(frame)
+            await ws.recv()
+            latencies.append(time.perf_counter() - started)
+
+
+async def run_level(url, clients, messages, samples_per_frame):
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(url, messages, samples_per_frame, latencies)
+                           for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    ms = np.array(latencies) * 1000
+    return {
+        'clients': clients,
+        'acks': len(latencies),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'msgs_per_sec': len(latencies) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    parser.add_argument('--messages', type=int, default=200, help='frames sent per client')
+    parser.add_argument('--samples-per-frame', type=int, default=1,
+                        help='1 sends legacy 44-byte frames, more sends v2 multi-sample frames')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--journal', action='store_true',
+                        help='ack after the ingest journal append instead of the buffer')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'),
+                       os.path.join(tmp, 'journal') if args.journal else '')
+        server = threading.Thread(target=start_ws_server, args=(app, '127.0.0.1', args.port), daemon=True)
+        server.start()
+        time.sleep(1)
+
+        url = f'ws://127.0.0.1:{args.port}'
+        print(f"{'clients':>8} {'acks':>8} {'p50 ms':>8} {'p99 ms':>8} {'msg/s':>10}")
+        for clients in args.clients:
+            r = asyncio.run(run_level(url, clients, args.messages, args.samples_per_frame))
+            print(f"{r['clients']:>8} {r['acks']:>8} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['msgs_per_sec']:>10.0f}")
+
+        # Flush before the temporary database goes away
+        ingest_journal.close()
+        ingest_buffer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Add sensor_chunk table for columnar raw sample storage
+
+Revision ID: 3b1f6c2a9d10
+Revises: 
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6c2a9d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if exists('sensor_chunk'):
+        return
+    op.create_table(
+        'sensor_chunk',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.String(length=36), nullable=False),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('end_time', sa.DateTime(), nullable=False),
+        sa.Column('sample_count', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['device_id'], ['device.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sensor_chunk_device_start', 'sensor_chunk', ['device_id', 'start_time'], unique=False)
+    op.create_index('ix_sensor_chunk_device_end', 'sensor_chunk', ['device_id', 'end_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_sensor_chunk_device_end', table_name='sensor_chunk')
+    op.drop_index('ix_sensor_chunk_device_start', table_name='sensor_chunk')
+    op.drop_table('sensor_chunk')
@@ -0,0 +1,35 @@
+"""Add composite (owner, timestamp) indexes for time-series queries
+
+Revision ID: 8e4d2b7c1f35
+Revises: 3b1f6c2a9d10
+Create Date: 2026-10-18 20:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4d2b7c1f35'
+down_revision = '3b1f6c2a9d10'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_sensordata_device_timestamp', 'sensordata', ['device_id', 'timestamp']),
+    ('ix_parkinson_metric_user_timestamp', 'parkinson_metric', ['user_id', 'timestamp']),
+    ('ix_medication_log_user_timestamp', 'medication_log', ['user_id', 'timestamp']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        if exists(table) and not exists(table, index=name):
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,37 @@
+"""Flag devices auto-created by the WebSocket server
+
+Revision ID: a7c3e9f15d62
+Revises: f2b7d8a61c4e
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f15d62'
+down_revision = 'f2b7d8a61c4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if exists('device', column='auto_created'):
+        return
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.add_column(sa.Column('auto_created', sa.Boolean(), nullable=False, server_default=sa.false()))
+    # Devices the WebSocket server created before this flag existed
+    op.execute(
+        sa.text("UPDATE device SET auto_created = :flag WHERE name LIKE 'ESP32 Auto-created %'")
+        .bindparams(flag=True)
+    )
+
+
+def downgrade():
+    if not exists('device', column='auto_created'):
+        return
+    with op.batch_alter_table('device') as batch_op:
+        batch_op.drop_column('auto_created')
@@ -0,0 +1,36 @@
+"""Count the samples with a value per sensor_summary column
+
+Revision ID: b3d5f7a9c1e2
+Revises: e6f1a3c8b904
+Create Date: 2026-10-20 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d5f7a9c1e2'
+down_revision = 'e6f1a3c8b904'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z', 'battery_level']
+
+
+def upgrade():
+    if exists('sensor_summary', column='accel_x_count'):
+        return
+    with op.batch_alter_table('sensor_summary') as batch_op:
+        for name in COLUMNS:
+            batch_op.add_column(sa.Column(f'{name}_count', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    if not exists('sensor_summary', column='accel_x_count'):
+        return
+    with op.batch_alter_table('sensor_summary') as batch_op:
+        for name in COLUMNS:
+            batch_op.drop_column(f'{name}_count')
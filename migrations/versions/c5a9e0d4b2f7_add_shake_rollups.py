@@ -0,0 +1,43 @@
+"""Add minute/hour/day shake rollup tables
+
+Revision ID: c5a9e0d4b2f7
+Revises: 8e4d2b7c1f35
+Create Date: 2026-10-18 20:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a9e0d4b2f7'
+down_revision = '8e4d2b7c1f35'
+branch_labels = None
+depends_on = None
+
+TABLES = ['shake_rollup_minute', 'shake_rollup_hour', 'shake_rollup_day']
+
+
+def upgrade():
+    for name in TABLES:
+        if exists(name):
+            continue
+        op.create_table(
+            name,
+            sa.Column('user_id', sa.String(length=36), nullable=False),
+            sa.Column('bucket_start', sa.DateTime(), nullable=False),
+            sa.Column('metric_count', sa.Integer(), nullable=False),
+            sa.Column('total', sa.Float(), nullable=False),
+            sa.Column('min_value', sa.Float(), nullable=False),
+            sa.Column('max_value', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('user_id', 'bucket_start')
+        )
+    # Fill the new tables with `flask parkinson rollup-backfill`
+
+
+def downgrade():
+    for name in reversed(TABLES):
+        op.drop_table(name)
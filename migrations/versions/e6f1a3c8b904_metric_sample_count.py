@@ -0,0 +1,32 @@
+"""Count the samples behind streamed ParkinsonMetric minutes
+
+Revision ID: e6f1a3c8b904
+Revises: d91c4a6e2b58
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f1a3c8b904'
+down_revision = 'd91c4a6e2b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if exists('parkinson_metric', column='sample_count'):
+        return
+    with op.batch_alter_table('parkinson_metric') as batch_op:
+        batch_op.add_column(sa.Column('sample_count', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    if not exists('parkinson_metric', column='sample_count'):
+        return
+    with op.batch_alter_table('parkinson_metric') as batch_op:
+        batch_op.drop_column('sample_count')
@@ -0,0 +1,40 @@
+"""Add sensor_summary table for downsampled raw sensor data
+
+Revision ID: f2b7d8a61c4e
+Revises: c5a9e0d4b2f7
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.schema import exists
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7d8a61c4e'
+down_revision = 'c5a9e0d4b2f7'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z', 'battery_level']
+STATS = ['mean', 'min', 'max', 'rms']
+
+
+def upgrade():
+    if exists('sensor_summary'):
+        return
+    op.create_table(
+        'sensor_summary',
+        sa.Column('device_id', sa.String(length=36), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('bucket_seconds', sa.Integer(), nullable=False),
+        sa.Column('sample_count', sa.Integer(), nullable=False),
+        *[sa.Column(f'{name}_{stat}', sa.Float(), nullable=True) for name in COLUMNS for stat in STATS],
+        sa.ForeignKeyConstraint(['device_id'], ['device.id'], ),
+        sa.PrimaryKeyConstraint('device_id', 'bucket_start')
+    )
+
+
+def downgrade():
+    op.drop_table('sensor_summary')
@@ -0,0 +1,29 @@
+import argparse
+import os
+import sys
+
+from app.websocket.workers import serve_workers
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Standalone WebSocket ingest server")
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('INGEST_WORKERS', os.cpu_count() or 1)),
+                        help='number of worker processes (default: one per core)')
+    parser.add_argument('--host', default=os.getenv('INGEST_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('INGEST_PORT', 8765)))
+    parser.add_argument('--drain-timeout', type=float, default=30,
+                        help='seconds to wait for workers to flush on shutdown')
+    parser.add_argument('--replay', metavar='JOURNAL_DIR',
+                        help='load an orphaned ingest journal into the database and exit')
+    args = parser.parse_args()
+
+    if args.replay:
+        from app import create_app
+        from app.websocket.ingest_buffer import ingest_buffer
+        from app.websocket.journal import replay_journal
+
+        app = create_app()
+        ingest_buffer.init_app(app)
+        print(f"Loaded {replay_journal(args.replay, ingest_buffer, log=print)} samples")
+    else:
+        sys.exit(serve_workers(args.workers, args.host, args.port, args.drain_timeout))
@@ -0,0 +1,43 @@
+import pytest
+
+from app import create_app
+from app.models.models import db, User, Device
+from app.parkinson import dose_cache, response_cache, daily_series
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+    })
+    # Process-wide caches would otherwise carry results between tests
+    dose_cache.clear()
+    daily_series.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    user = User(id='user-1', nume='Test', password='x', emails='test@example.com')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def device(app, user):
+    device = Device(id='00000000-0000-0000-0000-000000000001', name='Wrist',
+                    device_type='ESP32', user_id=user.id)
+    db.session.add(device)
+    db.session.commit()
+    return device
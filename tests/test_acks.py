@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+import pytest
+
+from app.websocket.acks import AckPolicy, BINARY_ACK, KIND_ACK, parse_seq
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def _acks(socket):
+    return [BINARY_ACK.unpack(message)[1] for message in socket.sent]
+
+
+def test_ack_carries_the_highest_sequence_number():
+    socket = FakeSocket()
+    policy = AckPolicy(socket, encoding='binary', negotiated=True)
+
+    async def run():
+        for seq in (0, 2, 1, 2, 3):
+            await policy.ack(seq, binary=True)
+
+    asyncio.run(run())
+    assert _acks(socket) == [0, 2, 2, 2, 3]
+    assert BINARY_ACK.unpack(socket.sent[0])[0] == KIND_ACK
+
+
+def test_cumulative_ack_every_n_messages():
+    socket = FakeSocket()
+    policy = AckPolicy(socket, mode='cumulative', every=3, encoding='json', negotiated=True)
+
+    async def run():
+        for seq in (5, 7, 6, 8):
+            await policy.ack(seq)
+        await policy.flush()
+
+    asyncio.run(run())
+    assert [json.loads(message)['seq'] for message in socket.sent] == [7, 8]
+
+
+def test_legacy_clients_get_the_original_replies():
+    socket = FakeSocket()
+    asyncio.run(AckPolicy(socket).ack(binary=True))
+    assert json.loads(socket.sent[0]) == {"status": "success", "message": "Binary data received"}
+
+
+def test_bad_hello_leaves_the_policy_unchanged():
+    policy = AckPolicy(FakeSocket())
+    with pytest.raises(ValueError):
+        policy.negotiate({'ack': 'cumulative', 'ack_every': 'lots'})
+    assert (policy.mode, policy.every, policy.negotiated) == ('message', 1, False)
+
+
+@pytest.mark.parametrize('value, expected', [(None, None), (0, 0), (3.0, 3), ('12', 12)])
+def test_parse_seq(value, expected):
+    assert parse_seq(value) == expected
+
+
+@pytest.mark.parametrize('value', [True, -1, 1.5, 'x', [1]])
+def test_parse_seq_rejects(value):
+    with pytest.raises(ValueError):
+        parse_seq(value)
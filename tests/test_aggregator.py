@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+from app.models.models import db, ParkinsonMetric, ShakeRollupMinute, ShakeRollupDay
+from app.parkinson.aggregator import ShakeAggregator
+from app.parkinson.rollups import update_rollups
+
+MINUTE = datetime(2026, 1, 5, 10, 30)
+
+
+def minute_row(value, count, timestamp=MINUTE):
+    return {'id': f'm-{value}-{count}', 'user_id': 'user-1', 'timestamp': timestamp,
+            'shake_per_minute': value, 'sample_count': count}
+
+
+def stored():
+    return db.session.execute(
+        db.select(ParkinsonMetric).order_by(ParkinsonMetric.timestamp)).scalars().all()
+
+
+def test_late_bucket_merges_into_stored_minute(app, user):
+    aggregator = ShakeAggregator(app)
+    assert aggregator.save(app, [minute_row(2.0, 30)]) == 1
+    assert aggregator.save(app, [minute_row(5.0, 10)]) == 1
+
+    [metric] = stored()
+    assert metric.sample_count == 40
+    assert metric.shake_per_minute == pytest.approx((2.0 * 30 + 5.0 * 10) / 40)
+    assert (aggregator.metrics_written, aggregator.minutes_merged) == (1, 1)
+
+    for model in (ShakeRollupMinute, ShakeRollupDay):
+        [rollup] = model.query.all()
+        assert rollup.metric_count == 1
+        assert rollup.total == pytest.approx(metric.shake_per_minute)
+        assert rollup.min_value == rollup.max_value == pytest.approx(metric.shake_per_minute)
+
+
+def test_second_worker_merges_same_minute(app, user):
+    ShakeAggregator(app).save(app, [minute_row(1.0, 10)])
+    ShakeAggregator(app).save(app, [minute_row(3.0, 10), minute_row(4.0, 5, MINUTE.replace(minute=31))])
+
+    first, second = stored()
+    assert (first.shake_per_minute, first.sample_count) == (2.0, 20)
+    assert (second.shake_per_minute, second.sample_count) == (4.0, 5)
+    [day] = ShakeRollupDay.query.all()
+    assert (day.metric_count, day.total, day.min_value, day.max_value) == (2, 6.0, 2.0, 4.0)
+
+
+def test_duplicates_within_a_batch_are_combined(app, user):
+    aggregator = ShakeAggregator(app)
+    aggregator.save(app, [minute_row(1.0, 1), minute_row(4.0, 3)])
+    [metric] = stored()
+    assert (metric.shake_per_minute, metric.sample_count) == (3.25, 4)
+
+
+def test_posted_metrics_are_not_merged(app, user):
+    posted = {'id': 'posted', 'user_id': 'user-1', 'timestamp': MINUTE, 'shake_per_minute': 9.0}
+    db.session.execute(ParkinsonMetric.__table__.insert(), [posted])
+    update_rollups([posted])
+    db.session.commit()
+
+    ShakeAggregator(app).save(app, [minute_row(1.0, 10)])
+    assert sorted((m.shake_per_minute, m.sample_count) for m in stored()) == [(1.0, 10), (9.0, None)]
+    [rollup] = ShakeRollupMinute.query.all()
+    assert (rollup.metric_count, rollup.total) == (2, 10.0)
+
+
+def test_idle_timeout_from_config(app):
+    app.config['SHAKE_INGEST_IDLE_TIMEOUT'] = 5.0
+    assert ShakeAggregator(app).idle_timeout == 5.0
+    del app.config['SHAKE_INGEST_IDLE_TIMEOUT']
+    assert ShakeAggregator(app).idle_timeout == 65.0
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.devices.chunks import pack_rows, decode_chunk, repack_chunks, query_sample_columns
+from app.models.models import db, SensorChunk
+from app.websocket.ingest_buffer import IngestBuffer
+
+START = datetime(2025, 1, 1)
+
+
+def _rows(device_id, seconds):
+    return [dict(device_id=device_id, timestamp=START + timedelta(seconds=s), accel_x=float(s))
+            for s in seconds]
+
+
+def test_pack_and_decode_round_trip():
+    rows = _rows('d', [3, 1, 2, 61])
+    chunks = pack_rows('d', rows, 60)
+
+    assert [chunk['sample_count'] for chunk in chunks] == [3, 1]
+    first = decode_chunk(chunks[0]['start_time'], 3, chunks[0]['data'])
+    assert first['accel_x'].tolist() == [1.0, 2.0, 3.0]
+    assert np.all(np.isnan(first['gyro_x']))
+
+
+def test_flushes_within_a_period_are_merged_once_it_is_over(app, device):
+    app.config['SENSOR_STORAGE'] = 'chunks'
+    buffer = IngestBuffer(app)
+    for second in range(0, 50, 10):
+        buffer.add_many(device.id, _rows(device.id, [second, second + 1]))
+        buffer.flush()
+    assert db.session.query(SensorChunk).count() == 5
+
+    # Not merged while samples for the period may still be queued
+    assert buffer.merge_closed(now=START + timedelta(seconds=90)) == 0
+    assert buffer.merge_closed(now=START + timedelta(seconds=120)) == 4
+    chunk = db.session.query(SensorChunk).one()
+    assert chunk.sample_count == 10
+    samples = decode_chunk(chunk.start_time, chunk.sample_count, chunk.data)
+    assert samples['accel_x'].tolist() == [0, 1, 10, 11, 20, 21, 30, 31, 40, 41]
+
+
+def test_repack_merges_leftover_partial_chunks(app, device):
+    chunks = pack_rows(device.id, _rows(device.id, [5, 65]), 60) + pack_rows(device.id, _rows(device.id, [1, 70]), 60)
+    db.session.execute(SensorChunk.__table__.insert(), chunks)
+    db.session.commit()
+    before = query_sample_columns(device.id, 10, after=(START - timedelta(seconds=1), None, None))
+
+    # The second minute is still open at this time
+    assert repack_chunks(device.id, before=START + timedelta(seconds=100), log=lambda *a: None) == 1
+    assert db.session.query(SensorChunk).count() == 3
+    assert repack_chunks(device.id, log=lambda *a: None) == 1
+    assert db.session.query(SensorChunk).count() == 2
+
+    after = query_sample_columns(device.id, 10, after=(START - timedelta(seconds=1), None, None))
+    assert after['t'].tolist() == before['t'].tolist()
+    assert after['accel_x'].tolist() == [1.0, 5.0, 65.0, 70.0]
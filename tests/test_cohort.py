@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.models import db, User, ParkinsonMetric, MedicationLog
+from app.parkinson import cohort
+from app.parkinson.cohort import cohort_report
+from app.parkinson.rollups import update_rollups
+
+START = datetime(2026, 1, 5)
+
+
+@pytest.fixture
+def patients(app, user):
+    db.session.add(User(id='user-2', nume='Second', password='x', emails='second@example.com'))
+    rows = []
+    for n, user_id in enumerate(('user-1', 'user-2')):
+        for i in range(3 * 24 * 12):
+            rows.append({'id': f'{user_id}-{i}', 'user_id': user_id,
+                         'timestamp': START + timedelta(minutes=5 * i, seconds=n * 20),
+                         'shake_per_minute': float((i * (n + 3)) % 11)})
+    db.session.execute(ParkinsonMetric.__table__.insert(), rows)
+    update_rollups(rows)
+    for user_id, hours in (('user-1', (8, 20, 32)), ('user-2', (9.5, 50)), ('user-1', (0,))):
+        for hour in hours:
+            db.session.add(MedicationLog(user_id=user_id, timestamp=START + timedelta(hours=hour, seconds=15)))
+    db.session.commit()
+
+
+def test_cohort_without_sql_date_arithmetic(patients, monkeypatch):
+    args = (['user-1', 'user-2', 'user-3'], START, START + timedelta(days=3))
+    expected = cohort_report(*args)
+    assert any(row[8] for row in expected['rows'])
+    monkeypatch.setattr(cohort, '_shift', lambda column, seconds: None)
+    report = cohort_report(*args)
+    assert report['columns'] == expected['columns']
+    for row, want in zip(report['rows'], expected['rows']):
+        assert row == pytest.approx(want)
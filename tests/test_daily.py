@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.models.models import db, ParkinsonMetric
+from app.parkinson import daily_series
+from app.parkinson.rollups import update_rollups
+
+NOW = datetime(2026, 3, 10, 12)
+
+
+def write(user_id, timestamp, value, commit=True):
+    row = {'id': f'{user_id}-{timestamp.isoformat()}-{value}', 'user_id': user_id,
+           'timestamp': timestamp, 'shake_per_minute': value}
+    db.session.execute(ParkinsonMetric.__table__.insert(), [row])
+    update_rollups([row])
+    if commit:
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+
+def test_daily_series_sees_late_write_after_commit(app, user):
+    write('user-1', NOW - timedelta(days=2), 2.0)
+    days, values = daily_series.get('user-1', now=NOW)
+    assert values.tolist() == [2.0]
+    assert len(daily_series) == 1
+
+    write('user-1', NOW - timedelta(days=2, hours=1), 4.0)
+    days, values = daily_series.get('user-1', now=NOW)
+    assert days.tolist() == [np.datetime64('2026-03-08', 'D').item()]
+    assert values.tolist() == [3.0]
+
+
+def test_daily_series_keeps_entry_on_rollback(app, user):
+    write('user-1', NOW - timedelta(days=3), 1.0)
+    daily_series.get('user-1', now=NOW)
+    write('user-1', NOW - timedelta(days=3), 9.0, commit=False)
+    assert 'daily_series_days' not in db.session.info
+    assert daily_series.get('user-1', now=NOW)[1].tolist() == [1.0]
+    assert len(daily_series) == 1
@@ -0,0 +1,75 @@
+import threading
+from datetime import datetime, timedelta
+
+from app.models.models import db, SensorData, SensorChunk
+from app.websocket.ingest_buffer import IngestBuffer
+
+
+def _rows(device_id, count, start=datetime(2025, 1, 1)):
+    return [dict(device_id=device_id, timestamp=start + timedelta(seconds=i), accel_x=float(i))
+            for i in range(count)]
+
+
+def _buffer(app, **config):
+    app.config.update(config)
+    return IngestBuffer(app)
+
+
+def test_bad_row_is_dropped_and_the_rest_written(app, device):
+    buffer = _buffer(app)
+    rows = _rows(device.id, 4)
+    buffer.add_many(device.id, rows[:2] + [dict(rows[0], timestamp='not a date')] + rows[2:])
+
+    assert buffer.flush() == 4
+    assert buffer.rows_rejected == 1
+    assert buffer.depth == 0
+    assert db.session.query(SensorData).count() == 4
+
+
+def test_unpackable_row_in_chunk_mode_goes_through_the_fallback(app, device):
+    buffer = _buffer(app, SENSOR_STORAGE='chunks')
+    rows = _rows(device.id, 4)
+    buffer.add_many(device.id, rows[:2] + [dict(rows[0], timestamp='not a date')] + rows[2:])
+
+    assert buffer.flush() == 4
+    assert buffer.rows_rejected == 1
+    assert buffer.depth == 0
+    assert db.session.query(db.func.sum(SensorChunk.sample_count)).scalar() == 4
+
+
+def test_rows_are_kept_while_the_database_is_unavailable(app, device):
+    buffer = _buffer(app)
+    buffer.add_many(device.id, _rows(device.id, 3))
+    SensorData.__table__.drop(db.engine)
+
+    assert buffer.flush() == 0
+    assert buffer.depth == 3
+    assert buffer.last_flush_failed
+
+    SensorData.__table__.create(db.engine)
+    assert buffer.flush() == 3
+    assert not buffer.last_flush_failed
+    assert db.session.query(SensorData).count() == 3
+
+
+def test_flusher_thread_survives_a_failing_flush(app):
+    buffer = _buffer(app, INGEST_FLUSH_INTERVAL=0.01)
+    calls = []
+    failed = threading.Event()
+
+    def flush():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        failed.set()
+        return 0
+
+    buffer.flush = flush
+    buffer.start()
+    try:
+        assert failed.wait(2)
+        assert buffer._thread.is_alive()
+    finally:
+        buffer._stopping.set()
+        buffer._wakeup.set()
+        buffer._thread.join()
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.models import db, ParkinsonMetric
+from app.parkinson import dose_cache
+from app.parkinson.rollups import update_rollups
+
+NOW = datetime(2026, 3, 10, 12)
+
+
+def write(user_id, timestamp, value, commit=True):
+    row = {'id': f'{user_id}-{timestamp.isoformat()}-{value}', 'user_id': user_id,
+           'timestamp': timestamp, 'shake_per_minute': value}
+    db.session.execute(ParkinsonMetric.__table__.insert(), [row])
+    update_rollups([row])
+    if commit:
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+
+def test_dose_cache_invalidated_on_commit_only(app, user):
+    dose = NOW - timedelta(hours=5)
+    key = ('user-1', dose, timedelta(minutes=30), timedelta(minutes=90))
+    dose_cache.put(key, {'delta': 1.0})
+
+    write('user-1', dose + timedelta(hours=3), 5.0)
+    assert dose_cache.get(key) == {'delta': 1.0}
+
+    write('user-1', dose + timedelta(minutes=10), 5.0, commit=False)
+    assert dose_cache.get(key) == {'delta': 1.0}
+
+    write('user-1', dose + timedelta(minutes=10), 5.0)
+    with pytest.raises(KeyError):
+        dose_cache.get(key)
+
+
+def test_dose_cache_drops_result_computed_across_invalidation(app):
+    dose = NOW - timedelta(hours=5)
+    key = ('user-1', dose, timedelta(minutes=30), timedelta(minutes=90))
+    generation = dose_cache.generation('user-1')
+    dose_cache.invalidate('user-1', dose, dose)
+    dose_cache.put(key, {'delta': 1.0}, generation)
+    with pytest.raises(KeyError):
+        dose_cache.get(key)
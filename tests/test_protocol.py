@@ -0,0 +1,52 @@
+import struct
+from datetime import datetime, timedelta
+from uuid import UUID
+
+import numpy as np
+import pytest
+
+from app.websocket.protocol import (
+    SAMPLE_DTYPE, decode_frame, encode_frame, sample_timestamps, frame_rows
+)
+
+DEVICE = '12345678-1234-5678-1234-567812345678'
+
+
+def _samples(count):
+    return np.arange(count * 7, dtype='<f4').reshape(count, 7)
+
+
+def test_legacy_frame():
+    frame = decode_frame(UUID(DEVICE).bytes + struct.pack('<7f', *range(7)))
+    assert frame.device_id == DEVICE
+    assert frame.seq is None
+    assert frame.samples['gyro_z'].tolist() == [5.0]
+
+
+def test_v2_round_trip():
+    base = datetime(2025, 1, 1, 12)
+    frame = decode_frame(encode_frame(DEVICE, _samples(3), seq=7, sample_rate=50, base_ts=base))
+    assert (frame.device_id, frame.seq, frame.sample_rate, frame.base_ts) == (DEVICE, 7, 50, base)
+    assert frame.samples['accel_x'].tolist() == [0.0, 7.0, 14.0]
+
+    timestamps = sample_timestamps(frame, datetime(2030, 1, 1))
+    assert timestamps.tolist() == [base, base + timedelta(milliseconds=20), base + timedelta(milliseconds=40)]
+    assert frame_rows(frame, timestamps)[1]['accel_x'] == 7.0
+
+
+def test_timestamps_count_back_from_arrival_without_a_device_clock():
+    received = datetime(2025, 1, 1, 12)
+    frame = decode_frame(encode_frame(DEVICE, _samples(2), sample_rate=10))
+    assert sample_timestamps(frame, received).tolist() == [received - timedelta(milliseconds=100), received]
+
+
+@pytest.mark.parametrize('data, message', [
+    (encode_frame(DEVICE, np.zeros(0, dtype=SAMPLE_DTYPE)), 'no samples'),
+    # Long enough to pass for a legacy frame, but the header says 3 samples
+    (encode_frame(DEVICE, _samples(3))[:-28], 'does not match'),
+    (encode_frame(DEVICE, _samples(1)) + b'\0', 'does not match'),
+    (b'\0' * 43, 'Invalid binary packet size'),
+])
+def test_malformed_frames_are_rejected(data, message):
+    with pytest.raises(ValueError, match=message):
+        decode_frame(data)
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app import create_app
+from app.devices.chunks import CHUNK_COLUMNS
+from app.devices.retention import compactor, summarize_samples, _merge, _write_summaries
+from app.models.models import db, SensorSummary
+
+T0 = int((datetime(2026, 1, 5, 10) - datetime(1970, 1, 1)).total_seconds() * 1e6)
+
+
+def columns(values):
+    return {name: np.array(values, dtype=np.float64) for name in CHUNK_COLUMNS}
+
+
+def test_merge_weights_by_valid_samples():
+    # Second half of the bucket has two samples, one missing the value
+    times = T0 + np.arange(4) * 1_000_000
+    values = [1.0, 1.0, 4.0, np.nan]
+    whole = summarize_samples('d', times, columns(values), 60)[0]
+    first = summarize_samples('d', times[:2], columns(values[:2]), 60)[0]
+    second = summarize_samples('d', times[2:], columns(values[2:]), 60)[0]
+
+    merged = _merge(first, second)
+    assert merged['sample_count'] == 4
+    assert merged['accel_x_count'] == 3
+    assert merged['accel_x_mean'] == pytest.approx(whole['accel_x_mean']) == pytest.approx(2.0)
+    assert merged['accel_x_rms'] == pytest.approx(whole['accel_x_rms'])
+    assert (merged['accel_x_min'], merged['accel_x_max']) == (1.0, 4.0)
+
+
+def test_merge_with_empty_column():
+    times = T0 + np.arange(2) * 1_000_000
+    first = summarize_samples('d', times[:1], columns([np.nan]), 60)[0]
+    second = summarize_samples('d', times[1:], columns([3.0]), 60)[0]
+    for merged in (_merge(first, second), _merge(second, first)):
+        assert (merged['gyro_z_mean'], merged['gyro_z_count'], merged['sample_count']) == (3.0, 1, 2)
+
+
+def test_merge_into_summary_without_counts():
+    old = summarize_samples('d', np.array([T0]), columns([2.0]), 60)[0]
+    for name in CHUNK_COLUMNS:
+        old[f'{name}_count'] = None
+    old['sample_count'] = 3
+    new = summarize_samples('d', np.array([T0 + 1]), columns([6.0]), 60)[0]
+    merged = _merge(old, new)
+    assert (merged['accel_y_mean'], merged['accel_y_count']) == (3.0, 4)
+
+
+def test_split_batches_store_merged_summary(app, device):
+    times = T0 + np.arange(6) * 1_000_000
+    values = [1.0, np.nan, np.nan, 5.0, 6.0, np.nan]
+    _write_summaries(summarize_samples(device.id, times[:3], columns(values[:3]), 60))
+    _write_summaries(summarize_samples(device.id, times[3:], columns(values[3:]), 60))
+    db.session.commit()
+
+    [summary] = SensorSummary.query.all()
+    assert (summary.sample_count, summary.battery_level_count) == (6, 3)
+    assert summary.battery_level_mean == pytest.approx(4.0)
+
+
+def test_compactor_starts_with_first_request(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(compactor, 'start', lambda: started.append(True))
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'c.db'}",
+                      'SENSOR_COMPACT_INTERVAL': 3600})
+    assert not started
+    app.test_client().get('/')
+    app.test_client().get('/')
+    assert started == [True, True]
+    assert compactor.interval == 3600
+
+
+def test_compactor_not_started_without_interval(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(compactor, 'start', lambda: started.append(True))
+    for config in ({}, {'SENSOR_COMPACT_INTERVAL': 3600, 'TESTING': True}):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'c.db'}", **config})
+        app.test_client().get('/')
+    assert not started
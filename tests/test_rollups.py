@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.models.models import db, ParkinsonMetric
+from app.parkinson import rollups
+from app.parkinson.rollups import update_rollups, shake_series
+
+START = datetime(2026, 1, 5)
+
+
+@pytest.fixture
+def metrics(app, user):
+    rows = [
+        {'id': f'm{i}', 'user_id': 'user-1', 'timestamp': START + timedelta(seconds=37 * i),
+         'shake_per_minute': float(i % 7)}
+        for i in range(500)
+    ]
+    db.session.execute(ParkinsonMetric.__table__.insert(), rows)
+    update_rollups(rows)
+    db.session.commit()
+    return rows
+
+
+def assert_same(left, right):
+    assert left.keys() == right.keys()
+    for key in left:
+        np.testing.assert_allclose(left[key], right[key])
+
+
+@pytest.mark.parametrize('step, start, end', [
+    (300, None, None),                                   # grouped minute rollups
+    (7200, START, START + timedelta(hours=4)),           # grouped hour rollups
+    (120, START + timedelta(seconds=30), None),          # raw metrics
+])
+def test_python_buckets_match_sql(metrics, monkeypatch, step, start, end):
+    expected = shake_series('user-1', step, start, end)
+    assert len(expected['t'])
+    monkeypatch.setattr(rollups, '_bucket_index', lambda column, step_seconds: None)
+    assert_same(shake_series('user-1', step, start, end), expected)
+
+
+def test_python_buckets_empty_range(metrics, monkeypatch):
+    monkeypatch.setattr(rollups, '_bucket_index', lambda column, step_seconds: None)
+    series = shake_series('user-1', 300, START - timedelta(days=2), START - timedelta(days=1))
+    assert all(len(values) == 0 for values in series.values())
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.devices.chunks import (
+    pack_rows, query_sample_columns, iter_samples, sample_cursor, parse_cursor
+)
+from app.models.models import db, SensorData, SensorChunk
+
+START = datetime(2025, 1, 1)
+
+
+@pytest.fixture
+def samples(app, device):
+    """
+    Rows and chunked samples interleaved, with several of each sharing
+    timestamps, across two chunk periods.
+    """
+    seconds = [0, 0, 0, 1, 1, 30, 59, 60, 60, 61]
+    rows = [dict(device_id=device.id, timestamp=START + timedelta(seconds=s), accel_x=float(i))
+            for i, s in enumerate(seconds)]
+    db.session.execute(SensorData.__table__.insert(), rows[::2])
+    db.session.execute(SensorChunk.__table__.insert(), pack_rows(device.id, rows[1::2], 60))
+    db.session.execute(SensorChunk.__table__.insert(), pack_rows(device.id, [
+        dict(device_id=device.id, timestamp=START + timedelta(seconds=0), accel_x=100.0),
+        dict(device_id=device.id, timestamp=START + timedelta(seconds=60), accel_x=101.0),
+    ], 60))
+    db.session.commit()
+    return device.id
+
+
+def key(sample):
+    return int(sample['t']), int(sample['id']), int(sample['chunk']), int(sample['pos'])
+
+
+def page_through(device_id, size, direction, cursor=None):
+    seen = []
+    while True:
+        page = query_sample_columns(device_id, size, **({direction: parse_cursor(cursor)} if cursor else {}))
+        seen += [key(sample) for sample in page]
+        if len(page) < size:
+            return seen
+        cursor = sample_cursor(page[-1])
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5])
+def test_before_pages_cover_everything_once(samples, size):
+    everything = [key(sample) for sample in query_sample_columns(samples, 100)]
+    assert len(everything) == 12
+    assert page_through(samples, size, 'before') == everything
+
+
+@pytest.mark.parametrize('size', [1, 4])
+def test_after_pages_run_oldest_first(samples, size):
+    everything = [key(sample) for sample in query_sample_columns(samples, 100)][::-1]
+    first = query_sample_columns(samples, size, after=(START - timedelta(seconds=1), None, None))
+    cursor = sample_cursor(first[-1])
+    rest = page_through(samples, size, 'after', cursor)
+    assert [key(sample) for sample in first] + rest == everything
+
+
+def test_bare_timestamp_cursor_matches_on_time(samples):
+    older = query_sample_columns(samples, 100, before=parse_cursor('2025-01-01T00:01:00Z'))
+    assert older['t'].max() < query_sample_columns(samples, 1)['t'][0]
+    assert len(older) == 8
+
+
+def test_iter_samples_matches_one_page(samples):
+    everything = query_sample_columns(samples, 100)
+    streamed = list(iter_samples(samples, page_size=2))
+    assert [item['accel_x'] for item in streamed] == everything['accel_x'].tolist()
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2025-01-01T00:00:00~7', (START, 7, None)),
+    ('2025-01-01T00:00:00~c3.12', (START, None, (3, 12))),
+    ('2025-01-01T01:00:00+01:00', (START, None, None)),
+])
+def test_parse_cursor(value, expected):
+    assert parse_cursor(value) == expected
+
+
+@pytest.mark.parametrize('value', ['', 'yesterday', '2025-01-01T00:00:00~x', '2025-01-01T00:00:00~c3'])
+def test_parse_cursor_rejects(value):
+    with pytest.raises(ValueError):
+        parse_cursor(value)
+
+
+def test_route_pages_with_next_cursor(client, samples):
+    seen, cursor = [], None
+    while True:
+        url = f'/devices/{samples}/sensor-data?limit=5' + (f'&before={cursor}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200
+        seen += [item['accel_x'] for item in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+    assert len(seen) == 12 and len(set(seen)) == 12
+    assert client.get(f'/devices/{samples}/sensor-data?before=nonsense').status_code == 400